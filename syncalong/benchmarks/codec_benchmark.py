@@ -0,0 +1,51 @@
+"""
+Compare the time it takes to encode and decode messages with the struct-based codec (`GeneralPacket`) against
+scapy (`scapy_view`, the codec used before). Both produce the same bytes.
+
+Usage: python benchmarks/codec_benchmark.py [repetitions]
+"""
+import dataclasses
+import sys
+import time
+
+from syncalong.common import scapy_view
+from syncalong.common.file_sync_packet import FileSyncPacket, FILE_SEND
+from syncalong.common.general_packet import GeneralPacket
+from syncalong.common.length_socket import build_packet
+from syncalong.common.signal_packet import SignalPacket, PLAY_SIGNAL
+
+PACKETS = {
+    "SignalPacket": SignalPacket(signal=PLAY_SIGNAL, send_timestamp=time.time(), seq=1, music_file_name="Ring05.wav"),
+    "FileSyncPacket": FileSyncPacket(message_type=FILE_SEND, file_name="Ring05.wav", file_size=1132740,
+                                     file_hash="ab" * 32, codecs="zstd,zlib", content_size=832725),
+}
+
+
+def measure(action, repetitions: int) -> float:
+    """
+    Microseconds per call of the given action.
+    """
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        action()
+    return (time.perf_counter() - start) / repetitions * 1e6
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, packet in PACKETS.items():
+        data = build_packet(packet)
+        scapy_packet = getattr(scapy_view, name)(**dataclasses.asdict(packet))
+        assert scapy_view.build(scapy_packet) == data
+
+        encode = measure(lambda: build_packet(packet), repetitions)
+        decode = measure(lambda: GeneralPacket(data)[type(packet)], repetitions)
+        scapy_encode = measure(lambda: scapy_view.build(scapy_packet), repetitions // 10)
+        scapy_decode = measure(lambda: scapy_view.dissect(data)[type(scapy_packet)], repetitions // 10)
+        print(f"{name} ({len(data)} bytes):")
+        print(f"  encode: {encode:8.2f} us, scapy {scapy_encode:8.2f} us ({scapy_encode / encode:5.1f}x)")
+        print(f"  decode: {decode:8.2f} us, scapy {scapy_decode:8.2f} us ({scapy_decode / decode:5.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
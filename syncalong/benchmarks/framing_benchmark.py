@@ -0,0 +1,43 @@
+"""
+Measure the rate of receiving small messages with `LengthSocket.recv`, when the sender sends them as fast as it can.
+
+Usage: python benchmarks/framing_benchmark.py [messages]
+"""
+import socket
+import sys
+import threading
+import time
+
+from syncalong.common.length_socket import LengthSocket, build_packet
+from syncalong.common.signal_packet import SignalPacket
+
+
+def connected_pair():
+    listener = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sender = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
+    sender.connect(listener.getsockname())
+    receiver, _ = listener.accept()
+    listener.close()
+    return sender, receiver
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    data = build_packet(SignalPacket(seq=1, music_file_name="Ring05.wav"))
+    message = len(data).to_bytes(4, 'big') + data
+    sender, receiver = connected_pair()
+    threading.Thread(target=sender.sendall, args=(message * count,), daemon=True).start()
+
+    start = time.perf_counter()
+    for _ in range(count):
+        assert receiver.recv() == data
+    elapsed = time.perf_counter() - start
+    print(f"{count} messages of {len(message)} bytes: {count / elapsed:,.0f} messages/s")
+    sender.close()
+    receiver.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Measure the amount of requests a second `NTPServer` answers, when several client processes send it requests as fast
+as they can (each keeping a window of requests in flight).
+
+Usage: python benchmarks/ntp_benchmark.py [seconds] [client processes] [server workers]
+"""
+import multiprocessing
+import socket
+import sys
+import time
+
+from syncalong.server.ntp_server import NTPServer, NTP_WORKERS
+
+NTP_REQUEST = b"\x23" + bytes(47)
+WINDOW = 16
+
+
+def run_client(port: int, seconds: float, results):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(('127.0.0.1', port))
+    sock.settimeout(0.2)
+    answered = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(WINDOW):
+            sock.send(NTP_REQUEST)
+        try:
+            for _ in range(WINDOW):
+                sock.recv(1024)
+                answered += 1
+        except socket.timeout:
+            pass
+    sock.close()
+    results.put(answered)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else NTP_WORKERS
+    server = NTPServer('127.0.0.1', 0, workers)
+    server.start()
+    port = server.address[1]
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_client, args=(port, seconds, results)) for _ in range(clients)]
+    for process in processes:
+        process.start()
+    answered = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    server.close()
+    print(f"{clients} clients, {workers} workers for {seconds} seconds: {answered / seconds:,.0f} requests/s")
+
+
+if __name__ == '__main__':
+    main()
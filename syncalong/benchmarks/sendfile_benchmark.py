@@ -0,0 +1,79 @@
+"""
+Compare the throughput of sending a song in chunks (read into memory chunk by chunk, then sent)
+against `LengthSocket.send_file` (sent by the OS straight from the page cache).
+
+Usage: python benchmarks/sendfile_benchmark.py [file size in MB] [repetitions]
+"""
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from syncalong.common.file_sync_packet import FILE_CHUNK_SIZE
+from syncalong.common.length_socket import LengthSocket
+
+
+def drain(conn: socket.socket, total: int):
+    received = 0
+    while received < total:
+        data = conn.recv(1024 * 1024)
+        if not data:
+            break
+        received += len(data)
+
+
+def connected_pair():
+    listener = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sender = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
+    sender.connect(listener.getsockname())
+    receiver, _ = listener.accept()
+    listener.close()
+    return sender, receiver
+
+
+def send_chunks(sock: LengthSocket, file_path: str):
+    with open(file_path, 'rb') as file_to_send:
+        for chunk in iter(lambda: file_to_send.read(FILE_CHUNK_SIZE), b""):
+            sock.sendall(chunk)
+
+
+def send_zero_copy(sock: LengthSocket, file_path: str):
+    sock.send_file(file_path)
+
+
+def measure(send_func, file_path: str, repetitions: int) -> float:
+    size = os.path.getsize(file_path)
+    best = None
+    for _ in range(repetitions):
+        sender, receiver = connected_pair()
+        drain_thread = threading.Thread(target=drain, args=(receiver, size))
+        drain_thread.start()
+        start = time.perf_counter()
+        send_func(sender, file_path)
+        drain_thread.join()
+        elapsed = time.perf_counter() - start
+        sender.close()
+        receiver.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return size / best / 2 ** 20
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as song:
+        song.write(os.urandom(size_mb * 2 ** 20))
+    try:
+        print(f"Sending a {size_mb} MB file over loopback, best of {repetitions}")
+        for name, send_func in [("chunked send", send_chunks), ("send_file", send_zero_copy)]:
+            print(f"{name:>12}: {measure(send_func, song.name, repetitions):8.1f} MB/s")
+    finally:
+        os.remove(song.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Measure the startup time of every mode of `python -m syncalong`: the time to import the mode's module (from
+`-X importtime`), the modules that took the longest to import, and the wall time of a fresh interpreter importing it.
+
+Usage: python benchmarks/startup_benchmark.py [runs]
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+MODES = {
+    "client": "syncalong.main.client_main",
+    "server": "syncalong.main.server_main",
+    "loadgen": "syncalong.main.loadgen_main",
+    "skew": "syncalong.main.skew_main",
+}
+SLOWEST_IMPORTS = 5
+
+
+def import_times(module):
+    """
+    Import the module in a fresh interpreter with `-X importtime`.
+
+    :return: The wall time of the interpreter in seconds, and {module: cumulative import time in seconds} of every
+             module it imported, or None if the import failed.
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode:
+        return wall, None
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return wall, times
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    baseline = statistics.median(import_times("sys")[0] for _ in range(runs))
+    print(f"interpreter: {baseline * 1e3:.1f} ms")
+    for mode, module in MODES.items():
+        results = [import_times(module) for _ in range(runs)]
+        if results[0][1] is None:
+            print(f"{mode}: can't import {module}")
+            continue
+        wall = statistics.median(wall for wall, _ in results)
+        imported = statistics.median(times[module] for _, times in results)
+        top_level = {name: seconds for name, seconds in results[0][1].items() if "." not in name and name != module}
+        slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:SLOWEST_IMPORTS]
+        print(f"{mode}: {wall * 1e3:.1f} ms in total, {imported * 1e3:.1f} ms importing {module} "
+              f"(slowest: {', '.join(f'{name} {seconds * 1e3:.1f} ms' for name, seconds in slowest)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,10 +10,11 @@ setuptools.setup(
     author_email=["shira.asael@gmail.com", "itaifain@gmail.com"],
     description="Sync your music!",
     install_requires=requirements,
+    extras_require={"zstd": ["zstandard"], "debug": ["scapy==2.4.3"]},
     url="https://github.com/shirasael/20588",
     packages=setuptools.find_packages(),
     classifiers=[
         "Programming Language :: Python :: 3",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
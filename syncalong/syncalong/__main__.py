@@ -1,15 +1,24 @@
 import sys
 
-from syncalong.main import client_main, server_main
 
 def main():
-    arg = sys.argv[1]
+    # The modes are imported only when selected, so that every mode loads only its own dependencies (the client and
+    # the server load wx, for example).
+    arg = sys.argv[1] if len(sys.argv) > 1 else None
     if arg == "client":
+        from syncalong.main import client_main
         client_main.main()
     elif arg == "server":
+        from syncalong.main import server_main
         server_main.main()
+    elif arg == "loadgen":
+        from syncalong.main import loadgen_main
+        loadgen_main.main(sys.argv[2:])
+    elif arg == "skew":
+        from syncalong.main import skew_main
+        skew_main.main(sys.argv[2:])
     else:
-        print("Please select 'client' or 'server'.")
+        print("Please select 'client', 'server', 'loadgen' or 'skew'.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,229 @@
+"""
+Audio backends the client plays songs with.
+
+The client drives playback only through the `AudioBackend` interface, so it runs the same with any backend:
+`PygameBackend` plays through the sound device, while `NullBackend` only keeps track of what would be playing, for
+clients without an audio device, tests and benchmarks. `RecordingBackend` also records the time of every call, for
+measuring how precisely the client acts on signals.
+The backend is chosen by name (see `create_backend`), so it can be set in the client's configuration.
+"""
+import time
+from typing import List, Tuple
+
+PYGAME = "pygame"
+NULL = "null"
+RECORDING = "recording"
+
+
+class AudioBackendError(Exception):
+    """
+    A backend could not load or play a song.
+    """
+
+
+class AudioBackend(object):
+    """
+    Plays a single song at a time.
+    """
+
+    def load(self, path: str):
+        """
+        Load the song at the given path, stopping the current song.
+
+        :raise AudioBackendError: If the song can't be loaded.
+        """
+        raise NotImplementedError
+
+    def preload(self, path: str):
+        """
+        Prepare the song at the given path to be loaded soon, so that loading it then is quick. The current song is
+        not interrupted, so this may do nothing while a song is playing.
+
+        :raise AudioBackendError: If the song can't be loaded.
+        """
+
+    def play(self, start: float = 0.0):
+        """
+        Play the loaded song from the given position (in seconds).
+
+        :raise AudioBackendError: If there is no loaded song, or it can't be played from that position.
+        """
+        raise NotImplementedError
+
+    def pause(self):
+        raise NotImplementedError
+
+    def unpause(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def position(self) -> float:
+        """
+        Position (in seconds) of the playing song.
+        """
+        raise NotImplementedError
+
+    def is_playing(self) -> bool:
+        """
+        Whether a song is playing (and not paused).
+        """
+        raise NotImplementedError
+
+
+class PygameBackend(AudioBackend):
+    """
+    Plays songs with `pygame.mixer.music`.
+    """
+
+    def __init__(self):
+        # pygame is imported only by this backend, so that clients with other backends don't load it at all.
+        import pygame
+        pygame.mixer.init()
+        self.error = pygame.error
+        self.music = pygame.mixer.music
+        self.preloaded = None
+        self.paused = False
+        # Position (in seconds) the song was started from, as pygame counts the position from the last play().
+        self.play_offset = 0.0
+
+    def load(self, path: str):
+        if path == self.preloaded:
+            self.preloaded = None
+            return
+        self.preloaded = None
+        try:
+            self.music.load(path)
+        except self.error as e:
+            raise AudioBackendError(f"Could not load {path}: {e}") from e
+        self.paused = False
+
+    def preload(self, path: str):
+        if self.music.get_busy() or self.paused:
+            return
+        self.load(path)
+        self.preloaded = path
+
+    def play(self, start: float = 0.0):
+        try:
+            self.music.play(start=start)
+        except self.error as e:
+            raise AudioBackendError(f"Could not play from {start:.3f}: {e}") from e
+        self.play_offset = start
+        self.paused = False
+
+    def pause(self):
+        self.music.pause()
+        self.paused = True
+
+    def unpause(self):
+        self.music.unpause()
+        self.paused = False
+
+    def stop(self):
+        self.music.stop()
+        self.paused = False
+
+    def position(self) -> float:
+        return self.play_offset + self.music.get_pos() / 1000
+
+    def is_playing(self) -> bool:
+        # Older versions of pygame count a paused song as busy.
+        return self.music.get_busy() and not self.paused
+
+
+class NullBackend(AudioBackend):
+    """
+    Plays nothing, but keeps track of the song that would be playing and its position (by the monotonic clock).
+    Songs are never read, and never end.
+    """
+
+    def __init__(self):
+        self.loaded = None
+        self.start_position = 0.0
+        # Monotonic times the song was played and paused at (None if it isn't).
+        self.played_at = None
+        self.paused_at = None
+
+    def load(self, path: str):
+        self.loaded = path
+        self.played_at = None
+        self.paused_at = None
+
+    def play(self, start: float = 0.0):
+        if self.loaded is None:
+            raise AudioBackendError("No song is loaded")
+        self.start_position = start
+        self.played_at = time.monotonic()
+        self.paused_at = None
+
+    def pause(self):
+        if self.is_playing():
+            self.paused_at = time.monotonic()
+
+    def unpause(self):
+        if self.paused_at is not None:
+            self.played_at += time.monotonic() - self.paused_at
+            self.paused_at = None
+
+    def stop(self):
+        self.played_at = None
+        self.paused_at = None
+
+    def position(self) -> float:
+        if self.played_at is None:
+            return 0.0
+        end = self.paused_at if self.paused_at is not None else time.monotonic()
+        return self.start_position + end - self.played_at
+
+    def is_playing(self) -> bool:
+        return self.played_at is not None and self.paused_at is None
+
+
+class RecordingBackend(NullBackend):
+    """
+    A `NullBackend` that records every call to it: the monotonic time it was made at, the method and its argument.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls: List[Tuple[float, str, object]] = []
+
+    def _record(self, method: str, argument=None):
+        self.calls.append((time.monotonic(), method, argument))
+
+    def load(self, path: str):
+        self._record("load", path)
+        super().load(path)
+
+    def preload(self, path: str):
+        self._record("preload", path)
+
+    def play(self, start: float = 0.0):
+        self._record("play", start)
+        super().play(start)
+
+    def pause(self):
+        self._record("pause")
+        super().pause()
+
+    def unpause(self):
+        self._record("unpause")
+        super().unpause()
+
+    def stop(self):
+        self._record("stop")
+        super().stop()
+
+
+BACKENDS = {PYGAME: PygameBackend, NULL: NullBackend, RECORDING: RecordingBackend}
+
+
+def create_backend(name: str) -> AudioBackend:
+    """
+    Create an audio backend by its name: "pygame", "null" or "recording".
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unsupported audio backend: {name}")
+    return BACKENDS[name]()
@@ -1,18 +1,38 @@
-import datetime
+import collections
+import functools
+import glob
+import hashlib
 import os
+import shutil
 import socket
-import pygame
 import threading
+import time
 import select
 
 from syncalong.common.general_packet import GeneralPacket, handle_packet
-from syncalong.client.timer import wait_for_remote_time
+from syncalong.client.audio_backend import AudioBackendError, create_backend, PYGAME
+from syncalong.client.timer import PreciseScheduler, wait_until
+from syncalong.client.drift_corrector import DriftCorrector, NO_CORRECTION, NUDGE, SEEK
+from syncalong.client.clock_service import ClockService
+from syncalong.client.peer_server import PeerServer, PEER_TIMEOUT
+from syncalong.client.multicast_receiver import MulticastReceiver
 
+from syncalong.common.compression import supported_codecs, decompressor
 from syncalong.common.length_socket import LengthSocket
-from syncalong.common.file_sync_packet import FileSyncPacket, WHO_HAS, who_has_answer_packet, FILE_SEND
-from syncalong.common.signal_packet import PLAY_SIGNAL, STOP_SIGNAL, SignalPacket, PAUSE_SIGNAL, UNPAUSE_SIGNAL
+from syncalong.common.multicast import multicast_receiver_socket
+from syncalong.common.file_sync_packet import FileSyncPacket, WHO_HAS, who_has_answer_packet, FILE_SEND, \
+    FILE_CHUNK_SIZE, MISSING, DELTA_SEND, DELTA_COPY, DELTA_DATA, FETCH, MULTICAST_SEND, MULTICAST_END, \
+    signatures_answer_packet, nack_packet
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
+from syncalong.common.signal_packet import PLAY_SIGNAL, STOP_SIGNAL, SignalPacket, PAUSE_SIGNAL, UNPAUSE_SIGNAL, \
+    POSITION_SIGNAL, commands
 
 TIMEOUT = 0.5
+DELTA_SUFFIX = ".delta"
+PARTIAL_SUFFIX = ".part"
+MULTICAST_SUFFIX = ".multicast"
+MAX_SIGNAL_DATAGRAM_SIZE = 64 * 1024
+SIGNAL_HISTORY = 64
 
 
 class UnknownSignalException(Exception):
@@ -29,10 +49,12 @@ class Client(object):
     The client connects to a server at a given address, and can either play/stop music or receive files to be played.
     All the clients received music files are saved in a local repository.
     The client synchronizes with a remote NTP server, in order to guarantee music will be played at the same time for
-    all clients at once.
+    all clients at once. The server is sampled in the background (see `ClockService`), so that handling a signal
+    doesn't wait for the network.
     """
 
-    def __init__(self, server_ip, server_port, ntp_server, music_files_repo):
+    def __init__(self, server_ip, server_port, ntp_server, music_files_repo, peer_port=None, signal_group=None,
+                 ntp_port=123, audio_backend=PYGAME):
         """
         Initialize a new client by connecting to the server at the given address.
 
@@ -40,15 +62,32 @@ class Client(object):
         :param server_port: Port of the server to connect to.
         :param ntp_server: Hostname of an NTP server to sync from.
         :param music_files_repo: Local path of a directory which will be used as the client's repository.
+        :param peer_port: Port for serving files of the repository to other clients (0 for any free port), at the
+                          address the client is connected to the server from. Default is None: files are not served
+                          to other clients.
+        :param signal_group: (address, port) of a multicast group the server sends signals to. Signals sent by the
+                             server as datagrams to the client itself are received either way.
+        :param ntp_port: Port of the NTP server.
+        :param audio_backend: Name of the audio backend to play with (see `create_backend`).
         """
-        pygame.mixer.init()
+        self.audio = create_backend(audio_backend)
         self.ntp_server = ntp_server
+        self.clock = ClockService(ntp_server, ntp_port)
+        self.scheduler = PreciseScheduler(self.clock)
+        self.drift_corrector = DriftCorrector()
         self.music_files_repo = music_files_repo
         if not os.path.exists(self.music_files_repo):
             os.makedirs(self.music_files_repo)
+        self.catalog = SongCatalog(os.path.join(self.music_files_repo, CATALOG_FILE_NAME))
         self.socket = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
         print(f'connecting to {server_ip}:{server_port}')
         self.socket.connect((server_ip, server_port))
+        self.socket.set_nodelay()
+        self.peer_server = None
+        if peer_port is not None:
+            self.peer_server = PeerServer(self.music_files_repo, self.catalog, self.socket.getsockname()[0], peer_port)
+        self.signal_sockets = self._open_signal_sockets(signal_group)
+        self.handled_signals = collections.deque(maxlen=SIGNAL_HISTORY)
         self.media_player = None
         self.plaing_now = ''
         self.stop_request = threading.Event()
@@ -60,76 +99,412 @@ class Client(object):
 
         All messages received are expected to be of type GeneralPacket.
         """
+        self.catalog.scan(self.music_files_repo)
+        self.clock.start()
+        if self.peer_server:
+            self.peer_server.start()
         self.socket.send(bytes("hello", encoding="utf-8"))
         while not self.stop_request.is_set():
-            sock, _, _ = select.select([self.socket], [], [], TIMEOUT)
-            if sock:
-                recv_packet = GeneralPacket(sock[0].recv())
-                handle_packet(recv_packet, {
-                    SignalPacket: self._handle_signal,
-                    FileSyncPacket: self._handle_file_sync
-                })
-        pygame.mixer.music.stop()
+            readable, _, _ = select.select([self.socket] + self.signal_sockets, [], [],
+                                           0 if self.socket.pending() else TIMEOUT)
+            for sock in readable:
+                if sock is not self.socket:
+                    self._recv_signal_datagram(sock)
+            if self.socket in readable or self.socket.pending():
+                try:
+                    recv_packet = GeneralPacket(self.socket.recv())
+                    handle_packet(recv_packet, {
+                        SignalPacket: self._handle_signal,
+                        FileSyncPacket: self._handle_file_sync
+                    })
+                except ConnectionError as e:
+                    print(f"Lost connection to server: {e}")
+                    break
+        self.audio.stop()
+        self.clock.stop()
+        if self.scheduler.lateness:
+            print(self.scheduler.summary())
+        if self.drift_corrector.heartbeats:
+            print(f"Drift: {self.drift_corrector.summary()}")
+        if self.peer_server:
+            self.peer_server.stop()
+        for sock in self.signal_sockets:
+            sock.close()
         self.socket.close()
 
+    def _open_signal_sockets(self, signal_group):
+        """
+        Open the UDP sockets the server may send signals to: a socket at the same address as the client's connection,
+        and (if given) a socket joined to the signal multicast group.
+        Signals are always sent over the connection too, so a socket that can't be opened is skipped.
+        """
+        local_ip, local_port = self.socket.getsockname()
+        signal_sockets = []
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind((local_ip, local_port))
+            signal_sockets.append(sock)
+        except OSError as e:
+            sock.close()
+            print(f"Can't receive signal datagrams at {local_ip}:{local_port}: {e}")
+        if signal_group is not None:
+            group, port = signal_group
+            try:
+                signal_sockets.append(multicast_receiver_socket(group, port, local_ip))
+            except OSError as e:
+                print(f"Can't join signal group {group}:{port}: {e}")
+        return signal_sockets
+
+    def _recv_signal_datagram(self, sock):
+        """
+        Receive a signal sent as a datagram, and handle it if it was sent by the server.
+        """
+        try:
+            data, address = sock.recvfrom(MAX_SIGNAL_DATAGRAM_SIZE)
+            if address[0] != self.socket.getpeername()[0]:
+                return
+            signal_packet = GeneralPacket(data)[SignalPacket]
+        except (OSError, IndexError) as e:
+            print(f"Dropping signal datagram: {e}")
+            return
+        self._handle_signal(signal_packet)
+
     def _handle_play(self, music_file_path):
         """
         Play the file at the given path. If the file is not found, an exception is thrown.
         :param music_file_path: Local music file to be played.
         """
         print("Playing {}".format(music_file_path))
-        pygame.mixer.music.load(music_file_path)
+        self.audio.load(music_file_path)
         self.plaing_now = os.path.basename(music_file_path)
-        pygame.mixer.music.play()
+        self.audio.play()
 
     def _handle_signal(self, signal_packet: SignalPacket):
         """
         Handle a packet of type SignalPacket: start / stop playing music, after waiting for the required amount of
         seconds (aligned with the NTP server's time).
+        The same signal may be received several times (as datagrams, and over the connection), and it is handled only
+        the first time. Signals are told apart by their sequence number.
 
         :param signal_packet: packet to be handled.
         """
+        if signal_packet.seq:
+            if signal_packet.seq in self.handled_signals:
+                return
+            self.handled_signals.append(signal_packet.seq)
+        if signal_packet.signal == POSITION_SIGNAL:
+            self._handle_position(signal_packet)
+            return
         print("Got signal {}".format(signal_packet.signal))
-        server_send_time = datetime.datetime.fromtimestamp(signal_packet.send_timestamp)
-        delay = signal_packet.wait_seconds
-        wait_for_remote_time(server_send_time, delay, self.ntp_server)
-
         music_ctl_handlers = {
-            STOP_SIGNAL: pygame.mixer.music.stop,
-            PAUSE_SIGNAL: pygame.mixer.music.pause,
-            UNPAUSE_SIGNAL: pygame.mixer.music.unpause
+            STOP_SIGNAL: self.audio.stop,
+            PAUSE_SIGNAL: self.audio.pause,
+            UNPAUSE_SIGNAL: self.audio.unpause
         }
         if signal_packet.signal == PLAY_SIGNAL:
             music_file = signal_packet.music_file_name.decode('utf-8')
             local_music_file_path = os.path.join(self.music_files_repo, music_file)
-            self._handle_play(local_music_file_path)
+            # Loading the song takes a while, so it is done before waiting rather than at the play time.
+            try:
+                self.audio.preload(local_music_file_path)
+            except AudioBackendError as e:
+                print(f"Could not preload {music_file}: {e}")
+            action = functools.partial(self._handle_play, local_music_file_path)
         elif signal_packet.signal in music_ctl_handlers:
-            music_ctl_handlers[signal_packet.signal]()
+            action = music_ctl_handlers[signal_packet.signal]
         else:
             raise UnknownSignalException(signal_packet.signal)
 
+        if not self.clock.synced.is_set():
+            print(f"Clock is not synced with {self.ntp_server} yet, assuming no offset")
+        command = commands[signal_packet.signal]
+        self.scheduler.run_at(signal_packet.send_timestamp + signal_packet.wait_seconds, action, command)
+        print(f"Executed {command} {self.scheduler.lateness[command][-1] * 1e3:.3f} ms late")
+
+    def _handle_position(self, signal_packet: SignalPacket):
+        """
+        Handle a heartbeat of the playback (POSITION_SIGNAL): compare the position the song should be at with the
+        position it is actually at, and correct the drift between them if needed (see `DriftCorrector`). A player that
+        is slightly ahead is paused for its drift, and otherwise it seeks to the expected position.
+
+        :param signal_packet: The heartbeat, telling the position of the song at the server's send time.
+        """
+        if signal_packet.music_file_name.decode('utf-8') != self.plaing_now or not self.audio.is_playing():
+            return
+        expected_position = signal_packet.position + self.clock.remote_time() - signal_packet.send_timestamp
+        actual_position = self.audio.position()
+        correction = self.drift_corrector.check(expected_position, actual_position)
+        if correction == NUDGE:
+            self.audio.pause()
+            wait_until(time.monotonic() + actual_position - expected_position)
+            self.audio.unpause()
+        elif correction == SEEK:
+            position = signal_packet.position + self.clock.remote_time() - signal_packet.send_timestamp
+            try:
+                self.audio.play(start=position)
+            except AudioBackendError as e:
+                self.drift_corrector.failed_corrections += 1
+                print(f"Could not seek {self.plaing_now} to {position:.3f}: {e}")
+        if correction != NO_CORRECTION:
+            print(f"Corrected a drift of {(actual_position - expected_position) * 1e3:.1f} ms by {correction}")
+
     def _handle_file_sync(self, file_sync_packet: FileSyncPacket):
         """
         Handle a packet of type FileSyncPacket: check if a required music file exists in the repository, or accept a
         file being sent.
         A file is considered as existing in the client if:
             - A file with the name in the FileSyncPacket exists in the client's repository
-            - The file's length is the same as the length specified in the FileSyncPacket
+            - The file's content hash is the one in the FileSyncPacket (or, if the packet has no hash, the file's
+              length is the same as the length specified in the FileSyncPacket)
+        If the repository holds the required content under another name, it is copied to the required name instead of
+        being sent again. If the repository holds an outdated file with the required name, the signatures of its blocks
+        are sent along with the answer, so that only the changes will be received (DELTA_SEND).
         When a file is received by the client, it overrides the file with the same name in the repository, if it exists.
+        Files are received into a hidden partial file, which replaces the file in the repository only once it is
+        complete. If the connection is lost in the middle, the partial file is kept, and the next WHO_HAS for the same
+        content is answered with the amount of bytes already received (in `offset`), so that the server resumes the
+        transfer from there.
+        The server may also send FETCH, telling the client to fetch the file from another client (see `PeerServer`).
+        The fetch is resumed the same way, and then answered like WHO_HAS.
+        The server may also send the file through a multicast group (MULTICAST_SEND). The client joins the group and
+        answers MISSING, receives the blocks until MULTICAST_END, and then asks for the blocks it lost (NACK, see
+        `_recv_multicast`). Resuming a transfer looks like this:
+
+        Server                                          Client
+        FileSyncPacket(message_type=WHO_HAS)    --->    find partial file of the same content
+                                                <---    FileSyncPacket(message_type=MISSING, offset=partial size)
+        FileSyncPacket(message_type=FILE_SEND,  --->    append to partial file
+                       offset=partial size)
+        file chunks from offset                 --->    rename partial file once file_size bytes are received
 
         :param file_sync_packet: packet to be handled.
         """
         local_path = os.path.join(self.music_files_repo, file_sync_packet.file_name.decode('utf-8'))
+        file_hash = file_sync_packet.file_hash.decode('utf-8')
         if file_sync_packet.message_type == WHO_HAS:
             print("Got who has!")
-            send_packet = who_has_answer_packet(local_path, file_sync_packet.file_size)
-            self.socket.send(send_packet)
+            if file_hash:
+                self._copy_from_catalog(local_path, file_hash)
+            self.socket.send(self._who_has_answer(local_path, file_hash, file_sync_packet.file_size, True))
         elif file_sync_packet.message_type == FILE_SEND:
-            file_size = file_sync_packet.file_size
-            received = 0
-            with open(local_path, 'wb') as local_file:
-                while received < file_size:
-                    read_size = 1024 if file_size - received >= 1024 else file_size - received
-                    data = self.socket.recv(read_size)
-                    received += len(data)
-                    local_file.write(data)
+            self._recv_file(local_path, file_hash, file_sync_packet.file_size, file_sync_packet.offset,
+                            codec=file_sync_packet.codecs.decode('utf-8'), content_size=file_sync_packet.content_size)
+        elif file_sync_packet.message_type == FETCH:
+            self._fetch_from_peer(local_path, file_sync_packet)
+            self.socket.send(self._who_has_answer(local_path, file_hash, file_sync_packet.file_size, False))
+        elif file_sync_packet.message_type == MULTICAST_SEND:
+            self._recv_multicast(local_path, file_sync_packet)
+            self.socket.send(self._who_has_answer(local_path, file_hash, file_sync_packet.file_size, False))
+        elif file_sync_packet.message_type == DELTA_SEND:
+            self._recv_delta(local_path, file_sync_packet.file_size)
+            self._add_received_file(local_path, file_hash, None)
+
+    def _who_has_answer(self, local_path, file_hash, file_size, allow_delta):
+        """
+        Answer whether the repository has the given file. If it doesn't, the answer tells the server what is needed
+        for sending only a part of the file: the offset of a partial transfer or (if allowed) the block signatures of
+        an outdated copy.
+        """
+        send_packet = who_has_answer_packet(local_path, file_size, file_hash, self.catalog)
+        partial_offset = self._partial_offset(local_path, file_hash)
+        if send_packet.message_type == MISSING and file_hash:
+            if 0 < partial_offset < file_size:
+                send_packet.offset = partial_offset
+                print(f"Resuming {local_path} from {send_packet.offset}")
+            elif allow_delta and os.path.exists(local_path):
+                send_packet = signatures_answer_packet(local_path)
+        if self.peer_server:
+            send_packet.peer_port = self.peer_server.port
+        send_packet.codecs = ",".join(supported_codecs())
+        return send_packet
+
+    def _partial_offset(self, local_path, file_hash):
+        partial_path = self._partial_path(local_path, file_hash)
+        return os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+
+    def _fetch_from_peer(self, local_path, fetch: FileSyncPacket):
+        """
+        Fetch a file from the peer in the given FETCH packet, resuming a partial transfer if there is one.
+        Failures are printed, and the server is told about them by the answer that follows the fetch.
+        """
+        file_hash = fetch.file_hash.decode('utf-8')
+        peer_host = fetch.peer_host.decode('utf-8')
+        print(f"Fetching {local_path} from peer {peer_host}:{fetch.peer_port}")
+        try:
+            with LengthSocket(socket.AF_INET, socket.SOCK_STREAM) as peer:
+                peer.settimeout(PEER_TIMEOUT)
+                peer.connect((peer_host, fetch.peer_port))
+                peer.send(FileSyncPacket(message_type=FETCH,
+                                         file_name=fetch.file_name,
+                                         file_hash=fetch.file_hash,
+                                         offset=self._partial_offset(local_path, file_hash)))
+                header = GeneralPacket(peer.recv())[FileSyncPacket]
+                if header.message_type == FILE_SEND:
+                    self._recv_file(local_path, file_hash, header.file_size, header.offset, peer)
+                else:
+                    print(f"Peer {peer_host}:{fetch.peer_port} doesn't have {local_path}")
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Could not fetch {local_path} from peer {peer_host}:{fetch.peer_port}: {e}")
+
+    def _recv_multicast(self, local_path, announcement: FileSyncPacket):
+        """
+        Receive a file sent to a multicast group (see `MulticastReceiver`), and then move it into the repository.
+        Once the server ends the multicast, it is sent a NACK with all the byte ranges that were lost (and could not be
+        recovered), and sends them back as DELTA_DATA packets:
+
+        Server                                          Client
+        FileSyncPacket(message_type=MULTICAST_SEND) --> join multicast group
+                                                <---    FileSyncPacket(message_type=MISSING)
+        file blocks and parity blocks (multicast) --->  write blocks to a temporary file
+        FileSyncPacket(message_type=MULTICAST_END) ---> recover lost blocks from parity blocks
+                                                <---    FileSyncPacket(message_type=NACK, ranges still missing)
+        FileSyncPacket(message_type=DELTA_DATA) --->    write range to the temporary file
+        range content                           --->
+        """
+        file_hash = announcement.file_hash.decode('utf-8')
+        directory, name = os.path.split(local_path)
+        temp_path = os.path.join(directory, f".{name}.{file_hash}{MULTICAST_SUFFIX}")
+        interface = self.socket.getsockname()[0]
+        try:
+            with open(temp_path, 'w+b') as temp_file, \
+                    MulticastReceiver(temp_file, announcement.peer_host.decode('utf-8'), announcement.peer_port,
+                                      interface, file_hash, announcement.file_size,
+                                      announcement.block_size) as receiver:
+                self.socket.send(FileSyncPacket(message_type=MISSING, file_name=announcement.file_name))
+                while True:
+                    readable, _, _ = select.select([receiver, self.socket], [], [],
+                                                   0 if self.socket.pending() else TIMEOUT)
+                    if receiver in readable:
+                        receiver.receive_pending()
+                    elif self.socket in readable or self.socket.pending():
+                        if self._recv_file_sync().message_type == MULTICAST_END:
+                            break
+                receiver.receive_pending()
+                recovered = receiver.recover()
+                ranges = receiver.missing_ranges()
+                print(f"Received {local_path} by multicast: recovered {recovered} blocks, {len(ranges)} ranges missing")
+                self.socket.send(nack_packet(local_path, ranges))
+                left = sum(count for _, count in ranges)
+                while left > 0:
+                    repair = self._recv_file_sync()
+                    temp_file.seek(repair.offset)
+                    self._recv_to_file(temp_file, repair.file_size)
+                    left -= repair.file_size
+            os.replace(temp_path, local_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._add_received_file(local_path, file_hash, None)
+
+    def _recv_file(self, local_path, file_hash, file_size, offset, sock=None, codec="", content_size=0):
+        """
+        Receive a file into its partial file, starting from the given offset, and then move it into the repository.
+        The file is received from the server in chunks, each preceded by a DELTA_DATA packet, and signals sent between
+        the chunks are handled on the way. If another socket is given (a peer's), the file is received from it as-is.
+        If a codec is given, `content_size` bytes compressed with it are received, and decompressed on the fly.
+        """
+        partial_path = self._partial_path(local_path, file_hash)
+        digest = hashlib.sha256()
+        with open(partial_path, 'r+b' if offset else 'wb') as partial_file:
+            while partial_file.tell() < offset:
+                data = partial_file.read(min(FILE_CHUNK_SIZE, offset - partial_file.tell()))
+                if not data:
+                    raise ValueError(f"Can't resume {local_path} from {offset}: partial file is too short")
+                digest.update(data)
+            partial_file.truncate()
+            decompress = decompressor(codec) if codec else None
+            size = content_size if codec else file_size - offset
+            if sock is None:
+                while size > 0:
+                    chunk = self._recv_file_sync()
+                    self._recv_to_file(partial_file, chunk.file_size, digest, decompress=decompress)
+                    size -= chunk.file_size
+            else:
+                self._recv_to_file(partial_file, size, digest, sock, decompress)
+            if decompress is not None:
+                data = decompress.flush()
+                digest.update(data)
+                partial_file.write(data)
+        os.replace(partial_path, local_path)
+        for stale_path in glob.glob(self._partial_path(glob.escape(local_path), '*')):
+            os.remove(stale_path)
+        self._add_received_file(local_path, file_hash, digest)
+
+    @staticmethod
+    def _partial_path(local_path, file_hash):
+        directory, name = os.path.split(local_path)
+        return os.path.join(directory, f".{name}.{file_hash}{PARTIAL_SUFFIX}")
+
+    def _recv_delta(self, local_path, file_size):
+        """
+        Receive the changes of a file, and build its new version out of the local copy and the changes.
+        The new version replaces the local copy only after it was fully received.
+        """
+        directory, name = os.path.split(local_path)
+        temp_path = os.path.join(directory, f".{name}{DELTA_SUFFIX}")
+        written = 0
+        with open(local_path, 'rb') as old_file, open(temp_path, 'wb') as new_file:
+            while written < file_size:
+                operation = self._recv_file_sync()
+                if operation.message_type == DELTA_COPY:
+                    old_file.seek(operation.offset)
+                    left = operation.file_size
+                    while left > 0:
+                        data = old_file.read(min(FILE_CHUNK_SIZE, left))
+                        new_file.write(data)
+                        left -= len(data)
+                elif operation.message_type == DELTA_DATA:
+                    self._recv_to_file(new_file, operation.file_size)
+                written += operation.file_size
+        os.replace(temp_path, local_path)
+
+    def _recv_file_sync(self) -> FileSyncPacket:
+        """
+        Receive the next FileSyncPacket from the server, in the middle of receiving a file. Signals may arrive in the
+        meantime (the server doesn't stop playing while it sends files), so they are handled on the way.
+        """
+        while True:
+            packet = GeneralPacket(self.socket.recv()).payload
+            if isinstance(packet, FileSyncPacket):
+                return packet
+            self._handle_signal(packet)
+
+    def _recv_to_file(self, local_file, size, digest=None, sock=None, decompress=None):
+        """
+        Receive the given amount of raw bytes from the server (or from the given socket), and write them to the given
+        file. If a decompressor is given (see `compression.decompressor`), the bytes are decompressed before they are
+        written. The decompressor is not flushed, as the compressed stream may go on in the next chunk.
+        """
+        sock = sock or self.socket
+        received = 0
+        while received < size:
+            data = sock.recv(min(FILE_CHUNK_SIZE, size - received))
+            if not data:
+                raise ConnectionError("Connection closed in the middle of a file")
+            received += len(data)
+            if decompress is not None:
+                data = decompress.decompress(data)
+            if digest is not None:
+                digest.update(data)
+            local_file.write(data)
+
+    def _add_received_file(self, local_path, file_hash, digest):
+        """
+        Add a file that was received to the catalog, and verify its content.
+        """
+        content_hash = digest.hexdigest() if digest is not None else self.catalog.hash_of(local_path)
+        if file_hash and content_hash != file_hash:
+            print(f"Received {local_path} with unexpected content")
+        self.catalog.add(local_path, content_hash)
+
+    def _copy_from_catalog(self, local_path, file_hash):
+        """
+        Copy a file with the given content to the given path, if the repository has one under another name.
+        """
+        if os.path.exists(local_path) and self.catalog.hash_of(local_path) == file_hash:
+            return
+        existing_path = self.catalog.find(file_hash)
+        if existing_path and existing_path != os.path.abspath(local_path):
+            print(f"Copying {existing_path} to {local_path}")
+            shutil.copyfile(existing_path, local_path)
+            self.catalog.add(local_path, file_hash)
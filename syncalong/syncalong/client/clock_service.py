@@ -0,0 +1,141 @@
+import collections
+import datetime
+import threading
+import time
+
+from ntplib import NTPClient, NTPException
+
+# Amount of recent samples the offset is chosen from (like NTP's clock filter).
+CLOCK_FILTER_SIZE = 8
+SAMPLE_INTERVAL = 8
+# The interval is doubled (up to this) every time the server tells the client to slow down.
+MAX_SAMPLE_INTERVAL = 64
+# The first samples are taken quickly, so that the clock is usable soon after the client starts.
+BURST_SAMPLES = 4
+BURST_INTERVAL = 0.5
+NTP_TIMEOUT = 1
+# Maximum drift of the local clock, in seconds per second (NTP's PHI). The error of a sample grows with its age.
+MAX_DRIFT = 15e-6
+
+
+class ClockService(threading.Thread):
+    """
+    Estimates the offset of the local clock from an NTP server, by sampling the server in the background.
+
+    Each sample is an offset and the round trip delay it was measured with. The error of an offset is at most half of
+    its round trip delay, so the sample with the minimum delay out of the last `CLOCK_FILTER_SIZE` samples is used.
+    The estimate is kept up to date by the sampling thread, so reading it never touches the network:
+
+        clock = ClockService("10.0.0.1")
+        clock.start()
+        clock.remote_time()
+    """
+
+    def __init__(self, ntp_server: str, ntp_port: int = 123, interval: float = SAMPLE_INTERVAL,
+                 filter_size: int = CLOCK_FILTER_SIZE):
+        """
+        Initialize a clock service. The server is sampled only once the service is started.
+
+        :param ntp_server: Hostname of the NTP server.
+        :param ntp_port: Port of the NTP server.
+        :param interval: Seconds between samples.
+        :param filter_size: Amount of recent samples the offset is chosen from.
+        """
+        super().__init__(daemon=True)
+        self.ntp_server = ntp_server
+        self.ntp_port = ntp_port
+        self.interval = interval
+        self.ntp_client = NTPClient()
+        # (offset, delay, monotonic time the sample was taken)
+        self.samples = collections.deque(maxlen=filter_size)
+        self.estimate = None
+        self.synced = threading.Event()
+        self.should_stop = threading.Event()
+
+    def run(self):
+        """
+        Sample the server every `interval` seconds, until `stop` is called.
+        """
+        while not self.should_stop.is_set():
+            sampled = self.sample()
+            self.should_stop.wait(BURST_INTERVAL if sampled and len(self.samples) < BURST_SAMPLES else self.interval)
+
+    def stop(self):
+        self.should_stop.set()
+
+    def sample(self) -> bool:
+        """
+        Take a single sample of the server.
+
+        A Kiss-o'-Death answer (of stratum 0) holds no time, so it is not a sample. It tells the client to poll less
+        often, so the interval is doubled.
+
+        :return: Whether the server answered with the time.
+        """
+        try:
+            result = self.ntp_client.request(self.ntp_server, port=self.ntp_port, timeout=NTP_TIMEOUT)
+        except (NTPException, OSError) as e:
+            print(f"Could not sample NTP server {self.ntp_server}:{self.ntp_port}: {e}")
+            return False
+        if result.stratum == 0:
+            self.interval = min(self.interval * 2, MAX_SAMPLE_INTERVAL)
+            kiss_code = result.ref_id.to_bytes(4, 'big').decode('ascii', 'replace')
+            print(f"NTP server {self.ntp_server}:{self.ntp_port} sent kiss code {kiss_code}, "
+                  f"sampling every {self.interval} seconds")
+            return False
+        self.add_sample(result.offset, result.delay)
+        return True
+
+    def add_sample(self, offset: float, delay: float):
+        """
+        Add a sample, and update the estimate to the sample with the minimum delay.
+
+        :param offset: Offset of the server's clock from the local clock, in seconds.
+        :param delay: Round trip delay the offset was measured with, in seconds.
+        """
+        self.samples.append((offset, max(delay, 0), time.monotonic()))
+        self.estimate = min(self.samples, key=lambda sample: sample[1])
+        self.synced.set()
+
+    def wait_synced(self, timeout: float = None) -> bool:
+        """
+        Wait until the first sample is taken.
+
+        :return: Whether the clock is synced.
+        """
+        return self.synced.wait(timeout)
+
+    @property
+    def offset(self) -> float:
+        """
+        Estimated offset of the server's clock from the local clock, in seconds (0 before the first sample).
+        """
+        estimate = self.estimate
+        return 0.0 if estimate is None else estimate[0]
+
+    @property
+    def error(self) -> float:
+        """
+        Bound of the error of `offset`, in seconds: half of the round trip delay it was measured with, plus the drift
+        the local clock may have had since. Infinite before the first sample.
+        """
+        estimate = self.estimate
+        if estimate is None:
+            return float("inf")
+        _, delay, sampled_at = estimate
+        return delay / 2 + MAX_DRIFT * (time.monotonic() - sampled_at)
+
+    def remote_time(self) -> float:
+        """
+        Current time of the server, as a timestamp.
+        """
+        return time.time() + self.offset
+
+    def now(self) -> datetime.datetime:
+        """
+        Current time of the server, as a local datetime.
+        """
+        return datetime.datetime.fromtimestamp(self.remote_time())
+
+    def __repr__(self):
+        return f"<ClockService {self.ntp_server}:{self.ntp_port} offset={self.offset:+.6f}s error={self.error:.6f}s>"
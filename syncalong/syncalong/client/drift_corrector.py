@@ -0,0 +1,82 @@
+import collections
+import statistics
+from typing import Dict
+
+# Drift (in seconds) that is not worth correcting.
+DRIFT_THRESHOLD = 0.03
+# A player ahead by up to this many seconds is paused for its drift; otherwise (or when behind) it seeks.
+MAX_NUDGE = 0.25
+DRIFT_HISTORY = 1000
+
+NO_CORRECTION = "none"
+NUDGE = "nudge"
+SEEK = "seek"
+
+
+def choose_correction(drift: float, threshold: float = DRIFT_THRESHOLD, max_nudge: float = MAX_NUDGE) -> str:
+    """
+    Choose how to correct the given drift of the player.
+
+    :param drift: Seconds the player is ahead of the expected position (negative if it is behind).
+    :return: NO_CORRECTION if the drift is within the threshold, NUDGE if the player is slightly ahead (and should
+             pause for the drift), or SEEK if it should seek to the expected position.
+    """
+    if abs(drift) < threshold:
+        return NO_CORRECTION
+    if 0 < drift <= max_nudge:
+        return NUDGE
+    return SEEK
+
+
+class DriftCorrector(object):
+    """
+    Compares the position of the local player with the position heartbeats of the server (POSITION_SIGNAL), chooses
+    how to correct the drift between them (see `choose_correction`), and keeps metrics of the drift and corrections.
+    """
+
+    def __init__(self, threshold: float = DRIFT_THRESHOLD, max_nudge: float = MAX_NUDGE):
+        """
+        :param threshold: Drift (in seconds) that is not worth correcting.
+        :param max_nudge: Maximal drift (in seconds) of a player that is ahead, to be corrected by pausing it.
+        """
+        self.threshold = threshold
+        self.max_nudge = max_nudge
+        self.heartbeats = 0
+        self.corrections: Dict[str, int] = collections.Counter()
+        self.failed_corrections = 0
+        self.drifts = collections.deque(maxlen=DRIFT_HISTORY)
+
+    def check(self, expected_position: float, actual_position: float) -> str:
+        """
+        Record a heartbeat, and choose how the player should be corrected.
+
+        :param expected_position: Position (in seconds) the player should be at now.
+        :param actual_position: Position (in seconds) the player is at now.
+        :return: The correction to make (see `choose_correction`).
+        """
+        drift = actual_position - expected_position
+        self.heartbeats += 1
+        self.drifts.append(drift)
+        correction = choose_correction(drift, self.threshold, self.max_nudge)
+        if correction != NO_CORRECTION:
+            self.corrections[correction] += 1
+        return correction
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Metrics of the drift (in seconds) and corrections so far.
+        """
+        drifts = [abs(drift) for drift in self.drifts]
+        return {"heartbeats": self.heartbeats,
+                "nudges": self.corrections[NUDGE],
+                "seeks": self.corrections[SEEK],
+                "failed_corrections": self.failed_corrections,
+                "last_drift": self.drifts[-1] if self.drifts else 0.0,
+                "mean_abs_drift": statistics.mean(drifts) if drifts else 0.0,
+                "max_abs_drift": max(drifts, default=0.0)}
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (f"{stats['heartbeats']} heartbeats, {stats['nudges']} nudges, {stats['seeks']} seeks "
+                f"({stats['failed_corrections']} failed), drift {stats['mean_abs_drift'] * 1e3:.1f} ms on average, "
+                f"{stats['max_abs_drift'] * 1e3:.1f} ms at most")
@@ -0,0 +1,118 @@
+from typing import BinaryIO, Dict, List
+
+from syncalong.common.multicast import FEC_GROUP_SIZE, DATAGRAM_HEADER, DATA_BLOCK, PARITY_BLOCK, Range, block_count, \
+    multicast_receiver_socket, transfer_id, unpack_datagram, xor_blocks
+
+MAX_DATAGRAM_SIZE = 64 * 1024
+
+
+class MulticastReceiver(object):
+    """
+    Receives the blocks of a file sent to a multicast group (see `MulticastSender`), and writes them into a local file.
+    Blocks that were lost are recovered from their FEC group's parity block when possible, and the rest are reported
+    by `missing_ranges`, to be repaired by the server.
+    The receiver has a `fileno`, so it may be waited on by `select`.
+    """
+
+    def __init__(self, local_file: BinaryIO, group: str, port: int, interface: str, file_hash: str, file_size: int,
+                 block_size: int):
+        """
+        Join the multicast group, and prepare the local file for receiving the blocks.
+
+        :param local_file: File to write the blocks into, opened for writing.
+        :param group: Address of the multicast group.
+        :param port: Port the datagrams are sent to.
+        :param interface: Address of the local interface to join the group on.
+        :param file_hash: Content hash of the file. Datagrams of other files are ignored.
+        :param file_size: Size of the file.
+        :param block_size: Size of the file's content in every datagram.
+        """
+        self.local_file = local_file
+        self.transfer_id = transfer_id(file_hash)
+        self.file_size = file_size
+        self.block_size = block_size
+        self.received = bytearray(block_count(file_size, block_size))
+        self.parities: Dict[int, bytes] = {}
+        self.local_file.truncate(file_size)
+        self.socket = multicast_receiver_socket(group, port, interface)
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    def receive_pending(self):
+        """
+        Handle all the datagrams waiting on the socket, without blocking.
+        """
+        while True:
+            try:
+                datagram = self.socket.recv(MAX_DATAGRAM_SIZE)
+            except BlockingIOError:
+                return
+            if len(datagram) < DATAGRAM_HEADER.size:
+                # Not a block of any file (anyone may send to the group), so it is dropped.
+                continue
+            transfer, kind, index, payload = unpack_datagram(datagram)
+            if transfer != self.transfer_id:
+                continue
+            # A block of the wrong size is not one the sender sent (see `MulticastSender`), so it is dropped rather
+            # than written over its neighbours.
+            if kind == DATA_BLOCK and index < len(self.received) and not self.received[index]:
+                if len(payload) == self._block_length(index):
+                    self._write_block(index, payload)
+            elif kind == PARITY_BLOCK and len(payload) == self.block_size:
+                self.parities[index] = payload
+
+    def recover(self) -> int:
+        """
+        Recover the blocks that can be rebuilt from parity blocks: a single lost block in every FEC group.
+
+        :return: Amount of blocks recovered.
+        """
+        recovered = 0
+        for group_index, parity in self.parities.items():
+            indexes = range(group_index * FEC_GROUP_SIZE, min((group_index + 1) * FEC_GROUP_SIZE, len(self.received)))
+            missing = [index for index in indexes if not self.received[index]]
+            if len(missing) != 1:
+                continue
+            blocks = [self._read_block(index) for index in indexes if index != missing[0]]
+            block = xor_blocks(blocks + [parity], self.block_size)
+            self._write_block(missing[0], block[:self._block_length(missing[0])])
+            recovered += 1
+        return recovered
+
+    def missing_ranges(self) -> List[Range]:
+        """
+        Byte ranges of the file that were not received yet, as (offset, count) tuples. Adjacent blocks are merged.
+        """
+        ranges = []
+        for index, received in enumerate(self.received):
+            if received:
+                continue
+            offset = index * self.block_size
+            count = self._block_length(index)
+            if ranges and sum(ranges[-1]) == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + count)
+            else:
+                ranges.append((offset, count))
+        return ranges
+
+    def _block_length(self, index: int) -> int:
+        return min(self.block_size, self.file_size - index * self.block_size)
+
+    def _read_block(self, index: int) -> bytes:
+        self.local_file.seek(index * self.block_size)
+        return self.local_file.read(self._block_length(index))
+
+    def _write_block(self, index: int, data: bytes):
+        self.local_file.seek(index * self.block_size)
+        self.local_file.write(data)
+        self.received[index] = 1
+
+    def close(self):
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,87 @@
+import os
+import socket
+import struct
+import threading
+
+from syncalong.common.general_packet import GeneralPacket
+from syncalong.common.length_socket import LengthSocket
+from syncalong.common.file_sync_packet import FileSyncPacket, FETCH, MISSING, file_send_packet
+from syncalong.common.song_catalog import SongCatalog
+
+PEER_TIMEOUT = 10
+ACCEPT_TIMEOUT = 0.5
+
+
+class PeerServer(threading.Thread):
+    """
+    A thread used by the client to serve files of its repository to other clients (peers).
+    Peers are sent to fetch files from each other by the music server, so that new files spread between the clients
+    instead of being uploaded by the server to each of them.
+
+    Peer                                            PeerServer
+    FileSyncPacket(message_type=FETCH, offset)  --->    look for file (by content hash) in repository
+                                                <---    FileSyncPacket(message_type=FILE_SEND, offset)
+                                                <---    file's content from offset
+    """
+
+    def __init__(self, music_files_repo, catalog: SongCatalog, ip: str, port=0):
+        """
+        Initialize the peer server, listening at the given address.
+
+        :param music_files_repo: The client's repository, from which files are served.
+        :param catalog: Catalog of the repository, used for verifying the content of the files served.
+        :param ip: Address to listen at. The client listens only at the address it is connected to the server from,
+                   rather than at all of its interfaces.
+        :param port: Port to listen at. Default is any free port.
+        """
+        super().__init__(daemon=True)
+        self.music_files_repo = music_files_repo
+        self.catalog = catalog
+        self.listening_socket = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listening_socket.bind((ip, port))
+        self.listening_socket.listen(socket.SOMAXCONN)
+        self.listening_socket.settimeout(ACCEPT_TIMEOUT)
+        self.port = self.listening_socket.getsockname()[1]
+        self.should_stop = threading.Event()
+
+    def run(self):
+        """
+        Accept peers and serve each of them on its own thread, until `stop` is called.
+        """
+        while not self.should_stop.is_set():
+            try:
+                conn, address = self.listening_socket.accept()
+            except socket.timeout:
+                continue
+            except OSError as e:
+                print(f"An error occured on peer server: {e}")
+                break
+            threading.Thread(target=self._serve_peer, args=(conn, address), daemon=True).start()
+        self.listening_socket.close()
+
+    def stop(self):
+        self.should_stop.set()
+
+    def _serve_peer(self, conn: LengthSocket, address):
+        """
+        Serve a single FETCH request of a peer. A peer that asks for a file the repository doesn't have (or for an
+        offset past its end) is answered MISSING, and a malformed request is dropped.
+        """
+        with conn:
+            try:
+                conn.settimeout(PEER_TIMEOUT)
+                request = GeneralPacket(conn.recv())[FileSyncPacket]
+                if request.message_type != FETCH:
+                    return
+                file_name = os.path.basename(request.file_name.decode('utf-8'))
+                file_hash = request.file_hash.decode('utf-8')
+                local_path = os.path.join(self.music_files_repo, file_name)
+                if not os.path.exists(local_path) or self.catalog.hash_of(local_path) != file_hash or \
+                        request.offset > os.path.getsize(local_path):
+                    conn.send(FileSyncPacket(message_type=MISSING, file_name=file_name))
+                    return
+                print(f"Serving {local_path} to peer {address[0]}:{address[1]} from {request.offset}")
+                conn.send(file_send_packet(local_path, file_hash, request.offset))
+                conn.send_file(local_path, request.offset)
+            except (OSError, ValueError, IndexError, struct.error) as e:
+                print(f"Could not serve peer {address[0]}:{address[1]}: {e}")
@@ -1,25 +1,104 @@
+import collections
 import datetime
+import statistics
 import time
+from typing import Callable, Dict
 
-from ntplib import NTPClient
+from syncalong.client.clock_service import ClockService
+
+# The last part of every wait is spent spinning on the clock, since sleeping may oversleep by a few milliseconds.
+BUSY_WAIT_SECONDS = 0.002
+LATENESS_HISTORY = 1000
+
+
+def wait_until(deadline: float, busy_wait: float = BUSY_WAIT_SECONDS) -> float:
+    """
+    Wait until the given `time.monotonic()` deadline: sleep until shortly before it, and then spin until it is met.
+
+    :param deadline: Monotonic time to wait until.
+    :param busy_wait: Seconds before the deadline to stop sleeping and start spinning.
+    :return: Seconds the deadline was actually met after (positive if it had already passed).
+    """
+    remaining = deadline - time.monotonic()
+    if remaining > busy_wait:
+        time.sleep(remaining - busy_wait)
+    now = time.monotonic()
+    while now < deadline:
+        now = time.monotonic()
+    return now - deadline
+
+
+def remote_to_monotonic(remote_timestamp: float, clock: ClockService) -> float:
+    """
+    Convert a timestamp of the remote clock to a `time.monotonic()` time, using the clock's estimated offset.
+    The wall clock is read only for the conversion, so it jumping afterwards doesn't affect waiting for the result.
+    """
+    return time.monotonic() + (remote_timestamp - clock.remote_time())
 
 
 def wait_for_remote_time(remote_start_time: datetime.datetime,
-                         wait_time_seconds: int,
-                         ntp_server,
-                         ntp_port=123):
+                         wait_time_seconds: float,
+                         clock: ClockService) -> float:
     """
     Wait the given amount of seconds, starting from the given remote time. The function returns when the remote
     time is exactly remote_start_time + wait_time_seconds.
+    The remote time is read from the given clock service, so waiting never queries the NTP server.
+
+    :return: Seconds the remote time was actually met after (see `wait_until`).
     """
-    wait_delta = datetime.timedelta(seconds=wait_time_seconds)
-    target_time = remote_start_time + wait_delta
-    current_remote_time = get_remote_time(ntp_server, ntp_port)
-    if target_time > current_remote_time:
-        time.sleep((target_time - current_remote_time).seconds)
+    target_time = remote_start_time.timestamp() + wait_time_seconds
+    return wait_until(remote_to_monotonic(target_time, clock))
+
+
+class PreciseScheduler(object):
+    """
+    Runs actions at given times of the remote clock, as precisely as the local clock allows (see `wait_until`), and
+    keeps how late every action was run by command, for reporting the synchronization accuracy:
+
+        scheduler.run_at(send_timestamp + wait_seconds, pygame.mixer.music.play, "PLAY")
+        print(scheduler.summary())
+    """
+
+    def __init__(self, clock: ClockService, busy_wait: float = BUSY_WAIT_SECONDS):
+        """
+        :param clock: Clock service estimating the remote time.
+        :param busy_wait: Seconds before every deadline to stop sleeping and start spinning.
+        """
+        self.clock = clock
+        self.busy_wait = busy_wait
+        self.lateness: Dict[str, collections.deque] = collections.defaultdict(
+            lambda: collections.deque(maxlen=LATENESS_HISTORY))
+
+    def run_at(self, remote_timestamp: float, action: Callable, command: str = ""):
+        """
+        Wait until the given remote time, and then run the action.
+
+        :param remote_timestamp: Time of the remote clock to run the action at.
+        :param action: Function to run (without arguments).
+        :param command: Name of the command the action is for, to report lateness by.
+        :return: The action's return value.
+        """
+        late = wait_until(remote_to_monotonic(remote_timestamp, self.clock), self.busy_wait)
+        self.lateness[command].append(late)
+        return action()
 
+    def stats(self, command: str) -> Dict[str, float]:
+        """
+        Statistics of the lateness of the given command's actions, in seconds.
+        """
+        lateness = sorted(self.lateness.get(command, ()))
+        if not lateness:
+            return {"count": 0}
+        return {"count": len(lateness),
+                "mean": statistics.mean(lateness),
+                "p50": lateness[len(lateness) // 2],
+                "p99": lateness[min(len(lateness) - 1, int(len(lateness) * 0.99))],
+                "max": lateness[-1]}
 
-def get_remote_time(ntp_server, ntp_port=123):
-    ntp_client = NTPClient()
-    result = ntp_client.request(ntp_server, port=ntp_port)
-    return datetime.datetime.fromtimestamp(result.tx_time)
+    def summary(self) -> str:
+        lines = []
+        for command in self.lateness:
+            stats = self.stats(command)
+            lines.append(f"{command or 'action'}: {stats['count']} runs, late by {stats['p50'] * 1e3:.3f} ms (p50), "
+                         f"{stats['p99'] * 1e3:.3f} ms (p99), {stats['max'] * 1e3:.3f} ms (max)")
+        return "\n".join(lines)
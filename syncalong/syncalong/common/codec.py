@@ -0,0 +1,30 @@
+"""
+Helpers shared by the packets of this program's protocol.
+
+Every packet is a dataclass that encodes itself with precompiled `struct` formats. All the numbers on the wire are
+big-endian, and every variable-length field is preceded by its length.
+"""
+import struct
+from typing import Union
+
+UINT = struct.Struct("!I")
+USHORT = struct.Struct("!H")
+
+
+def to_bytes(value: Union[str, bytes]) -> bytes:
+    """
+    Convert a string field to bytes (encoded as UTF-8). Bytes are returned as-is.
+    """
+    return value.encode('utf-8') if isinstance(value, str) else bytes(value)
+
+
+def read_field(data, offset: int, length: int) -> bytes:
+    """
+    Read a variable-length field from the given offset of the data.
+
+    :raise ValueError: If the data is too short to hold the field.
+    """
+    end = offset + length
+    if end > len(data):
+        raise ValueError(f"Packet is too short: field of {length} bytes at {offset}, but only {len(data)} bytes")
+    return bytes(data[offset:end])
@@ -0,0 +1,87 @@
+"""
+Streaming compression of song files.
+
+Clients that miss a file tell the server which codecs they can decompress, in order of preference. The server picks
+the first of them it supports, and sends the file compressed (see `CompressionCache`), unless the file's format is
+already compressed or compressing it barely saves anything.
+zlib is always supported. zstd is supported only if the `zstandard` package is installed.
+"""
+import os
+import zlib
+from typing import List
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZLIB = "zlib"
+ZSTD = "zstd"
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+COMPRESS_READ_SIZE = 1024 * 1024
+
+COMPRESSED_EXTENSIONS = {".mp3", ".ogg", ".oga", ".opus", ".m4a", ".aac", ".flac", ".wma", ".zip", ".gz"}
+
+
+def supported_codecs() -> List[str]:
+    """
+    Codecs supported by this side, in order of preference.
+    """
+    return [ZSTD, ZLIB] if zstandard is not None else [ZLIB]
+
+
+def choose_codec(offered: List[str]) -> str:
+    """
+    Choose the codec to send a file with: the first of the offered codecs which is supported.
+
+    :param offered: Codecs supported by the receiver, in order of preference.
+    :return: The chosen codec, or an empty string if none of them is supported.
+    """
+    supported = supported_codecs()
+    return next((codec for codec in offered if codec in supported), "")
+
+
+def is_compressible(file_path: str) -> bool:
+    """
+    Whether the file's format is not compressed already (by its extension).
+    """
+    return os.path.splitext(file_path)[1].lower() not in COMPRESSED_EXTENSIONS
+
+
+def compress_file(source_path: str, target_path: str, codec: str) -> int:
+    """
+    Compress a file with the given codec, reading it in chunks so it is never held in memory as a whole.
+
+    :param source_path: Path of the file to compress.
+    :param target_path: Path to write the compressed file to.
+    :param codec: One of the supported codecs.
+    :return: Size of the compressed file.
+    """
+    compressor = _compressor(codec)
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        for chunk in iter(lambda: source.read(COMPRESS_READ_SIZE), b""):
+            target.write(compressor.compress(chunk))
+        target.write(compressor.flush())
+        return target.tell()
+
+
+def decompressor(codec: str):
+    """
+    Create a streaming decompressor for the given codec. Compressed data is passed to its `decompress` method chunk
+    by chunk, which returns the data decompressed so far.
+    """
+    if codec == ZLIB:
+        return zlib.decompressobj()
+    if codec == ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unsupported codec: {codec}")
+
+
+def _compressor(codec: str):
+    if codec == ZLIB:
+        return zlib.compressobj(ZLIB_LEVEL)
+    if codec == ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(f"Unsupported codec: {codec}")
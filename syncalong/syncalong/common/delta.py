@@ -0,0 +1,184 @@
+"""
+Block-level delta encoding of files, in the spirit of rsync.
+
+The receiver of a file splits its existing (old) copy into blocks, and sends the signature of every block: a weak
+rolling checksum and a strong hash. The sender slides a window over its new copy, and every window whose signature
+matches a block of the old copy is replaced by an instruction to copy that block. Only the data between matches has
+to be sent.
+"""
+import hashlib
+import math
+import mmap
+import struct
+import zlib
+from typing import List, Optional, Tuple
+
+MIN_BLOCK_SIZE = 2048
+MAX_LITERAL_RATIO = 0.5
+# The window is rolled byte by byte (in Python), so an unrelated file is given up on if no block matches in any of a
+# few windows spread over it (its start, middle and end), each of these bytes long.
+MATCH_PROBE_SIZE = 256 * 1024
+MATCH_PROBES = 3
+
+COPY = 0
+DATA = 1
+
+ADLER_MOD = 65521
+SIGNATURE_FORMAT = struct.Struct("!I16s")
+
+Signature = Tuple[int, bytes]
+Operation = Tuple[int, int, int]
+
+
+def delta_block_size(file_size: int) -> int:
+    """
+    Choose the block size for the signatures of a file: about the square root of the file's size, so that the amount
+    of signatures and the size of every block grow together.
+    """
+    return max(MIN_BLOCK_SIZE, int(math.sqrt(file_size)) // 8 * 8)
+
+
+def strong_hash(block) -> bytes:
+    return hashlib.md5(block).digest()
+
+
+def block_signatures(file_path: str, block_size: int) -> List[Signature]:
+    """
+    Calculate the signatures of all the full blocks of a file. A partial block at the end of the file is skipped.
+
+    :param file_path: Path of the file.
+    :param block_size: Size of every block.
+    :return: List of (weak checksum, strong hash) of every block, by order.
+    """
+    signatures = []
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) < block_size:
+                break
+            signatures.append((zlib.adler32(block), strong_hash(block)))
+    return signatures
+
+
+def pack_signatures(signatures: List[Signature]) -> bytes:
+    return b"".join(SIGNATURE_FORMAT.pack(weak, strong) for weak, strong in signatures)
+
+
+def unpack_signatures(data: bytes) -> List[Signature]:
+    return list(SIGNATURE_FORMAT.iter_unpack(data))
+
+
+def delta_plan(file_path: str, block_size: int, signatures: List[Signature]) -> Optional[List[Operation]]:
+    """
+    Plan how to build the given file out of the blocks of an old copy of it, whose signatures are given.
+
+    The plan is a list of operations, each is one of:
+        (COPY, offset, count): copy `count` bytes from `offset` of the old copy.
+        (DATA, offset, count): send `count` bytes from `offset` of the given file.
+    Consecutive operations of the same kind are merged.
+
+    :param file_path: Path of the (new) file to be built.
+    :param block_size: Size of the blocks of the old copy.
+    :param signatures: Signatures of the blocks of the old copy (see `block_signatures`).
+    :return: The plan, or None if more than `MAX_LITERAL_RATIO` of the file would have to be sent anyway, or if no
+             block matched in any of the probed windows of it (see `MATCH_PROBES`).
+    """
+    blocks = {}
+    for index, (weak, strong) in enumerate(signatures):
+        blocks.setdefault(weak, {}).setdefault(strong, index)
+
+    with open(file_path, 'rb') as f:
+        file_size = f.seek(0, 2)
+        if file_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if not _probe(data, file_size, block_size, blocks):
+                return None
+            return _plan(data, file_size, block_size, blocks)
+
+
+def _probe(data, file_size: int, block_size: int, blocks: dict) -> bool:
+    """
+    Check whether any block matches in one of `MATCH_PROBES` windows of `MATCH_PROBE_SIZE` bytes, spread evenly from the
+    start of the file to its end.
+    """
+    last_start = max(0, file_size - block_size - MATCH_PROBE_SIZE)
+    starts = sorted({last_start * probe // (MATCH_PROBES - 1) for probe in range(MATCH_PROBES)})
+    for start in starts:
+        end = min(start + MATCH_PROBE_SIZE, file_size - block_size + 1)
+        weak = None
+        for position in range(start, end):
+            if weak is None:
+                weak = zlib.adler32(data[position:position + block_size])
+            candidates = blocks.get(weak)
+            if candidates and strong_hash(data[position:position + block_size]) in candidates:
+                return True
+            byte_in = data[position + block_size] if position + block_size < file_size else None
+            weak = _roll(weak, data[position], byte_in, block_size)
+            if weak is None:
+                break
+    return False
+
+
+def _plan(data, file_size: int, block_size: int, blocks: dict) -> Optional[List[Operation]]:
+    max_literal = file_size * MAX_LITERAL_RATIO
+    plan = []
+    literal = 0
+    literal_start = 0
+    position = 0
+    weak = None
+    while position + block_size <= file_size:
+        if weak is None:
+            weak = zlib.adler32(data[position:position + block_size])
+        candidates = blocks.get(weak)
+        if candidates:
+            index = candidates.get(strong_hash(data[position:position + block_size]))
+            if index is not None:
+                _append(plan, DATA, literal_start, position - literal_start)
+                _append(plan, COPY, index * block_size, block_size)
+                position += block_size
+                literal_start = position
+                weak = None
+                continue
+
+        literal += 1
+        if literal > max_literal:
+            return None
+        weak = _roll(weak, data[position], data[position + block_size] if position + block_size < file_size else None,
+                     block_size)
+        position += 1
+        if weak is None:
+            break
+    _append(plan, DATA, literal_start, file_size - literal_start)
+    return plan
+
+
+def _roll(weak: int, byte_out: int, byte_in: Optional[int], block_size: int) -> Optional[int]:
+    """
+    Move the adler32 checksum of a window one byte forward. Returns None if the window reached the end of the data.
+    """
+    if byte_in is None:
+        return None
+    a = weak & 0xffff
+    b = weak >> 16
+    a = (a - byte_out + byte_in) % ADLER_MOD
+    b = (b - block_size * byte_out + a - 1) % ADLER_MOD
+    return b << 16 | a
+
+
+def _append(plan: List[Operation], kind: int, offset: int, count: int):
+    if count == 0:
+        return
+    if plan:
+        last_kind, last_offset, last_count = plan[-1]
+        if last_kind == kind and last_offset + last_count == offset:
+            plan[-1] = (kind, last_offset, last_count + count)
+            return
+    plan.append((kind, offset, count))
+
+
+def plan_literal_size(plan: List[Operation]) -> int:
+    """
+    Amount of bytes of the file that have to be sent by the given plan.
+    """
+    return sum(count for kind, _, count in plan if kind == DATA)
@@ -1,46 +1,228 @@
 import os
+import struct
+from dataclasses import dataclass
 from typing import List
 
-from scapy.fields import IntEnumField, FieldLenField, StrField, IntField
-from scapy.packet import Packet
+from syncalong.common.codec import UINT, USHORT, to_bytes, read_field
+from syncalong.common.delta import COPY, Operation, block_signatures, delta_block_size, pack_signatures
+from syncalong.common.multicast import Range, pack_ranges
+from syncalong.common.song_catalog import SongCatalog
 
 MISSING = 0
 HAVE = 1
 WHO_HAS = 2
 FILE_SEND = 3
+DELTA_SEND = 4
+DELTA_COPY = 5
+DELTA_DATA = 6
+FETCH = 7
+MULTICAST_SEND = 8
+MULTICAST_END = 9
+NACK = 10
 
-message_types = {WHO_HAS: "WHO_HAS", HAVE: "HAVE", MISSING: "MISSING", FILE_SEND: "FILE_SEND"}
+FILE_CHUNK_SIZE = 64 * 1024
 
+message_types = {WHO_HAS: "WHO_HAS", HAVE: "HAVE", MISSING: "MISSING", FILE_SEND: "FILE_SEND",
+                 DELTA_SEND: "DELTA_SEND", DELTA_COPY: "DELTA_COPY", DELTA_DATA: "DELTA_DATA", FETCH: "FETCH",
+                 MULTICAST_SEND: "MULTICAST_SEND", MULTICAST_END: "MULTICAST_END", NACK: "NACK"}
 
-class FileSyncPacket(Packet):
-    name = "file_sync_packet"
-    fields_desc = [
-        IntEnumField("message_type", 1, message_types),
-        IntField("file_size", 0),
-        FieldLenField("file_name_len", None, length_of="file_name"),
-        StrField("file_name", ""),
-    ]
 
+# message_type, file_size, file_name_len
+FILE_SYNC_HEADER = struct.Struct("!IIH")
+# offset, block_size, signatures_len
+FILE_SYNC_BLOCKS = struct.Struct("!III")
+# peer_port, codecs_len
+FILE_SYNC_PEER = struct.Struct("!HH")
 
-def who_has_packet(file_path: str) -> FileSyncPacket:
+
+@dataclass
+class FileSyncPacket:
+    """
+    A message of the file sync protocol (see `MusicServer.serve_music_file`). The fields used depend on the message
+    type. String fields may be given as str, and are always kept as bytes.
+    """
+    message_type: int = HAVE
+    file_size: int = 0
+    file_name: bytes = b""
+    file_hash: bytes = b""
+    offset: int = 0
+    block_size: int = 0
+    signatures: bytes = b""
+    peer_host: bytes = b""
+    peer_port: int = 0
+    codecs: bytes = b""
+    content_size: int = 0
+
+    def __post_init__(self):
+        self.file_name = to_bytes(self.file_name)
+        self.file_hash = to_bytes(self.file_hash)
+        self.signatures = to_bytes(self.signatures)
+        self.peer_host = to_bytes(self.peer_host)
+        self.codecs = to_bytes(self.codecs)
+
+    def encode(self) -> bytes:
+        file_name = to_bytes(self.file_name)
+        file_hash = to_bytes(self.file_hash)
+        signatures = to_bytes(self.signatures)
+        peer_host = to_bytes(self.peer_host)
+        codecs = to_bytes(self.codecs)
+        return b"".join((FILE_SYNC_HEADER.pack(self.message_type, self.file_size, len(file_name)), file_name,
+                         USHORT.pack(len(file_hash)), file_hash,
+                         FILE_SYNC_BLOCKS.pack(self.offset, self.block_size, len(signatures)), signatures,
+                         USHORT.pack(len(peer_host)), peer_host,
+                         FILE_SYNC_PEER.pack(self.peer_port, len(codecs)), codecs,
+                         UINT.pack(self.content_size)))
+
+    @classmethod
+    def decode(cls, data, offset: int = 0) -> "FileSyncPacket":
+        """
+        Parse a packet encoded by `encode`, starting at the given offset of the data.
+
+        :raise ValueError: If the data is not a valid packet.
+        """
+        try:
+            message_type, file_size, length = FILE_SYNC_HEADER.unpack_from(data, offset)
+            offset += FILE_SYNC_HEADER.size
+            file_name = read_field(data, offset, length)
+            offset += length
+            length, = USHORT.unpack_from(data, offset)
+            offset += USHORT.size
+            file_hash = read_field(data, offset, length)
+            offset += length
+            file_offset, block_size, length = FILE_SYNC_BLOCKS.unpack_from(data, offset)
+            offset += FILE_SYNC_BLOCKS.size
+            signatures = read_field(data, offset, length)
+            offset += length
+            length, = USHORT.unpack_from(data, offset)
+            offset += USHORT.size
+            peer_host = read_field(data, offset, length)
+            offset += length
+            peer_port, length = FILE_SYNC_PEER.unpack_from(data, offset)
+            offset += FILE_SYNC_PEER.size
+            codecs = read_field(data, offset, length)
+            offset += length
+            content_size, = UINT.unpack_from(data, offset)
+        except struct.error as e:
+            raise ValueError(f"Invalid file sync packet: {e}")
+        return cls(message_type, file_size, file_name, file_hash, file_offset, block_size, signatures, peer_host,
+                   peer_port, codecs, content_size)
+
+
+def who_has_packet(file_path: str, file_hash: str = "") -> FileSyncPacket:
     return FileSyncPacket(message_type=WHO_HAS,
                           file_name=os.path.basename(file_path),
-                          file_size=os.path.getsize(file_path))
+                          file_size=os.path.getsize(file_path),
+                          file_hash=file_hash)
+
 
+def who_has_answer_packet(file_path: str, file_size: int, file_hash: str = "",
+                          catalog: SongCatalog = None) -> FileSyncPacket:
+    """
+    Answer whether the given local file is the one asked for by a WHO_HAS packet.
+    If the WHO_HAS packet carries a content hash and a catalog is given, the file must have the same content.
+    Otherwise, the file must have the same size.
 
-def who_has_answer_packet(file_path: str, file_size: int) -> FileSyncPacket:
-    response = HAVE
-    if not os.path.exists(file_path) or os.path.getsize(file_path) != file_size:
-        response = MISSING
+    :param file_path: Local path of the file asked for.
+    :param file_size: Size of the file asked for.
+    :param file_hash: Content hash of the file asked for, if known.
+    :param catalog: Catalog of the local files, used for getting the hash of the local file.
+    :return: HAVE or MISSING packet.
+    """
+    response = MISSING
+    if os.path.exists(file_path):
+        if file_hash and catalog is not None:
+            if catalog.hash_of(file_path) == file_hash:
+                response = HAVE
+        elif os.path.getsize(file_path) == file_size:
+            response = HAVE
     print("Who has response: {}".format(message_types[response]))
-    return FileSyncPacket(message_type=response)
+    return FileSyncPacket(message_type=response, file_name=os.path.basename(file_path))
+
+
+def signatures_answer_packet(file_path: str) -> FileSyncPacket:
+    """
+    Answer a WHO_HAS packet with MISSING, along with the block signatures of the existing (outdated) local file, so
+    that only the difference will be sent (see `delta`).
+
+    :param file_path: Local path of the outdated file.
+    :return: MISSING packet with the block size and signatures of the local file.
+    """
+    block_size = delta_block_size(os.path.getsize(file_path))
+    return FileSyncPacket(message_type=MISSING,
+                          file_name=os.path.basename(file_path),
+                          block_size=block_size,
+                          signatures=pack_signatures(block_signatures(file_path, block_size)))
 
 
-def send_file_packets(file_path: str) -> List[FileSyncPacket]:
-    packets = [FileSyncPacket(message_type=FILE_SEND,
-                              file_name=os.path.basename(file_path),
-                              file_size=os.path.getsize(file_path))]
-    with open(file_path, 'rb') as file_to_send:
-        data = file_to_send.read()
-        packets.append(data)
-    return packets
+def delta_packets(file_path: str, file_hash: str, block_size: int, plan: List[Operation]):
+    """
+    Generate the packets needed for sending a file by a delta plan: a DELTA_SEND packet, followed by a packet for every
+    operation in the plan. DELTA_COPY packets tell the client which part of its old copy to copy, and DELTA_DATA packets
+    are followed by a part of the file's content (not generated, and should be sent by the caller).
+
+    :param file_path: Path of the file to be sent.
+    :param file_hash: Content hash of the file.
+    :param block_size: Block size of the client's signatures.
+    :param plan: Plan to send (see `delta.delta_plan`).
+    :return: Generator of the packets.
+    """
+    yield FileSyncPacket(message_type=DELTA_SEND,
+                         file_name=os.path.basename(file_path),
+                         file_size=os.path.getsize(file_path),
+                         file_hash=file_hash,
+                         block_size=block_size)
+    for kind, offset, count in plan:
+        yield FileSyncPacket(message_type=DELTA_COPY if kind == COPY else DELTA_DATA, offset=offset, file_size=count)
+
+
+def fetch_packet(file_path: str, file_hash: str, peer_host: str, peer_port: int) -> FileSyncPacket:
+    """
+    Create a FETCH packet, telling a client to fetch the given file from the peer at the given address.
+    The client asks the peer for the file with a FETCH packet of its own (holding the offset to start from), and
+    then answers whether it has the file, like it answers WHO_HAS.
+    """
+    return FileSyncPacket(message_type=FETCH,
+                          file_name=os.path.basename(file_path),
+                          file_size=os.path.getsize(file_path),
+                          file_hash=file_hash,
+                          peer_host=peer_host,
+                          peer_port=peer_port)
+
+
+def multicast_send_packet(file_path: str, file_hash: str, group: str, port: int,
+                          block_size: int) -> FileSyncPacket:
+    """
+    Create a MULTICAST_SEND packet, telling a client to join the given multicast group and receive the file's blocks
+    from it (see `multicast`). The client answers MISSING once it joined the group.
+    """
+    return FileSyncPacket(message_type=MULTICAST_SEND,
+                          file_name=os.path.basename(file_path),
+                          file_size=os.path.getsize(file_path),
+                          file_hash=file_hash,
+                          block_size=block_size,
+                          peer_host=group,
+                          peer_port=port)
+
+
+def nack_packet(file_path: str, ranges: List[Range]) -> FileSyncPacket:
+    """
+    Create a NACK packet, asking for the given (offset, count) byte ranges of a file that were not received by
+    multicast. The ranges are sent back as DELTA_DATA packets, each followed by its content.
+    """
+    return FileSyncPacket(message_type=NACK, file_name=os.path.basename(file_path), signatures=pack_ranges(ranges))
+
+
+def file_send_packet(file_path: str, file_hash: str = "", offset: int = 0, codec: str = "",
+                     content_size: int = 0) -> FileSyncPacket:
+    """
+    Create the FILE_SEND packet that precedes the content of the given file.
+    If an offset is given, only the content from this offset on follows the packet (resuming a transfer).
+    If a codec is given, the content follows compressed with this codec, and its (compressed) size must be given.
+    """
+    return FileSyncPacket(message_type=FILE_SEND,
+                          file_name=os.path.basename(file_path),
+                          file_size=os.path.getsize(file_path),
+                          file_hash=file_hash,
+                          offset=offset,
+                          codecs=codec,
+                          content_size=content_size)
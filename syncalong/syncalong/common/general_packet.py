@@ -1,7 +1,7 @@
-from scapy.compat import raw
-from scapy.fields import IntEnumField, ConditionalField, PacketField
-from scapy.packet import Packet, bind_layers, Padding
+from dataclasses import dataclass
+from typing import Union
 
+from syncalong.common.codec import UINT
 from syncalong.common.signal_packet import SignalPacket
 from syncalong.common.file_sync_packet import FileSyncPacket
 
@@ -9,34 +9,65 @@ from syncalong.common.file_sync_packet import FileSyncPacket
 all_layers = [SignalPacket, FileSyncPacket]
 
 layers_dict = {}
+layer_types = {}
 
 for idx, layer in enumerate(all_layers):
-    bind_layers(layer, Padding)
     layers_dict.update({idx: layer.__name__})
+    layer_types[layer] = idx
 
+RAW_DATA_TYPES = (bytes, bytearray, memoryview)
 
-def condition(layer_cls) -> ConditionalField:
-    """
-    Create a conditional layer field. the layer must be present in `all_layers`.
-    :param layer_cls: Layer class to create conditional field for.
-    :return: Conditional field representing the given layer.
-    """
-    return ConditionalField(PacketField(layer_cls._name, layer_cls(), layer_cls),
-                            lambda pkt: pkt.layer_type == all_layers.index(layer_cls))
 
-
-class GeneralPacket(Packet):
+@dataclass
+class GeneralPacket:
     """
     Packet that holds messages of specific types.
     This packet was made in order to make communication with the multiple protocols easy, and handle different requests
     in an agnostic way (without checking types all the time).
+
+    On the wire, the packet is the type of the inner packet (its index in `all_layers`), followed by the inner packet.
+    A GeneralPacket may be created from an inner packet, or from received data (which is parsed):
+
+        GeneralPacket(data)[FileSyncPacket]
+
+    :raise ValueError: If created from data that is not a valid packet.
+    """
+    payload: Union[SignalPacket, FileSyncPacket]
+
+    def __post_init__(self):
+        if isinstance(self.payload, RAW_DATA_TYPES):
+            self.payload = decode_payload(self.payload)
+
+    @property
+    def layer_type(self) -> int:
+        return layer_types[type(self.payload)]
+
+    def __getitem__(self, layer_cls):
+        """
+        Get the inner packet, which must be of the given type.
+
+        :raise IndexError: If the inner packet is of another type.
+        """
+        if type(self.payload) is not layer_cls:
+            raise IndexError(f"Layer [{layer_cls.__name__}] not found in {self.payload!r}")
+        return self.payload
+
+    def encode(self) -> bytes:
+        return UINT.pack(self.layer_type) + self.payload.encode()
+
+
+def decode_payload(data) -> Union[SignalPacket, FileSyncPacket]:
+    """
+    Parse the inner packet out of a GeneralPacket's data.
+
+    :raise ValueError: If the data is not a valid packet.
     """
-    name = "GeneralPacket"
-    fields_desc = [
-        IntEnumField("layer_type", 1, layers_dict),
-        condition(SignalPacket),
-        condition(FileSyncPacket),
-    ]
+    if len(data) < UINT.size:
+        raise ValueError(f"Packet is too short: {len(data)} bytes")
+    layer_type, = UINT.unpack_from(data)
+    if layer_type >= len(all_layers):
+        raise ValueError(f"Unknown layer type: {layer_type}")
+    return all_layers[layer_type].decode(data, UINT.size)
 
 
 def handle_packet(pkt: GeneralPacket, type_handlers):
@@ -49,10 +80,8 @@ def handle_packet(pkt: GeneralPacket, type_handlers):
     :param type_handlers: dictionary mapping layer type to its handler function.
     :return: Return value of handler function.
     """
-    layer_type = all_layers[pkt.layer_type]
-    handler = type_handlers[layer_type]
-    inner_pkt = pkt[layer_type]
-    return handler(inner_pkt)
+    handler = type_handlers[type(pkt.payload)]
+    return handler(pkt.payload)
 
 
 def generate_packet(pkt) -> GeneralPacket:
@@ -61,8 +90,4 @@ def generate_packet(pkt) -> GeneralPacket:
     :param pkt: Packet to be wrapped (type must be one of the types in `all_layers`)
     :return: GeneralPacket with the given packet as an inner field.
     """
-    gp = GeneralPacket(
-        layer_type=pkt.__class__.__name__,
-    )
-    gp.__setattr__(pkt._name, pkt)
-    return gp
\ No newline at end of file
+    return GeneralPacket(pkt)
@@ -1,9 +1,9 @@
+import asyncio
 import socket
 import _socket
 from typing import List
 
-from scapy.compat import raw
-
+from syncalong.common.codec import UINT
 from syncalong.common.general_packet import GeneralPacket, generate_packet
 
 
@@ -15,6 +15,41 @@ def int_from_bytes(xbytes: bytes) -> int:
     return int.from_bytes(xbytes, 'big')
 
 
+RAW_TYPES = (bytes, bytearray, memoryview)
+RECV_BUFFER_SIZE = 64 * 1024
+MAX_SEND_BUFFERS = 512
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+
+def build_frames(packets) -> List[bytes]:
+    """
+    Build the given packets into a list of buffers to be sent: every packet is preceded by its length, and raw buffers
+    are sent as-is (see `LengthSocket.send`).
+    """
+    buffers = []
+    for packet in packets:
+        if isinstance(packet, RAW_TYPES):
+            buffers.append(packet)
+        else:
+            data = build_packet(packet)
+            buffers.append(int_to_bytes(len(data)))
+            buffers.append(data)
+    return buffers
+
+
+def build_packet(packet) -> bytes:
+    """
+    Build a packet of this program's protocol into bytes (without its length).
+    A custom packet is wrapped with GeneralPacket before it is built.
+
+    :param packet: GeneralPacket, or a custom packet which is part of this program's protocol.
+    :return: The built packet.
+    """
+    if not isinstance(packet, GeneralPacket):
+        packet = generate_packet(packet)
+    return packet.encode()
+
+
 class LengthSocket(socket.socket):
     """
     A socket that is designed to send / receive messages by length.
@@ -23,50 +58,219 @@ class LengthSocket(socket.socket):
 
     Length packet also offers integration with packets used by server / clients in this program, and is responsible
     for building the packets properly before sending them.
+
+    Received data is read into a reusable buffer, as much as is available in every system call, so several messages
+    may be parsed out of a single call. Since buffered data is not seen by `select`, callers that wait for the socket
+    to become readable should check `pending` first.
     """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._recv_buffer = bytearray(RECV_BUFFER_SIZE)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._recv_start = 0
+        self._recv_end = 0
+
     def send(self, packet, flags: int = ...) -> int:
         """
         Send a single packet (alongside its length).
         A packet might be of type GeneralPacket, of a specific custom packet which is part of this program's
         protocol (to be wrapped by GeneralPacket), or simple bytes.
 
-        If bytes are passed, they'll be sent as-is.
+        If bytes (or any other raw buffer) are passed, they'll be sent as-is.
         If a GeneralPacket is passed, it'll be built and sent.
         If a custom packet is passed, it'll be wrapped with GeneralPacket, and then built and sent.
+        The length and the packet are sent together, in a single system call when possible.
 
         :param packet: The packet (or bytes) to be sent.
         :param flags: Ignored.
         :return: Total amount of bytes sent.
         """
-        to_send = packet
-        sent_len = 0
-        if not isinstance(to_send, bytes):
-            if not isinstance(packet, GeneralPacket):
-                to_send = generate_packet(packet)
-            to_send = raw(to_send)
-            sent_len = super().send(int_to_bytes(len(to_send)))
-        sent_data = super().send(to_send)
-        return sent_len + sent_data
+        if isinstance(packet, RAW_TYPES):
+            return super().send(packet)
+        return self._send_buffers(build_frames([packet]))
+
+    def send_batch(self, packets) -> int:
+        """
+        Send several packets (each alongside its length) at once, coalesced into as few system calls as possible.
+        Packets are handled exactly like in `send`, and the whole batch is always sent.
+
+        :param packets: The packets (or bytes) to be sent, by order.
+        :return: Total amount of bytes sent.
+        """
+        buffers = build_frames(packets)
+        return sum(self._send_buffers(buffers[start:start + MAX_SEND_BUFFERS])
+                   for start in range(0, len(buffers), MAX_SEND_BUFFERS))
+
+    def set_nodelay(self):
+        """
+        Disable Nagle's algorithm, so that small messages are sent right away instead of waiting for the previous ones
+        to be acknowledged. Every message is sent in a single write (see `send`), so it never holds up small writes
+        of its own.
+        """
+        self.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send_file(self, file_path: str, offset: int = 0, count: int = None) -> int:
+        """
+        Send the content of a file as-is (without its length), straight from the OS to the socket.
+        `os.sendfile` is used when the platform supports it, so that no userspace copies of the file are made.
+        Otherwise the file is read and sent in chunks.
+
+        :param file_path: Path of the file to be sent.
+        :param offset: Position in the file to start sending from.
+        :param count: Amount of bytes to send. If None, the file is sent until its end.
+        :return: Total amount of bytes sent.
+        """
+        with open(file_path, 'rb') as file_to_send:
+            return self.sendfile(file_to_send, offset, count)
+
+    async def async_send_file(self, file_path: str, loop: asyncio.AbstractEventLoop, offset: int = 0,
+                              count: int = None) -> int:
+        """
+        Send the content of a file like `send_file`, without blocking the given event loop.
+        The socket must be in non-blocking mode.
+
+        :param file_path: Path of the file to be sent.
+        :param loop: The event loop driving this socket.
+        :param offset: Position in the file to start sending from.
+        :param count: Amount of bytes to send. If None, the file is sent until its end.
+        :return: Total amount of bytes sent.
+        """
+        with open(file_path, 'rb') as file_to_send:
+            return await loop.sock_sendfile(self, file_to_send, offset, count, fallback=True)
 
     def recv(self, bufsize: int = -1, flags: int = ...) -> bytes:
         """
         Receive bytes from socket.
-        If bufsize is specified and is >= 0, the specific amount of bytes will be read.
-        Otherwise, the socket will first recv 4 bytes representing the message length, and then read it.
-        Receiving i done at once, for the entire buffer size (no split).
+        If bufsize is specified and is >= 0, up to this amount of bytes will be read (like `socket.recv`), buffered
+        bytes first.
+        Otherwise, a whole message will be read: 4 bytes representing the message length, and then the message itself.
+        The socket is read until the whole message arrived, no matter how many reads it takes.
 
         The return value is the data that was received (without length bytes).
 
         :param bufsize: The size of the data to recv, or -1 in order to receive a message with size specified.
         :param flags: Ignored.
         :return: The data received from the socket.
+        :raise ConnectionError: If the connection was closed before a whole message was received.
         """
         if bufsize >= 0:
+            if self.pending():
+                return self._take(min(bufsize, self.pending()))
             return super().recv(bufsize)
-        else:
-            length = int_from_bytes(super().recv(4))
-            return super().recv(int(length))
+        self._fill(UINT.size)
+        length, = UINT.unpack_from(self._recv_buffer, self._recv_start)
+        self._fill(UINT.size + length)
+        self._recv_start += UINT.size
+        return self._take(length)
+
+    def pending(self) -> int:
+        """
+        Amount of bytes that were received from the socket, and were not returned by `recv` yet.
+        """
+        return self._recv_end - self._recv_start
+
+    async def async_send(self, packet, loop: asyncio.AbstractEventLoop) -> int:
+        """
+        Send a single packet (alongside its length) without blocking the given event loop.
+        Packets are handled exactly like in `send`, but the whole message is always sent.
+        The socket must be in non-blocking mode.
+
+        :param packet: The packet (or bytes) to be sent.
+        :param loop: The event loop driving this socket.
+        :return: Total amount of bytes sent.
+        """
+        return await self.async_send_batch([packet], loop)
+
+    async def async_send_batch(self, packets, loop: asyncio.AbstractEventLoop) -> int:
+        """
+        Send several packets like `send_batch`, without blocking the given event loop. The packets are joined into a
+        single buffer, which is written at once.
+        The socket must be in non-blocking mode.
+
+        :param packets: The packets (or bytes) to be sent, by order.
+        :param loop: The event loop driving this socket.
+        :return: Total amount of bytes sent.
+        """
+        buffers = build_frames(packets)
+        to_send = buffers[0] if len(buffers) == 1 else b"".join(buffers)
+        await loop.sock_sendall(self, to_send)
+        return len(to_send)
+
+    async def async_recv(self, loop: asyncio.AbstractEventLoop, bufsize: int = -1) -> bytes:
+        """
+        Receive bytes from socket without blocking the given event loop.
+        If bufsize is specified and is >= 0, exactly this amount of bytes will be read.
+        Otherwise, a message preceded by its length will be read, and returned without its length bytes.
+        The socket must be in non-blocking mode.
+
+        :param loop: The event loop driving this socket.
+        :param bufsize: The size of the data to recv, or -1 in order to receive a message with size specified.
+        :return: The data received from the socket.
+        :raise ConnectionError: If the connection was closed before all the data was received.
+        """
+        if bufsize >= 0:
+            await self._async_fill(bufsize, loop)
+            return self._take(bufsize)
+        await self._async_fill(UINT.size, loop)
+        length, = UINT.unpack_from(self._recv_buffer, self._recv_start)
+        await self._async_fill(UINT.size + length, loop)
+        self._recv_start += UINT.size
+        return self._take(length)
+
+    def _send_buffers(self, buffers: List[bytes]) -> int:
+        """
+        Send all the given buffers, with a single scatter/gather `sendmsg` call if the platform supports it.
+        """
+        total = sum(map(len, buffers))
+        if not HAS_SENDMSG:
+            self.sendall(b"".join(buffers))
+            return total
+        sent = self.sendmsg(buffers)
+        if sent < total:
+            self.sendall(b"".join(buffers)[sent:])
+        return total
+
+    def _fill(self, size: int):
+        """
+        Read from the socket until at least `size` bytes are buffered.
+        """
+        self._reserve(size)
+        while self.pending() < size:
+            received = super().recv_into(self._recv_view[self._recv_end:])
+            if not received:
+                raise ConnectionError(f"Connection closed by {self}")
+            self._recv_end += received
+
+    async def _async_fill(self, size: int, loop: asyncio.AbstractEventLoop):
+        self._reserve(size)
+        while self.pending() < size:
+            received = await loop.sock_recv_into(self, self._recv_view[self._recv_end:])
+            if not received:
+                raise ConnectionError(f"Connection closed by {self}")
+            self._recv_end += received
+
+    def _reserve(self, size: int):
+        """
+        Make room in the buffer for `size` bytes from the start of the buffered data. The buffered data is moved to
+        the beginning of the buffer, and the buffer grows if it is smaller than `size`.
+        """
+        if self._recv_start + size <= len(self._recv_buffer):
+            return
+        buffered = self._recv_view[self._recv_start:self._recv_end].tobytes()
+        if size > len(self._recv_buffer):
+            self._recv_buffer = bytearray(size)
+            self._recv_view = memoryview(self._recv_buffer)
+        self._recv_buffer[:len(buffered)] = buffered
+        self._recv_start = 0
+        self._recv_end = len(buffered)
+
+    def _take(self, size: int) -> bytes:
+        data = self._recv_view[self._recv_start:self._recv_start + size].tobytes()
+        self._recv_start += size
+        if self._recv_start == self._recv_end:
+            self._recv_start = self._recv_end = 0
+        return data
 
     def accept(self):
         """
@@ -82,22 +286,3 @@ class LengthSocket(socket.socket):
     def __repr__(self):
         addr, port = self.getsockname()
         return f"<LengthSocket {addr}:{port}>"
-
-
-def send_to_all(sockets: List[LengthSocket], packets):
-    """
-    Send all the given packets to all the given sockets.
-    If there was a failure while trying to send a packet to a client, this client will not be receiving any more
-    of the packets that are sent.
-
-    :param sockets: Sockets to send the packets to.
-    :param packets: Packets to be sent to all clients.
-    """
-    for packet in packets:
-        for s in sockets:
-            try:
-                s.send(packet)
-            except (Exception, socket.error) as e:
-                print(f"Could not send packets to {s}: {e}")
-                print(f"Stopping transmit to {s}")
-                sockets.remove(s)
@@ -0,0 +1,102 @@
+"""
+Sending files to many clients at once over UDP multicast.
+
+The file is split into blocks, and every block is sent once to a multicast group, in a datagram of its own. After
+every `FEC_GROUP_SIZE` blocks the sender adds a parity block (the XOR of the group's blocks), so a receiver that lost a
+single block of a group recovers it without asking for it. Blocks that are still missing once the whole file was sent
+are asked for by the receiver (a NACK with their byte ranges), and repaired over its own connection.
+"""
+import socket
+import struct
+from typing import Iterable, List, Tuple
+
+MULTICAST_BLOCK_SIZE = 1400
+FEC_GROUP_SIZE = 8
+MULTICAST_TTL = 1
+MULTICAST_RATE = 8 * 1024 * 1024
+MULTICAST_RECV_BUFFER = 4 * 1024 * 1024
+
+DATA_BLOCK = 0
+PARITY_BLOCK = 1
+
+DATAGRAM_HEADER = struct.Struct("!8sIB")
+RANGE_FORMAT = struct.Struct("!II")
+
+Range = Tuple[int, int]
+
+
+def transfer_id(file_hash: str) -> bytes:
+    """
+    Identifier of a file's transfer, carried by each of its datagrams: the start of the file's content hash.
+    """
+    return bytes.fromhex(file_hash[:16])
+
+
+def block_count(file_size: int, block_size: int) -> int:
+    return (file_size + block_size - 1) // block_size
+
+
+def xor_blocks(blocks: Iterable[bytes], block_size: int) -> bytes:
+    """
+    XOR the given blocks together. Blocks shorter than `block_size` are padded with zeros.
+    """
+    parity = 0
+    for block in blocks:
+        parity ^= int.from_bytes(block.ljust(block_size, b"\0"), 'big')
+    return parity.to_bytes(block_size, 'big')
+
+
+def pack_datagram(file_hash: str, kind: int, index: int, payload: bytes) -> bytes:
+    """
+    Build a datagram holding a block of a file.
+
+    :param file_hash: Content hash of the file.
+    :param kind: DATA_BLOCK or PARITY_BLOCK.
+    :param index: Index of the block in the file (or, for a parity block, the index of its FEC group).
+    :param payload: Content of the block.
+    :return: The datagram.
+    """
+    return DATAGRAM_HEADER.pack(transfer_id(file_hash), index, kind) + payload
+
+
+def unpack_datagram(datagram: bytes) -> Tuple[bytes, int, int, bytes]:
+    """
+    Parse a datagram built by `pack_datagram`.
+
+    :return: Tuple of the transfer id, block kind, block index and payload.
+    """
+    transfer, index, kind = DATAGRAM_HEADER.unpack_from(datagram)
+    return transfer, kind, index, datagram[DATAGRAM_HEADER.size:]
+
+
+def pack_ranges(ranges: List[Range]) -> bytes:
+    return b"".join(RANGE_FORMAT.pack(offset, count) for offset, count in ranges)
+
+
+def unpack_ranges(data: bytes) -> List[Range]:
+    return list(RANGE_FORMAT.iter_unpack(data))
+
+
+def multicast_sender_socket(ttl: int = MULTICAST_TTL) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    return sock
+
+
+def multicast_receiver_socket(group: str, port: int, interface: str) -> socket.socket:
+    """
+    Create a socket that receives the datagrams sent to the given multicast group.
+
+    :param group: Address of the multicast group.
+    :param port: Port the datagrams are sent to.
+    :param interface: Address of the local interface to join the group on.
+    :return: The socket, in non-blocking mode.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MULTICAST_RECV_BUFFER)
+    sock.bind(("", port))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(group) + socket.inet_aton(interface))
+    sock.setblocking(False)
+    return sock
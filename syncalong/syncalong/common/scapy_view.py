@@ -0,0 +1,86 @@
+"""
+Scapy definitions of this program's packets, for inspecting messages while debugging. The program itself doesn't use
+scapy (see `general_packet`), so it is required only for this module:
+
+    from syncalong.common.scapy_view import dissect
+    dissect(data).show()
+"""
+from scapy.compat import raw
+from scapy.fields import ConditionalField, FieldLenField, IEEEDoubleField, IntEnumField, IntField, PacketField, \
+    ShortField, StrField, StrLenField
+from scapy.packet import Packet, Padding, bind_layers
+
+from syncalong.common.file_sync_packet import message_types
+from syncalong.common.general_packet import layers_dict
+from syncalong.common.signal_packet import DEFAULT_WAIT_SECONDS, commands
+
+
+class SignalPacket(Packet):
+    name = "signal_packet"
+    fields_desc = [IntEnumField("signal", 1, commands),
+                   IEEEDoubleField("send_timestamp", 0),
+                   IntField("wait_seconds", DEFAULT_WAIT_SECONDS),
+                   IntField("seq", 0),
+                   IEEEDoubleField("position", 0),
+                   FieldLenField("music_file_name_len", None, length_of="music_file_name"),
+                   StrField("music_file_name", "")]
+
+
+class FileSyncPacket(Packet):
+    name = "file_sync_packet"
+    fields_desc = [
+        IntEnumField("message_type", 1, message_types),
+        IntField("file_size", 0),
+        FieldLenField("file_name_len", None, length_of="file_name"),
+        StrLenField("file_name", "", length_from=lambda pkt: pkt.file_name_len),
+        FieldLenField("file_hash_len", None, length_of="file_hash"),
+        StrLenField("file_hash", "", length_from=lambda pkt: pkt.file_hash_len),
+        IntField("offset", 0),
+        IntField("block_size", 0),
+        FieldLenField("signatures_len", None, length_of="signatures", fmt="!I"),
+        StrLenField("signatures", "", length_from=lambda pkt: pkt.signatures_len),
+        FieldLenField("peer_host_len", None, length_of="peer_host"),
+        StrLenField("peer_host", "", length_from=lambda pkt: pkt.peer_host_len),
+        ShortField("peer_port", 0),
+        FieldLenField("codecs_len", None, length_of="codecs"),
+        StrLenField("codecs", "", length_from=lambda pkt: pkt.codecs_len),
+        IntField("content_size", 0),
+    ]
+
+
+scapy_layers = [SignalPacket, FileSyncPacket]
+
+for layer in scapy_layers:
+    bind_layers(layer, Padding)
+
+
+def condition(layer_cls) -> ConditionalField:
+    return ConditionalField(PacketField(layer_cls._name, layer_cls(), layer_cls),
+                            lambda pkt: pkt.layer_type == scapy_layers.index(layer_cls))
+
+
+class GeneralPacket(Packet):
+    name = "GeneralPacket"
+    fields_desc = [
+        IntEnumField("layer_type", 1, layers_dict),
+        condition(SignalPacket),
+        condition(FileSyncPacket),
+    ]
+
+
+def dissect(data: bytes) -> GeneralPacket:
+    """
+    Dissect a packet (as sent on the wire, without its length) with scapy.
+    """
+    return GeneralPacket(data)
+
+
+def build(packet) -> bytes:
+    """
+    Build a packet (a GeneralPacket, or an inner packet of this module) with scapy.
+    """
+    if not isinstance(packet, GeneralPacket):
+        general_packet = GeneralPacket(layer_type=scapy_layers.index(type(packet)))
+        setattr(general_packet, packet._name, packet)
+        packet = general_packet
+    return raw(packet)
@@ -1,5 +1,7 @@
-from scapy.fields import FieldLenField, StrField, IntField, IntEnumField, IEEEFloatField, IEEEDoubleField
-from scapy.packet import Packet
+import struct
+from dataclasses import dataclass
+
+from syncalong.common.codec import to_bytes, read_field
 
 DEFAULT_WAIT_SECONDS = 5
 
@@ -7,20 +9,54 @@ PLAY_SIGNAL = 1
 STOP_SIGNAL = 2
 PAUSE_SIGNAL = 3
 UNPAUSE_SIGNAL = 4
+# Heartbeat of the playback: the song should be at `position` seconds when the server's clock is at `send_timestamp`.
+POSITION_SIGNAL = 5
+
+commands = {PLAY_SIGNAL: "PLAY", STOP_SIGNAL: "STOP", PAUSE_SIGNAL: "PAUSE", UNPAUSE_SIGNAL: "UNPAUSE",
+            POSITION_SIGNAL: "POSITION"}
+
+# signal, send_timestamp, wait_seconds, seq, position, music_file_name_len
+SIGNAL_HEADER = struct.Struct("!IdIIdH")
+
+
+@dataclass(eq=False)
+class SignalPacket:
+    """
+    A signal telling the clients to play / stop / pause / unpause music.
+    String fields may be given as str, and are always kept as bytes.
+    """
+    signal: int = PLAY_SIGNAL
+    send_timestamp: float = 0
+    wait_seconds: int = DEFAULT_WAIT_SECONDS
+    seq: int = 0
+    position: float = 0
+    music_file_name: bytes = b""
+
+    def __post_init__(self):
+        self.music_file_name = to_bytes(self.music_file_name)
 
-commands = {PLAY_SIGNAL: "PLAY", STOP_SIGNAL: "STOP", PAUSE_SIGNAL: "PAUSE", UNPAUSE_SIGNAL: "UNPAUSE"}
+    def encode(self) -> bytes:
+        music_file_name = to_bytes(self.music_file_name)
+        return SIGNAL_HEADER.pack(self.signal, self.send_timestamp, self.wait_seconds, self.seq, self.position,
+                                  len(music_file_name)) + music_file_name
 
+    @classmethod
+    def decode(cls, data, offset: int = 0) -> "SignalPacket":
+        """
+        Parse a packet encoded by `encode`, starting at the given offset of the data.
 
-class SignalPacket(Packet):
-    name = "signal_packet"
-    fields_desc = [IntEnumField("signal", 1, commands),
-                   IEEEDoubleField("send_timestamp", 0),
-                   IntField("wait_seconds", DEFAULT_WAIT_SECONDS),
-                   FieldLenField("music_file_name_len", None, length_of="music_file_name"),
-                   StrField("music_file_name", "")]
+        :raise ValueError: If the data is not a valid packet.
+        """
+        try:
+            signal, send_timestamp, wait_seconds, seq, position, name_len = SIGNAL_HEADER.unpack_from(data, offset)
+        except struct.error as e:
+            raise ValueError(f"Invalid signal packet: {e}")
+        music_file_name = read_field(data, offset + SIGNAL_HEADER.size, name_len)
+        return cls(signal, send_timestamp, wait_seconds, seq, position, music_file_name)
 
     def __eq__(self, other):
         return self.signal == other.signal \
                and self.send_timestamp == other.send_timestamp \
                and self.wait_seconds == other.wait_seconds \
+               and self.position == other.position \
                and self.music_file_name == other.music_file_name
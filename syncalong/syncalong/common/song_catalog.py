@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+CATALOG_FILE_NAME = ".syncalong_catalog.json"
+HASH_READ_SIZE = 1024 * 1024
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Calculate the content hash of a file (SHA-256, as a hex string).
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SongCatalog(object):
+    """
+    A content-addressed catalog of song files.
+    Every file in the catalog is identified by the hash of its content. Hashes are cached on disk, keyed by the file's
+    path, size and modification time, so a file is hashed again only after it was changed.
+    """
+
+    def __init__(self, cache_path: str, max_workers: int = None):
+        """
+        Initialize a catalog, loading the hashes cached in the given file (if it exists).
+
+        :param cache_path: Path of the file that caches the catalog on disk.
+        :param max_workers: Maximum amount of threads used for hashing files. Default is decided by
+                            `ThreadPoolExecutor`.
+        """
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        # Held by a save from taking the snapshot of the entries until the cache file is replaced, so that an older
+        # snapshot never replaces a newer one.
+        self.save_lock = threading.Lock()
+        self.entries = {}
+        self._load()
+
+    def hash_of(self, file_path: str) -> str:
+        """
+        Get the content hash of the given file, hashing it only if it is not cached or was changed.
+
+        :param file_path: Path of the file to hash.
+        :return: Hash of the file's content.
+        """
+        return self.hash_all([file_path])[_key(file_path)]
+
+    def hash_all(self, file_paths: Iterable[str]) -> Dict[str, str]:
+        """
+        Get the content hashes of all the given files.
+        Only files that are not cached or were changed are hashed, concurrently in a thread pool.
+
+        :param file_paths: Paths of the files to hash.
+        :return: Dictionary mapping the absolute path of every file to its hash.
+        """
+        hashes = {}
+        changed = {}
+        for file_path in file_paths:
+            key = _key(file_path)
+            stat = os.stat(key)
+            cached = self._cached_hash(key, stat)
+            if cached is None:
+                changed[key] = stat
+            else:
+                hashes[key] = cached
+
+        if changed:
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                for key, content_hash in zip(changed, executor.map(file_hash, changed)):
+                    hashes[key] = content_hash
+                    self._set_entry(key, changed[key], content_hash)
+            self.save()
+        return hashes
+
+    def scan(self, directory: str) -> Dict[str, str]:
+        """
+        Bring the catalog up to date with all the files in the given directory (hidden files are skipped).
+        Files of the directory that no longer exist are removed from the catalog.
+
+        :param directory: Directory to scan.
+        :return: Dictionary mapping the absolute path of every file in the directory to its hash.
+        """
+        directory = _key(directory)
+        file_paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                      if not name.startswith('.') and os.path.isfile(os.path.join(directory, name))]
+        with self.lock:
+            for key in list(self.entries):
+                if os.path.dirname(key) == directory and key not in file_paths:
+                    del self.entries[key]
+        return self.hash_all(file_paths)
+
+    def add(self, file_path: str, content_hash: str):
+        """
+        Record the hash of a file whose content is already known (for example, a file that was just received).
+
+        :param file_path: Path of the file.
+        :param content_hash: Hash of the file's content.
+        """
+        key = _key(file_path)
+        self._set_entry(key, os.stat(key), content_hash)
+        self.save()
+
+    def find(self, content_hash: str) -> Optional[str]:
+        """
+        Find a file in the catalog with the given content.
+
+        :param content_hash: Hash of the content to look for.
+        :return: Path of a file with this content, or None if there is no such file.
+        """
+        with self.lock:
+            candidates = [key for key, entry in self.entries.items() if entry["hash"] == content_hash]
+        for key in candidates:
+            try:
+                if self._cached_hash(key, os.stat(key)) == content_hash:
+                    return key
+            except OSError:
+                continue
+        return None
+
+    def save(self):
+        """
+        Write the catalog to its cache file. The catalog is written to a temporary file of its own, which then replaces
+        the cache file, so the cache file is never left half written.
+        """
+        directory = os.path.dirname(self.cache_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self.save_lock:
+            with self.lock:
+                data = json.dumps(self.entries)
+            fd, temp_path = tempfile.mkstemp(dir=directory or None, prefix=os.path.basename(self.cache_path),
+                                             suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(data)
+                os.replace(temp_path, self.cache_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def _cached_hash(self, key: str, stat: os.stat_result) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["hash"]
+        return None
+
+    def _set_entry(self, key: str, stat: os.stat_result, content_hash: str):
+        with self.lock:
+            self.entries[key] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": content_hash}
+
+
+def _key(file_path: str) -> str:
+    return os.path.abspath(file_path)
@@ -4,6 +4,7 @@ import wx.adv
 import wx
 
 from syncalong.definitions import CODE_PATH
+from syncalong.client.audio_backend import PYGAME
 from syncalong.client.client import Client
 from syncalong.gui.gui_general import HORIZONTAL, VERTICAL, PORT_VALID_CHARS, check_valid_data
 import os
@@ -65,7 +66,9 @@ class SettingsPanel(wx.Panel):
         except:
             CONF = {"ServerIp": "",
                     "ServerPort": "22222",
-                    "SongsPath": "./songs_folder"}
+                    "SongsPath": "./songs_folder",
+                    "AudioBackend": PYGAME,
+                    "PeerPort": None}
             self.on_save(None)
 
 
@@ -103,7 +106,9 @@ class Mp3Panel(wx.Panel):
             if CONF["ServerIp"] and CONF["ServerPort"]:
                 print('Connect')
                 try:
-                    self.client = Client(CONF["ServerIp"], CONF["ServerPort"], CONF["ServerIp"], CONF["SongsPath"])
+                    self.client = Client(CONF["ServerIp"], CONF["ServerPort"], CONF["ServerIp"], CONF["SongsPath"],
+                                         peer_port=CONF.get("PeerPort"), signal_group=CONF.get("SignalGroup"),
+                                         audio_backend=CONF.get("AudioBackend", PYGAME))
                 except:
                     wx.MessageBox('Could not connect to server, try again or change server ip/port')
                     return
@@ -0,0 +1,276 @@
+"""
+Headless load generator for `MusicServer`: runs many lightweight simulated clients in a single process, and reports
+how long they took to connect, the throughput of the files they were sent, and how long signals took to reach them.
+
+Against a running server, the clients are connected for a given amount of time, while the server is operated as usual:
+
+    python -m syncalong loadgen --clients 200 --server 10.0.0.1:8080 --duration 60
+
+Without a server, a local one is started, serves them a file and signals them to play it:
+
+    python -m syncalong loadgen --clients 200 --file-size 5000000 --signals 5 --json report.json
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import tempfile
+import time
+from typing import Dict, List
+
+from syncalong.common.file_sync_packet import FileSyncPacket, WHO_HAS, FETCH, FILE_SEND, HAVE, MISSING, \
+    FILE_CHUNK_SIZE, message_types
+from syncalong.common.general_packet import GeneralPacket
+from syncalong.common.length_socket import LengthSocket
+from syncalong.common.signal_packet import SignalPacket, commands
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
+from syncalong.server.music_server import MusicServer
+
+LOADGEN_CLIENTS = 50
+LOADGEN_FILE_SIZE = 4 * 1024 * 1024
+LOADGEN_SIGNALS = 3
+SIGNAL_SPACING = 0.5
+REGISTER_TIMEOUT = 30
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """
+    Summary of the given values: their count, and their 50th, 90th and 99th percentiles and maximum.
+    """
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {"count": len(values),
+            "p50": values[len(values) // 2],
+            "p90": values[min(len(values) - 1, int(len(values) * 0.9))],
+            "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+            "max": values[-1]}
+
+
+class SimulatedClient(object):
+    """
+    A client that speaks the protocol of `Client` without playing anything: it answers WHO_HAS (remembering the
+    content hashes it was sent instead of keeping the files), receives files into a null sink, and logs the time every
+    signal arrived at (including signals sent in the middle of a file).
+    It never serves its peers, and doesn't advertise any codecs, so the server always sends it the whole file as-is.
+    Signal latencies are measured against the local clock, so they are meaningful only if it is synced with the
+    server's clock (as it is for a local server).
+    """
+
+    def __init__(self, server_address, loop: asyncio.AbstractEventLoop):
+        self.server_address = server_address
+        self.loop = loop
+        self.socket = None
+        self.task = None
+        self.connect_time = None
+        self.received_hashes = set()
+        self.bytes_received = 0
+        # (file name, bytes, seconds from the FILE_SEND header until the last byte, perf_counter() of the last byte)
+        self.transfers = []
+        # command -> seconds from the server's send time until the signal arrived
+        self.signal_latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.error = None
+
+    async def connect(self):
+        """
+        Connect to the server and say hello. The time it took is kept in `connect_time`.
+        """
+        start = time.perf_counter()
+        self.socket = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setblocking(False)
+        await self.loop.sock_connect(self.socket, self.server_address)
+        self.socket.set_nodelay()
+        await self.socket.async_send(b"hello", self.loop)
+        self.connect_time = time.perf_counter() - start
+
+    async def run(self):
+        """
+        Handle the server's messages until the connection is closed or the task is cancelled.
+        """
+        try:
+            while True:
+                packet = GeneralPacket(await self.socket.async_recv(self.loop)).payload
+                if isinstance(packet, SignalPacket):
+                    self._handle_signal(packet)
+                else:
+                    await self._handle_file_sync(packet)
+        except (ConnectionError, OSError, ValueError) as e:
+            self.error = e
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+
+    def _handle_signal(self, signal_packet: SignalPacket):
+        latency = time.time() - signal_packet.send_timestamp
+        self.signal_latencies[commands.get(signal_packet.signal, str(signal_packet.signal))].append(latency)
+
+    async def _handle_file_sync(self, file_sync_packet: FileSyncPacket):
+        if file_sync_packet.message_type in (WHO_HAS, FETCH):
+            response = HAVE if file_sync_packet.file_hash in self.received_hashes else MISSING
+            await self.socket.async_send(FileSyncPacket(message_type=response, file_name=file_sync_packet.file_name),
+                                         self.loop)
+        elif file_sync_packet.message_type == FILE_SEND:
+            start = time.perf_counter()
+            size = file_sync_packet.file_size - file_sync_packet.offset
+            remaining = size
+            while remaining:
+                packet = GeneralPacket(await self.socket.async_recv(self.loop)).payload
+                if isinstance(packet, SignalPacket):
+                    self._handle_signal(packet)
+                    continue
+                chunk = packet.file_size
+                remaining -= chunk
+                while chunk:
+                    chunk -= len(await self.socket.async_recv(self.loop, min(chunk, FILE_CHUNK_SIZE)))
+            self.bytes_received += size
+            self.received_hashes.add(file_sync_packet.file_hash)
+            end = time.perf_counter()
+            self.transfers.append((file_sync_packet.file_name.decode('utf-8'), size, end - start, end))
+        else:
+            raise ValueError(f"Unexpected {message_types.get(file_sync_packet.message_type)} message")
+
+
+def report(clients: List[SimulatedClient], transfer_seconds: float = None) -> dict:
+    """
+    Summarize the measurements of the given clients (all the times are in seconds).
+
+    :param transfer_seconds: Time from serving the file until all the clients received it, if known.
+    """
+    bytes_received = sum(client.bytes_received for client in clients)
+    signal_latencies = collections.defaultdict(list)
+    for client in clients:
+        for command, latencies in client.signal_latencies.items():
+            signal_latencies[command].extend(latencies)
+    result = {
+        "clients": len(clients),
+        "connected": sum(client.connect_time is not None for client in clients),
+        "errors": sum(client.error is not None and not isinstance(client.error, ConnectionError)
+                      for client in clients),
+        "connect_time": percentiles([client.connect_time for client in clients if client.connect_time is not None]),
+        "bytes_received": bytes_received,
+        "client_throughput": percentiles([size / seconds for client in clients
+                                          for _, size, seconds, _ in client.transfers if seconds > 0]),
+        "signal_latency": {command: percentiles(latencies) for command, latencies in signal_latencies.items()},
+    }
+    if transfer_seconds:
+        result["transfer_seconds"] = transfer_seconds
+        result["throughput"] = bytes_received / transfer_seconds
+    return result
+
+
+def format_report(result: dict) -> str:
+    def times(stats):
+        if not stats["count"]:
+            return "none"
+        return (f"p50 {stats['p50'] * 1e3:.2f} ms, p90 {stats['p90'] * 1e3:.2f} ms, p99 {stats['p99'] * 1e3:.2f} ms, "
+                f"max {stats['max'] * 1e3:.2f} ms ({stats['count']})")
+
+    lines = [f"{result['connected']}/{result['clients']} clients connected, {result['errors']} errors",
+             f"connect time: {times(result['connect_time'])}",
+             f"received {result['bytes_received'] / 2 ** 20:.1f} MiB"]
+    if "throughput" in result:
+        lines[-1] += f" in {result['transfer_seconds']:.2f} s ({result['throughput'] / 2 ** 20:.1f} MiB/s in total)"
+    if result["client_throughput"]["count"]:
+        lines.append(f"throughput per client: p50 {result['client_throughput']['p50'] / 2 ** 20:.1f} MiB/s")
+    for command, stats in result["signal_latency"].items():
+        lines.append(f"{command} signal latency: {times(stats)}")
+    return "\n".join(lines)
+
+
+async def connect_clients(server_address, count: int, loop: asyncio.AbstractEventLoop) -> List[SimulatedClient]:
+    """
+    Connect the given amount of simulated clients to the server concurrently, and start handling their messages.
+    """
+    clients = [SimulatedClient(server_address, loop) for _ in range(count)]
+    results = await asyncio.gather(*(client.connect() for client in clients), return_exceptions=True)
+    for client, result in zip(clients, results):
+        if isinstance(result, Exception):
+            client.error = result
+            client.close()
+        else:
+            client.task = loop.create_task(client.run())
+    return clients
+
+
+async def stop_clients(clients: List[SimulatedClient]):
+    for client in clients:
+        if client.task is not None:
+            client.task.cancel()
+            await asyncio.gather(client.task, return_exceptions=True)
+        client.close()
+
+
+async def load_remote_server(server_address, count: int, duration: float) -> dict:
+    """
+    Connect simulated clients to a running server, and measure them for the given amount of seconds.
+    """
+    loop = asyncio.get_running_loop()
+    clients = await connect_clients(server_address, count, loop)
+    await asyncio.sleep(duration)
+    await stop_clients(clients)
+    return report(clients)
+
+
+async def load_local_server(count: int, music_file: str, signals: int, work_dir: str) -> dict:
+    """
+    Start a local server, connect simulated clients to it, serve them the given file and signal them to play it.
+    """
+    loop = asyncio.get_running_loop()
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(os.path.join(work_dir, CATALOG_FILE_NAME)),
+                         heartbeat_interval=None)
+    server.start()
+    clients = []
+    try:
+        clients = await connect_clients(server.server_socket.getsockname(), count, loop)
+        deadline = time.time() + REGISTER_TIMEOUT
+        while len(server.clients) < sum(client.connect_time is not None for client in clients) \
+                and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        await loop.run_in_executor(None, server.serve_music_file, music_file)
+        transfer_seconds = max((transfer[3] for client in clients for transfer in client.transfers),
+                               default=time.perf_counter()) - start
+        for _ in range(signals):
+            await loop.run_in_executor(None, server.signal_play_all, music_file)
+            await asyncio.sleep(SIGNAL_SPACING)
+        await stop_clients(clients)
+    finally:
+        await loop.run_in_executor(None, server.close)
+    return report(clients, transfer_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m syncalong loadgen", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=LOADGEN_CLIENTS, help="amount of simulated clients")
+    parser.add_argument("--server", help="HOST:PORT of a running server (default: start a local server)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to stay connected to a running server")
+    parser.add_argument("--file", help="file the local server serves (default: a random file)")
+    parser.add_argument("--file-size", type=int, default=LOADGEN_FILE_SIZE, help="size of the random file")
+    parser.add_argument("--signals", type=int, default=LOADGEN_SIGNALS, help="play signals the local server sends")
+    parser.add_argument("--json", help="path to write the report to, as JSON")
+    args = parser.parse_args(argv)
+
+    if args.server:
+        host, port = args.server.rsplit(":", 1)
+        result = asyncio.run(load_remote_server((host, int(port)), args.clients, args.duration))
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            music_file = args.file
+            if music_file is None:
+                music_file = os.path.join(work_dir, "loadgen.wav")
+                with open(music_file, "wb") as f:
+                    f.write(os.urandom(args.file_size))
+            result = asyncio.run(load_local_server(args.clients, music_file, args.signals, work_dir))
+
+    print(format_report(result))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,14 @@
 import os
 import json
+import threading
 import wx
 import wx.lib.mixins.listctrl as listmix
 from mutagen.mp3 import MP3
 
 from syncalong.definitions import CODE_PATH
-from syncalong.server.music_server import MusicServer
-from syncalong.server.ntp_server import NTPServer
+from syncalong.server.music_server import MusicServer, HEARTBEAT_INTERVAL
+from syncalong.server.ntp_server import NTPServer, AsyncNTPServer, NTP_WORKERS
+from syncalong.server.prefetcher import Prefetcher, PREFETCH_LOOKAHEAD
 
 from syncalong.gui.gui_general import HORIZONTAL, VERTICAL, PORT_VALID_CHARS, check_valid_data
 
@@ -149,6 +151,9 @@ class Mp3Panel(wx.Panel):
 
         main_sizer.Add(botton_sizer, 0, wx.ALL | wx.CENTRE, 5)
 
+        self.prefetch_status = wx.StaticText(self, label='')
+        main_sizer.Add(self.prefetch_status, 0, wx.ALL | wx.EXPAND, 5)
+
         self.SetSizer(main_sizer)
 
         self.timer = wx.Timer(self)
@@ -156,6 +161,7 @@ class Mp3Panel(wx.Panel):
 
         self.music_s = None
         self.ntp_s = None
+        self.prefetcher = None
         self.song_list = []
 
         self.running = False
@@ -166,11 +172,25 @@ class Mp3Panel(wx.Panel):
         if not self.running:
             if CONF["ServerPort"]:
                 if not self.music_s:
-                    self.music_s = MusicServer("0.0.0.0", CONF["ServerPort"])
+                    self.music_s = MusicServer("0.0.0.0", CONF["ServerPort"],
+                                               multicast_group=CONF.get("MulticastGroup"),
+                                               signal_datagrams=CONF.get("SignalDatagrams", False),
+                                               signal_group=CONF.get("SignalGroup"),
+                                               heartbeat_interval=CONF.get("HeartbeatInterval", HEARTBEAT_INTERVAL))
+                    songs = [self.list_ctrl.GetItemText(i) for i in range(self.list_ctrl.ItemCount)]
+                    threading.Thread(target=self.music_s.catalog.hash_all, args=(songs,), daemon=True).start()
                 if not self.ntp_s:
-                    self.ntp_s = NTPServer("0.0.0.0", 123)
+                    # "NtpSimulatedOffset" makes the NTP server lie about its time, for testing the clients only.
+                    if CONF.get("NtpRateLimit"):
+                        self.ntp_s = AsyncNTPServer("0.0.0.0", 123, rate=CONF["NtpRateLimit"],
+                                                    simulated_offset=CONF.get("NtpSimulatedOffset"))
+                    else:
+                        self.ntp_s = NTPServer("0.0.0.0", 123, CONF.get("NtpWorkers", NTP_WORKERS),
+                                               simulated_offset=CONF.get("NtpSimulatedOffset"))
                 self.ntp_s.start()
                 self.music_s.start()
+                self.prefetcher = Prefetcher(self.music_s, CONF.get("PrefetchLookahead", PREFETCH_LOOKAHEAD))
+                self.prefetcher.start()
                 self.running = True
                 self.on_play_trigger(event)
             else:
@@ -180,6 +200,8 @@ class Mp3Panel(wx.Panel):
         print('stop')
         if self.running:
             self.timer.Stop()
+            self.prefetcher.stop()
+            self.prefetcher = None
             self.music_s.signal_stop_all()
             self.running = False
 
@@ -209,11 +231,13 @@ class Mp3Panel(wx.Panel):
         print('play')
         if self.running and self.music_s.clients and self.list_ctrl.ItemCount > 0:
             song = self.list_ctrl.GetItem(0)
-            self.music_s.serve_music_file(song.GetText())
+            self.prefetcher.ensure(song.GetText())
             self.music_s.signal_play_all(song.GetText())
             self.timer.StartOnce(
                 MP3(song.GetText()).info.length * 1000)  # Timer works with milliseconds and MP3 works with Seconds
             self.list_ctrl.DeleteItem(song.GetId())
+            self.prefetcher.set_upcoming([self.list_ctrl.GetItemText(i) for i in range(self.list_ctrl.ItemCount)])
+            self.prefetch_status.SetLabel(self.prefetcher.summary())
         else:
             self.timer.StartOnce(1000)
 
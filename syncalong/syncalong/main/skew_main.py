@@ -0,0 +1,276 @@
+"""
+Synchronization skew harness: runs a local `MusicServer` and `NTPServer` with many `Client` instances, signals them
+to play, pause, unpause and stop a song, and measures how far apart the clients executed every signal.
+
+Every client records the `time.monotonic()` instant it executed every command at. The clock is shared by all the
+processes of the machine, so the spread of a signal is the latest instant minus the earliest one. The clients run in
+this process by default (where they take turns holding the GIL, which adds to the spread), or in a process each:
+
+    python -m syncalong skew --clients 8 --rounds 5 --json skew.json
+    python -m syncalong skew --clients 8 --processes
+"""
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from typing import List
+
+from syncalong.client.audio_backend import NULL
+from syncalong.client.client import Client
+from syncalong.client.timer import PreciseScheduler, BUSY_WAIT_SECONDS
+from syncalong.common.signal_packet import PLAY_SIGNAL, PAUSE_SIGNAL, UNPAUSE_SIGNAL, STOP_SIGNAL, commands
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
+from syncalong.main.loadgen_main import percentiles
+from syncalong.server.music_server import MusicServer
+from syncalong.server.ntp_server import NTPServer
+
+SKEW_CLIENTS = 8
+SKEW_ROUNDS = 3
+SKEW_WAIT_SECONDS = 1
+# Seconds to wait after every signal's play time before sending the next one.
+SIGNAL_MARGIN = 0.5
+SYNC_TIMEOUT = 10
+SONG_SECONDS = 10
+SONG_RATE = 22050
+ROUND_SIGNALS = (PLAY_SIGNAL, PAUSE_SIGNAL, UNPAUSE_SIGNAL, STOP_SIGNAL)
+
+
+class RecordingScheduler(PreciseScheduler):
+    """
+    A scheduler that records every action it runs: the command, the remote time it was scheduled for, the monotonic
+    time it was actually run at and how late it was.
+    """
+
+    def __init__(self, clock, busy_wait: float = BUSY_WAIT_SECONDS):
+        super().__init__(clock, busy_wait)
+        self.executions = []
+
+    def run_at(self, remote_timestamp, action, command=""):
+        def recorded_action():
+            self.executions.append((command, remote_timestamp, time.monotonic(), self.lateness[command][-1]))
+            return action()
+
+        return super().run_at(remote_timestamp, recorded_action, command)
+
+
+def recording_client(server_address, ntp_port: int, music_files_repo: str) -> Client:
+    """
+    Create a client of the given server whose scheduler records the commands it executes (see `RecordingScheduler`).
+    The client doesn't play anything (see `NullBackend`), so it doesn't need an audio device.
+    """
+    os.makedirs(music_files_repo, exist_ok=True)
+    client = Client(server_address[0], server_address[1], server_address[0], music_files_repo, ntp_port=ntp_port,
+                    audio_backend=NULL)
+    client.scheduler = RecordingScheduler(client.clock)
+    return client
+
+
+def write_song(path: str, seconds: float = SONG_SECONDS):
+    """
+    Write a silent WAV file the clients can play.
+    """
+    with wave.open(path, "wb") as song:
+        song.setnchannels(1)
+        song.setsampwidth(2)
+        song.setframerate(SONG_RATE)
+        song.writeframes(bytes(2 * int(SONG_RATE * seconds)))
+
+
+def skew_report(executions: List[list], clock_errors: List[float] = ()) -> dict:
+    """
+    Summarize the executions of all the clients (all the times are in seconds).
+
+    :param executions: For every client, the (command, remote timestamp, monotonic time, lateness) of every command it
+                       executed (see `RecordingScheduler`).
+    :param clock_errors: Error bounds of the clients' clocks at the end of the run.
+    """
+    instants = collections.defaultdict(list)
+    lateness = collections.defaultdict(list)
+    for client_executions in executions:
+        for command, remote_timestamp, executed, late in client_executions:
+            instants[(command, remote_timestamp)].append(executed)
+            lateness[command].append(late)
+    spreads = collections.defaultdict(list)
+    for (command, _), signal_instants in sorted(instants.items(), key=lambda item: item[0][1]):
+        spreads[command].append(max(signal_instants) - min(signal_instants))
+    return {
+        "clients": len(executions),
+        "signals": len(instants),
+        "missed": sum(len(executions) - len(signal_instants) for signal_instants in instants.values()),
+        "max_spread": max((max(command_spreads) for command_spreads in spreads.values()), default=0.0),
+        "spread": {command: percentiles(command_spreads) for command, command_spreads in spreads.items()},
+        "lateness": {command: percentiles(command_lateness) for command, command_lateness in lateness.items()},
+        "clock_error": percentiles(list(clock_errors)),
+    }
+
+
+def format_report(result: dict) -> str:
+    lines = [f"{result['clients']} clients, {result['signals']} signals, {result['missed']} missed executions, "
+             f"max spread {result['max_spread'] * 1e3:.3f} ms"]
+    for command, stats in result["spread"].items():
+        lateness = result["lateness"][command]
+        lines.append(f"{command}: spread p50 {stats['p50'] * 1e3:.3f} ms, p99 {stats['p99'] * 1e3:.3f} ms, "
+                     f"max {stats['max'] * 1e3:.3f} ms; late by {lateness['p50'] * 1e3:.3f} ms (p50)")
+    if result["clock_error"]["count"]:
+        lines.append(f"clock error bound: p50 {result['clock_error']['p50'] * 1e3:.3f} ms, "
+                     f"max {result['clock_error']['max'] * 1e3:.3f} ms")
+    return "\n".join(lines)
+
+
+class InProcessClients(object):
+    """
+    Recording clients that run in threads of this process.
+    """
+
+    def __init__(self, server_address, ntp_port: int, repos: List[str]):
+        self.clients = [recording_client(server_address, ntp_port, repo) for repo in repos]
+        self.threads = [threading.Thread(target=client.start, daemon=True) for client in self.clients]
+        for thread in self.threads:
+            thread.start()
+
+    def wait_synced(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        return all(client.clock.wait_synced(max(deadline - time.monotonic(), 0)) for client in self.clients)
+
+    def stop(self):
+        """
+        Stop the clients.
+
+        :return: The executions of every client, and the error bounds of their clocks.
+        """
+        errors = [client.clock.error for client in self.clients]
+        for client in self.clients:
+            client.stop_request.set()
+        for thread in self.threads:
+            thread.join()
+        return [client.scheduler.executions for client in self.clients], errors
+
+
+class SubprocessClients(object):
+    """
+    Recording clients that run in a process each (see `run_child`). A child says when its clock is synced, and writes
+    its executions to a file once its standard input is closed.
+    """
+
+    def __init__(self, server_address, ntp_port: int, repos: List[str]):
+        self.outputs = [repo + ".json" for repo in repos]
+        self.processes = [subprocess.Popen([sys.executable, "-m", "syncalong.main.skew_main", "--child",
+                                            "--server", f"{server_address[0]}:{server_address[1]}",
+                                            "--ntp-port", str(ntp_port), "--repo", repo, "--json", output],
+                                           stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                          for repo, output in zip(repos, self.outputs)]
+
+    def wait_synced(self, timeout: float) -> bool:
+        # The children time out on their own, and say whether they are synced either way.
+        return all([process.stdout.readline().strip() == "synced" for process in self.processes])
+
+    def stop(self):
+        for process in self.processes:
+            process.stdin.close()
+        for process in self.processes:
+            process.wait()
+        executions, errors = [], []
+        for output in self.outputs:
+            with open(output) as f:
+                result = json.load(f)
+            executions.append(result["executions"])
+            errors.append(result["clock_error"])
+        return executions, errors
+
+
+def run_child(server_address, ntp_port: int, repo: str, output: str):
+    """
+    Run a single recording client (in a process started by `SubprocessClients`) until the standard input is closed.
+    """
+    # The client logs to the standard output, which is kept for talking to the parent.
+    sys.stdout = sys.stderr
+    client = recording_client(server_address, ntp_port, repo)
+    thread = threading.Thread(target=client.start, daemon=True)
+    thread.start()
+    print("synced" if client.clock.wait_synced(SYNC_TIMEOUT) else "not synced", file=sys.__stdout__, flush=True)
+    sys.stdin.read()
+    error = client.clock.error
+    client.stop_request.set()
+    thread.join()
+    with open(output, "w") as f:
+        json.dump({"executions": client.scheduler.executions, "clock_error": error}, f)
+
+
+def measure_skew(count: int, rounds: int, wait_seconds: int, work_dir: str, processes: bool = False) -> dict:
+    """
+    Start a local server and NTP server and the given amount of recording clients, serve the clients a song, and
+    signal them to play, pause, unpause and stop it the given amount of times.
+    """
+    song = os.path.join(work_dir, "skew.wav")
+    write_song(song)
+    ntp_server = NTPServer('127.0.0.1', 0)
+    ntp_server.start()
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(os.path.join(work_dir, CATALOG_FILE_NAME)),
+                         heartbeat_interval=None)
+    server.start()
+    try:
+        repos = [os.path.join(work_dir, f"client{i}") for i in range(count)]
+        clients_type = SubprocessClients if processes else InProcessClients
+        clients = clients_type(server.server_socket.getsockname(), ntp_server.address[1], repos)
+        deadline = time.monotonic() + SYNC_TIMEOUT
+        while len(server.clients) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if not clients.wait_synced(SYNC_TIMEOUT):
+            print("Not all the clients synced their clocks, measuring anyway")
+        server.serve_music_file(song)
+        signal_handlers = {
+            PLAY_SIGNAL: lambda: server.signal_play_all(song, wait_seconds),
+            PAUSE_SIGNAL: lambda: server.signal_pause_all(wait_seconds),
+            UNPAUSE_SIGNAL: lambda: server.signal_unpause_all(wait_seconds),
+            STOP_SIGNAL: lambda: server.signal_stop_all(wait_seconds),
+        }
+        for _ in range(rounds):
+            for signal in ROUND_SIGNALS:
+                print(f"Signaling {commands[signal]}")
+                signal_handlers[signal]()
+                time.sleep(wait_seconds + SIGNAL_MARGIN)
+        executions, clock_errors = clients.stop()
+    finally:
+        server.close()
+        ntp_server.close()
+    return skew_report(executions, clock_errors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m syncalong skew", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=SKEW_CLIENTS, help="amount of clients")
+    parser.add_argument("--rounds", type=int, default=SKEW_ROUNDS,
+                        help="times to signal play, pause, unpause and stop")
+    parser.add_argument("--wait", type=int, default=SKEW_WAIT_SECONDS,
+                        help="seconds from sending every signal until the clients execute it")
+    parser.add_argument("--processes", action="store_true", help="run every client in its own process")
+    parser.add_argument("--json", help="path to write the report to, as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--server", help=argparse.SUPPRESS)
+    parser.add_argument("--ntp-port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--repo", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        host, port = args.server.rsplit(":", 1)
+        run_child((host, int(port)), args.ntp_port, args.repo, args.json)
+        return None
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = measure_skew(args.clients, args.rounds, args.wait, work_dir, args.processes)
+
+    print(format_report(result))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import asyncio
+
+from syncalong.common.general_packet import GeneralPacket
+from syncalong.common.length_socket import LengthSocket
+
+
+class ClientConnection(object):
+    """
+    A single client connected to the music server.
+    Connections are driven by the server's event loop: every message the client sends is read into an inbox by
+    `read_messages`, and sends are serialized so that concurrent broadcasts never interleave their bytes on the stream.
+    """
+
+    def __init__(self, sock: LengthSocket, address, loop: asyncio.AbstractEventLoop):
+        """
+        Initialize a connection over the given socket. Must be called from within the event loop.
+
+        :param sock: Connected socket of the client. Will be switched to non-blocking mode.
+        :param address: Address of the client.
+        :param loop: The event loop driving this connection.
+        """
+        sock.setblocking(False)
+        sock.set_nodelay()
+        self.socket = sock
+        self.address = address
+        self.loop = loop
+        self.inbox = asyncio.Queue()
+        self.send_lock = asyncio.Lock()
+        self.closed = False
+        # The task reading the client's messages (see `read_messages`).
+        self.reader = None
+        self.peer_port = 0
+        self.codecs = []
+
+    async def send(self, packet) -> int:
+        """
+        Send a single packet (or raw bytes) to the client. See `LengthSocket.send` for the packets accepted.
+
+        :param packet: The packet to be sent.
+        :return: Total amount of bytes sent.
+        """
+        async with self.send_lock:
+            return await self.send_locked(packet)
+
+    async def send_locked(self, packet) -> int:
+        """
+        Send a single packet to the client, while the caller is already holding `send_lock`.
+        Used for messages made of several packets (like files), which must not be interleaved with other packets.
+
+        :param packet: The packet to be sent.
+        :return: Total amount of bytes sent.
+        """
+        return await self.socket.async_send(packet, self.loop)
+
+    async def send_batch_locked(self, packets) -> int:
+        """
+        Send several packets to the client in a single write (see `LengthSocket.async_send_batch`), while the caller
+        is already holding `send_lock`.
+
+        :param packets: The packets to be sent, by order.
+        :return: Total amount of bytes sent.
+        """
+        return await self.socket.async_send_batch(packets, self.loop)
+
+    async def send_file_locked(self, file_path: str, offset: int = 0, count: int = None) -> int:
+        """
+        Send the content of a file to the client (see `LengthSocket.send_file`), while the caller is already holding
+        `send_lock`.
+
+        :param file_path: Path of the file to be sent.
+        :param offset: Position in the file to start sending from.
+        :param count: Amount of bytes to send. If None, the file is sent until its end.
+        :return: Total amount of bytes sent.
+        """
+        return await self.socket.async_send_file(file_path, self.loop, offset, count)
+
+    async def recv(self) -> GeneralPacket:
+        """
+        Wait for the next message sent by the client.
+
+        :return: The message that was received.
+        :raise ConnectionError: If the client disconnected.
+        """
+        data = await self.inbox.get()
+        if data is None:
+            self.inbox.put_nowait(None)
+            raise ConnectionError(f"{self} disconnected")
+        return GeneralPacket(data)
+
+    async def read_messages(self):
+        """
+        Read messages from the client into the inbox, until the client disconnects (or the connection is closed).
+        """
+        self.reader = asyncio.current_task()
+        try:
+            while True:
+                self.inbox.put_nowait(await self.socket.async_recv(self.loop))
+        except (ConnectionError, OSError) as e:
+            print(f"Stopped reading from {self}: {e}")
+        finally:
+            self.closed = True
+            self.inbox.put_nowait(None)
+
+    def close(self):
+        """
+        Close the connection. Must be called from within the event loop.
+        The socket is removed from the event loop before it is closed: its descriptor may be reused by the next socket
+        right away, and the loop must not mistake one for the other.
+        """
+        self.closed = True
+        if self.socket.fileno() != -1:
+            self.loop.remove_reader(self.socket.fileno())
+            self.loop.remove_writer(self.socket.fileno())
+        if self.reader is not None and self.reader is not asyncio.current_task():
+            self.reader.cancel()
+        self.socket.close()
+
+    def __repr__(self):
+        addr, port = self.address
+        return f"<ClientConnection {addr}:{port}>"
@@ -0,0 +1,60 @@
+import asyncio
+import os
+from typing import Dict, Optional, Tuple
+
+from syncalong.common.compression import compress_file, is_compressible
+
+COMPRESSION_CACHE_DIR_NAME = ".syncalong_compressed"
+MAX_COMPRESSED_RATIO = 0.9
+
+
+class CompressionCache(object):
+    """
+    A cache of compressed copies of the served files, keyed by the file's content hash and the codec.
+    Every file is compressed only once for every codec, no matter how many clients it is sent to (even at the same
+    time), and the copies are kept on disk, so they are sent straight from the OS like the files themselves.
+    """
+
+    def __init__(self, directory: str, loop: asyncio.AbstractEventLoop):
+        """
+        Initialize a cache in the given directory. The directory is created if it doesn't exist.
+
+        :param directory: Directory to keep the compressed copies in.
+        :param loop: The event loop the cache is used from. Files are compressed in its default executor.
+        """
+        self.directory = directory
+        self.loop = loop
+        self.pending: Dict[Tuple[str, str], asyncio.Future] = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    async def compressed_path(self, file_path: str, file_hash: str, codec: str) -> Optional[str]:
+        """
+        Get the path of a compressed copy of the given file, compressing it if there is none yet.
+
+        :param file_path: Path of the file.
+        :param file_hash: Content hash of the file.
+        :param codec: Codec to compress the file with.
+        :return: Path of the compressed copy, or None if the file should be sent as-is: its format is compressed
+                 already, or compressing it saves less than `1 - MAX_COMPRESSED_RATIO` of its size.
+        """
+        if not codec or not file_hash or not is_compressible(file_path):
+            return None
+        path = os.path.join(self.directory, f"{file_hash}.{codec}")
+        if not os.path.exists(path):
+            key = (file_hash, codec)
+            if key not in self.pending:
+                self.pending[key] = self.loop.run_in_executor(None, self._compress, file_path, path, codec)
+            try:
+                await asyncio.shield(self.pending[key])
+            finally:
+                self.pending.pop(key, None)
+        if os.path.getsize(path) > os.path.getsize(file_path) * MAX_COMPRESSED_RATIO:
+            return None
+        return path
+
+    @staticmethod
+    def _compress(file_path: str, path: str, codec: str):
+        temp_path = path + ".tmp"
+        compressed_size = compress_file(file_path, temp_path, codec)
+        os.replace(temp_path, path)
+        print(f"Compressed {file_path} with {codec}: {os.path.getsize(file_path)} -> {compressed_size} bytes")
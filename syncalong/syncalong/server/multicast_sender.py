@@ -0,0 +1,100 @@
+import asyncio
+import socket
+from typing import BinaryIO, List, Tuple
+
+from syncalong.common.multicast import MULTICAST_BLOCK_SIZE, FEC_GROUP_SIZE, MULTICAST_RATE, MULTICAST_TTL, \
+    DATA_BLOCK, PARITY_BLOCK, multicast_sender_socket, pack_datagram, xor_blocks
+
+SEND_RETRY_DELAY = 0.001
+# FEC groups read (and their parity computed) at a time, off the event loop.
+MULTICAST_READ_GROUPS = 32
+
+
+class MulticastSender(object):
+    """
+    Sends files to a multicast group, block by block, with a parity block after every FEC group (see `multicast`).
+    Datagrams are paced to the given rate, so that receivers (and the network) are not flooded with more datagrams
+    than they can take.
+    """
+
+    def __init__(self, group: str, port: int, loop: asyncio.AbstractEventLoop, rate: int = MULTICAST_RATE,
+                 block_size: int = MULTICAST_BLOCK_SIZE, ttl: int = MULTICAST_TTL):
+        """
+        Initialize a sender to the given multicast group.
+
+        :param group: Address of the multicast group.
+        :param port: Port to send the datagrams to.
+        :param loop: The event loop driving the sender's socket.
+        :param rate: Maximal amount of bytes to send in a second.
+        :param block_size: Size of the file's content sent in every datagram.
+        :param ttl: Amount of routers the datagrams may pass. Default keeps them in the local network.
+        """
+        self.group = group
+        self.port = port
+        self.loop = loop
+        self.rate = rate
+        self.block_size = block_size
+        self.socket = multicast_sender_socket(ttl)
+        self.socket.setblocking(False)
+
+    async def send_file(self, file_path: str, file_hash: str, interface: str) -> int:
+        """
+        Send all the blocks of the file to the group, along with their parity blocks.
+
+        :param file_path: Path of the file to be sent.
+        :param file_hash: Content hash of the file, identifying its datagrams.
+        :param interface: Address of the local interface to send the datagrams from.
+        :return: Total amount of bytes of blocks sent (parity blocks included).
+        """
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        sent = 0
+        start = self.loop.time()
+        with open(file_path, 'rb') as file_to_send:
+            group_index = 0
+            while True:
+                groups = await self.loop.run_in_executor(None, self._read_groups, file_to_send)
+                if not groups:
+                    break
+                for blocks, parity in groups:
+                    for offset, block in enumerate(blocks):
+                        await self._send_datagram(pack_datagram(file_hash, DATA_BLOCK,
+                                                                group_index * FEC_GROUP_SIZE + offset, block))
+                    await self._send_datagram(pack_datagram(file_hash, PARITY_BLOCK, group_index, parity))
+                    sent += sum(map(len, blocks)) + len(parity)
+                    group_index += 1
+
+                    ahead = sent / self.rate - (self.loop.time() - start)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+        return sent
+
+    def _read_groups(self, file_to_send: BinaryIO) -> List[Tuple[List[bytes], bytes]]:
+        """
+        Read the next FEC groups of the file (up to `MULTICAST_READ_GROUPS` of them), and compute their parity blocks.
+        This is run in an executor, so that reading the file and computing the parity don't block the event loop.
+
+        :return: The blocks of every group read, and the group's parity block.
+        """
+        groups = []
+        for _ in range(MULTICAST_READ_GROUPS):
+            blocks = []
+            for _ in range(FEC_GROUP_SIZE):
+                block = file_to_send.read(self.block_size)
+                if not block:
+                    break
+                blocks.append(block)
+            if not blocks:
+                break
+            groups.append((blocks, xor_blocks(blocks, self.block_size)))
+        return groups
+
+    async def _send_datagram(self, datagram: bytes):
+        while True:
+            try:
+                self.socket.sendto(datagram, (self.group, self.port))
+                return
+            except BlockingIOError:
+                await asyncio.sleep(SEND_RETRY_DELAY)
+
+    def close(self):
+        self.socket.close()
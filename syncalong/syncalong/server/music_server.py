@@ -1,75 +1,145 @@
+import asyncio
+import collections
+import random
 import socket
 import threading
-from typing import List
+from typing import Dict, List, Set
 from datetime import datetime
 
+from syncalong.definitions import CODE_PATH
+from syncalong.common.compression import choose_codec
+from syncalong.common.delta import delta_plan, plan_literal_size, unpack_signatures
 from syncalong.common.general_packet import GeneralPacket
-from syncalong.common.length_socket import LengthSocket, send_to_all
+from syncalong.common.length_socket import LengthSocket, build_packet
+from syncalong.common.multicast import MULTICAST_RATE, multicast_sender_socket, unpack_ranges
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
 from syncalong.common.signal_packet import *
 from syncalong.common.file_sync_packet import *
+from syncalong.server.client_connection import ClientConnection
+from syncalong.server.compression_cache import CompressionCache, COMPRESSION_CACHE_DIR_NAME
+from syncalong.server.multicast_sender import MulticastSender
 
+HELLO = b"hello"
+HANDSHAKE_TIMEOUT = 5
+WHO_HAS_TIMEOUT = 5
+MULTICAST_MIN_CLIENTS = 2
+SIGNAL_REDUNDANCY = 3
+SIGNAL_RETRANSMIT_INTERVAL = 0.005
+HEARTBEAT_INTERVAL = 2
+# Bytes of a file sent to a client at a time. Signals and heartbeats are sent to the client between chunks, so they
+# never wait for a whole file.
+SEND_CHUNK_SIZE = 256 * 1024
+# Slowest rate (in bytes per second) a client is expected to receive a file at. A client that takes longer to confirm it
+# received a file is dropped (see `_transfer_timeout`).
+MIN_TRANSFER_RATE = 128 * 1024
+CATALOG_PATH = str(CODE_PATH / 'server' / CATALOG_FILE_NAME)
 
-class RecvClientsThread(threading.Thread):
+
+class EventLoopThread(threading.Thread):
     """
-    A thread used by the music server to accept clients asynchronously.
+    A thread running the music server's event loop, which drives all of the server's sockets.
     """
-    def __init__(self, listening_socket, on_recv_callback):
-        """
-        Initialize the receive thread, with the given socket and the goven callback function.
-        The callback will be triggered for every clients that established a new connection with the server.
-
-        :param listening_socket: The socket to accept clients to. Must be bound and in listening mode.
-        :param on_recv_callback: Function that receives data, connection and address to be called with every
-                                 connection that is established.
-        """
-        super().__init__()
-        self.listening_socket = listening_socket
-        self.on_recv_callback = on_recv_callback
-        self.should_stop = threading.Event()
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__(daemon=True)
+        self.loop = loop
 
     def run(self):
-        """
-        Accept a new client and call the callback, endlessly, or until `stop` is called.
-        Note that there is no timeout for accepting clients.
-        """
-        while not self.should_stop.is_set():
-            try:
-                conn, address = self.listening_socket.accept()
-                data = conn.recv(len('hello'))
-                self.on_recv_callback(data, conn, address)
-            except (Exception, OSError) as e:
-                if e.errno == 10038:
-                    break
-                raise
-            except (Exception, socket.error) as e:
-                print(f"An error occured on server thread: {e}")
-                raise
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join()
 
 
 class MusicServer(object):
     """
     The music server is used for accepting clients (to play the music), serving them files and signaling them when to
     play music or stop playing.
+
+    All the sockets of the server are non-blocking and driven by a single event loop running on its own thread, so
+    that a slow client never holds up the others. The public methods are blocking, and may be called from any thread.
     """
-    clients: List[LengthSocket]
+    clients: List[ClientConnection]
 
-    def __init__(self, ip, port, max_clients=10):
+    def __init__(self, ip, port, backlog=socket.SOMAXCONN, who_has_timeout=WHO_HAS_TIMEOUT, catalog=None, swarm=True,
+                 multicast_group=None, multicast_rate=MULTICAST_RATE, signal_datagrams=False, signal_group=None,
+                 signal_redundancy=SIGNAL_REDUNDANCY, compression=True, compression_cache_dir=None,
+                 heartbeat_interval=HEARTBEAT_INTERVAL):
         """
         Initialize a new server, who'll accept clients in the given ip:port.
         :param ip: The address of the server.
         :param port: The port of the server.
-        :param max_clients: Maximum amount of clients to be handled by the server. Default is 10.
+        :param backlog: Amount of connections waiting to be accepted by the server. Default is the system maximum.
+        :param who_has_timeout: Seconds to wait for the clients to answer whether they have a file, before giving up
+                                on the clients that did not answer.
+        :param catalog: SongCatalog used for identifying the served files by their content. Default is a catalog
+                        cached in the server's code directory.
+        :param swarm: Whether clients that have a file should serve it to the clients that don't, instead of the
+                      server serving it to each of them.
+        :param multicast_group: (address, port) of a multicast group to send new files through, to all the clients
+                                that need them at once. Default is not to use multicast.
+        :param multicast_rate: Maximal amount of bytes to send to the multicast group in a second.
+        :param signal_datagrams: Whether signals should also be sent to every client as a UDP datagram, before they
+                                 are sent over its connection.
+        :param signal_group: (address, port) of a multicast group to send the signals' datagrams to, instead of
+                             sending a datagram to every client. Implies `signal_datagrams`.
+        :param signal_redundancy: Amount of times every signal's datagram is sent, in case some of them are lost.
+        :param compression: Whether files should be sent compressed to clients that support it (see `compression`).
+        :param compression_cache_dir: Directory to keep the compressed copies of the files in. Default is next to the
+                                      catalog's cache file.
+        :param heartbeat_interval: Seconds between heartbeats of the playback position (see `_send_heartbeats`).
+                                   If None, no heartbeats are sent.
         """
         self.clients = []
+        self.who_has_timeout = who_has_timeout
+        self.catalog = catalog or SongCatalog(CATALOG_PATH)
+        self.swarm = swarm
+        self.file_bytes_sent = 0
+        self.serve_lock = threading.Lock()
         self.server_socket = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((ip, port))
-        self.server_socket.listen(max_clients)
+        self.server_socket.listen(backlog)
+        self.server_socket.setblocking(False)
         print(f"Accepting clients at {ip}:{port}")
-        self.recv_thread = RecvClientsThread(self.server_socket,
-                                             lambda data, conn, addr: self.clients.append(conn))
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = EventLoopThread(self.loop)
+        self.loop_thread.start()
+        self.multicast_sender = None
+        if multicast_group is not None:
+            self.multicast_sender = MulticastSender(*multicast_group, self.loop, multicast_rate)
+        self.compression_cache = None
+        if compression:
+            self.compression_cache = CompressionCache(
+                compression_cache_dir or os.path.join(os.path.dirname(self.catalog.cache_path),
+                                                      COMPRESSION_CACHE_DIR_NAME), self.loop)
+        self.signal_group = tuple(signal_group) if signal_group is not None else None
+        self.signal_redundancy = signal_redundancy
+        self.signal_seq = random.getrandbits(31)
+        self.signal_socket = None
+        if signal_datagrams or signal_group is not None:
+            self.signal_socket = multicast_sender_socket()
+            self.signal_socket.setblocking(False)
+        self.accept_task = None
+        self.client_tasks = set()
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_task = None
+        # Clients in the middle of receiving a multicast, which are not sent heartbeats (see `_send_heartbeats`).
+        self.multicast_clients = set()
+        # The song being played, the server's time it was (or will be) at position 0, and its position if paused.
+        self.playing_file = None
+        self.play_start_time = 0
+        self.paused_position = None
 
     def close(self):
         self.stop()
+        self._run(self._close_clients())
+        self.loop_thread.stop()
+        self.loop.close()
+        if self.multicast_sender is not None:
+            self.multicast_sender.close()
+        if self.signal_socket is not None:
+            self.signal_socket.close()
         self.server_socket.close()
         print('music server closed')
         return None
@@ -78,10 +148,11 @@ class MusicServer(object):
         """
         Run the server and start accepting clients.
         """
-        if not self.recv_thread.is_alive():
-            self.recv_thread.start()
+        self._run(self._start_accepting())
+        if self.heartbeat_interval is not None and self.heartbeat_task is None:
+            self.heartbeat_task = self._run(self._start_heartbeats())
 
-    def signal_play_all(self, music_file):
+    def signal_play_all(self, music_file, wait_seconds=DEFAULT_WAIT_SECONDS):
         """
         Send all the clients a signal to begin playing the given file.
         Note that this method doesn't assure that all clients actually have the needed file.
@@ -90,11 +161,12 @@ class MusicServer(object):
         NTP server, so that all clients will play together. Waiting threshold is sent with the signal packet.
 
         :param music_file: Music file name to be played by client. Could be also path.
+        :param wait_seconds: Seconds from sending the signal until the clients play.
         """
         print("Signal play")
-        self._send_signal(PLAY_SIGNAL, music_file_name=os.path.basename(music_file))
+        self._run(self._send_signal(PLAY_SIGNAL, wait_seconds, os.path.basename(music_file)))
 
-    def signal_stop_all(self):
+    def signal_stop_all(self, wait_seconds=DEFAULT_WAIT_SECONDS):
         """
         Signal all the clients to stop playing music.
 
@@ -102,9 +174,9 @@ class MusicServer(object):
         NTP server, so that all clients will stop playing together. Waiting threshold is sent with the signal packet.
         """
         print("Signal stop")
-        self._send_signal(STOP_SIGNAL)
+        self._run(self._send_signal(STOP_SIGNAL, wait_seconds))
 
-    def signal_pause_all(self):
+    def signal_pause_all(self, wait_seconds=DEFAULT_WAIT_SECONDS):
         """
         Signal all the clients to pause playing music.
 
@@ -112,9 +184,9 @@ class MusicServer(object):
         NTP server, so that all clients will stop playing together. Waiting threshold is sent with the signal packet.
         """
         print("Signal pause")
-        self._send_signal(PAUSE_SIGNAL)
+        self._run(self._send_signal(PAUSE_SIGNAL, wait_seconds))
 
-    def signal_unpause_all(self):
+    def signal_unpause_all(self, wait_seconds=DEFAULT_WAIT_SECONDS):
         """
         Signal all the clients to continue playing music (after pause).
 
@@ -122,70 +194,599 @@ class MusicServer(object):
         NTP server, so that all clients will stop playing together. Waiting threshold is sent with the signal packet.
         """
         print("Signal pause")
-        self._send_signal(UNPAUSE_SIGNAL)
+        self._run(self._send_signal(UNPAUSE_SIGNAL, wait_seconds))
 
     def serve_music_file(self, local_file_path: str):
         """
         Serve the given music file to all the clients that don't have it in their repository.
+        Files are identified by the hash of their content, so a client that has a file with the same name but a
+        different content is sent the file again. Such clients answer with the block signatures of their file, and are
+        sent only the blocks that changed (DELTA_SEND, followed by DELTA_COPY and DELTA_DATA packets) if the files
+        are similar enough.
+        In swarm mode, the server sends the file itself to a single client at most. The rest of the clients are told to
+        fetch it from clients that already have it (FETCH), so the file spreads in about log(clients) rounds.
+        Clients list the codecs they support in their answers, and the file is sent to them compressed if it is
+        worth it (see `CompressionCache`).
+        In multicast mode, the file is sent once to a multicast group that all the clients that need it join
+        (MULTICAST_SEND). Every client then asks for the blocks it lost (NACK), and is sent only them.
         If a client doesn't have the file, the communication with it would be as so:
 
         Server                                          Client
         FileSyncPacket(message_type=WHO_HAS)    --->    look for file in repository
                                                 <---    FileSyncPacket(message_type=MISSING)
         FileSyncPacket(message_type=FILE_SEND)  --->    get file name and size
-        file chunk (1024 bytes)                 --->    write to repository
+        FileSyncPacket(message_type=DELTA_DATA) --->    get chunk size
+        file chunk (SEND_CHUNK_SIZE bytes)      --->    write to repository
             .                                   --->        .
             .                                   --->        .
             .                                   --->        .
+        FileSyncPacket(message_type=DELTA_DATA) --->    get chunk size
         file chunk (last)                       --->    read all file size; stop reading from stream.
 
+        Signals and heartbeats may be sent between the chunks, so that they don't wait for the whole file.
+
+        Files are served one at a time: a call made while another file is being served waits for it to finish.
+
         :param local_file_path: Local path to a music file to be synced with all clients.
+        :return: The clients that have the file now: the ones that already had it, and the ones it was sent to. Clients
+                 that did not answer in time, or that the file could not be sent to, are left out.
+        """
+        with self.serve_lock:
+            return self._run(self._serve_music_file(local_file_path))
+
+    def stop(self):
+        """
+        Stop the server from accepting clients.
+        """
+        self._run(self._stop_accepting())
+
+    def _run(self, coro):
+        """
+        Run the given coroutine on the server's event loop, and wait for its result.
         """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _start_accepting(self):
+        if self.accept_task is None:
+            self.accept_task = self.loop.create_task(self._accept_clients())
+
+    async def _start_heartbeats(self) -> asyncio.Task:
+        task = self.loop.create_task(self._send_heartbeats())
+        self.client_tasks.add(task)
+        return task
+
+    async def _stop_accepting(self):
+        if self.accept_task is not None:
+            self.accept_task.cancel()
+            try:
+                await self.accept_task
+            except asyncio.CancelledError:
+                pass
+            self.accept_task = None
+
+    async def _close_clients(self):
+        for task in list(self.client_tasks):
+            task.cancel()
+        for client in self.clients:
+            client.close()
+        self.clients = []
+
+    async def _accept_clients(self):
+        """
+        Accept new clients endlessly, until the task is cancelled.
+        Every client is handled by its own task, so accepting never waits for a client's handshake.
+        """
+        while True:
+            try:
+                conn, address = await self.loop.sock_accept(self.server_socket)
+            except OSError as e:
+                print(f"An error occured while accepting clients: {e}")
+                continue
+            self._spawn(self._handle_client(conn, address))
+
+    async def _handle_client(self, conn: LengthSocket, address):
+        """
+        Receive the client's hello, and then read its messages until it disconnects.
+        """
+        client = ClientConnection(conn, address, self.loop)
+        try:
+            hello = await asyncio.wait_for(conn.async_recv(self.loop, len(HELLO)), HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError, OSError) as e:
+            print(f"Handshake with {client} failed: {e}")
+            client.close()
+            return
+        if hello != HELLO:
+            print(f"Unexpected hello from {client}: {hello}")
+            client.close()
+            return
+        self.clients.append(client)
+        await client.read_messages()
+        self._drop_client(client)
+
+    def _spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self.client_tasks.add(task)
+        task.add_done_callback(self.client_tasks.discard)
+
+    def _drop_client(self, client: ClientConnection):
+        if client in self.clients:
+            self.clients.remove(client)
+            client.close()
+
+    async def _send_to_all(self, clients: List[ClientConnection], packets):
+        """
+        Send all the given packets to all the given clients, concurrently.
+        Packets are sent one at a time to all the clients, so packets may be generated lazily and only a single one of
+        them is held in memory.
+        If there was a failure while trying to send a packet to a client, this client is disconnected and will not be
+        receiving any more of the packets that are sent.
+
+        :param clients: Clients to send the packets to.
+        :param packets: Packets to be sent to all clients.
+        """
+        clients = list(clients)
+        for packet in packets:
+            if not clients:
+                break
+            results = await asyncio.gather(*(client.send(packet) for client in clients), return_exceptions=True)
+            for client, result in zip(list(clients), results):
+                if isinstance(result, Exception):
+                    print(f"Could not send packets to {client}: {result}")
+                    print(f"Stopping transmit to {client}")
+                    clients.remove(client)
+                    self._drop_client(client)
+
+    async def _serve_music_file(self, local_file_path: str) -> List[ClientConnection]:
         print(f"Sending file {local_file_path}")
-        missing_clients = self._query_file_existence(local_file_path)
-        send_to_all(missing_clients, send_file_packets(local_file_path))
+        file_hash = await self.loop.run_in_executor(None, self.catalog.hash_of, local_file_path)
+        answers, _ = await self._query_file_existence(local_file_path, file_hash)
+        missing_clients = {conn: answer for conn, answer in answers.items() if answer.message_type == MISSING}
+        seeders = [conn for conn, answer in answers.items() if answer.message_type == HAVE and conn.peer_port]
+        had_file = {conn for conn, answer in answers.items() if answer.message_type == HAVE}
+        received = await self._send_file_to_all(missing_clients, local_file_path, file_hash, seeders)
+        return [client for client in self.clients if client in had_file or client in received]
+
+    async def _send_file_to_all(self, clients: Dict[ClientConnection, FileSyncPacket], local_file_path: str,
+                                file_hash: str = "", seeders: List[ClientConnection] = ()) -> Set[ClientConnection]:
+        """
+        Send the given file to all the given clients, concurrently.
+        The file's content goes straight from the OS to the sockets (see `LengthSocket.send_file`), so it is never
+        read into the server's memory.
+        Clients that answered with an offset already received a part of the file, and are sent the rest of it.
+        Clients that answered with the signatures of an outdated copy of the file are sent only its changes. The
+        changes are planned once for every distinct outdated copy.
+        The rest of the clients are sent the file by multicast (see `_multicast_file`) or, in swarm mode, by their
+        peers (see `_swarm_file`).
+        If there was a failure while trying to send the file to a client, this client is disconnected.
+
+        :param clients: Clients to send the file to, mapped to their answers to WHO_HAS.
+        :param local_file_path: Path of the file to be sent.
+        :param file_hash: Content hash of the file, sent to the clients for verification.
+        :param seeders: Clients that have the file, and can serve it to their peers.
+        :return: The clients the file was sent to.
+        """
+        plans = {}
+        fresh_clients = [client for client, answer in clients.items() if not answer.offset and not answer.signatures]
+        multicast_clients = []
+        swarm_clients = []
+        if self.multicast_sender is not None and file_hash and len(fresh_clients) >= MULTICAST_MIN_CLIENTS:
+            multicast_clients = fresh_clients
+        elif self.swarm and file_hash:
+            swarm_clients = fresh_clients
+        clients = {client: answer for client, answer in clients.items()
+                   if client not in multicast_clients and client not in swarm_clients}
+
+        async def send(client: ClientConnection, answer: FileSyncPacket):
+            plan = None
+            if 0 < answer.offset < os.path.getsize(local_file_path):
+                print(f"Resuming {local_file_path} to {client} from {answer.offset}")
+                await self._send_file(client, local_file_path, file_hash, answer.offset)
+                return
+            if answer.signatures:
+                key = (answer.block_size, answer.signatures)
+                if key not in plans:
+                    plans[key] = self.loop.run_in_executor(None, delta_plan, local_file_path, answer.block_size,
+                                                           unpack_signatures(answer.signatures))
+                plan = await plans[key]
+            if plan is None:
+                await self._send_file(client, local_file_path, file_hash)
+            else:
+                await self._send_delta(client, local_file_path, file_hash, answer.block_size, plan)
 
-    def _query_file_existence(self, local_file_path: str) -> List[LengthSocket]:
+        clients = list(clients.items())
+        results = await asyncio.gather(self._multicast_file(multicast_clients, local_file_path, file_hash),
+                                       self._swarm_file(swarm_clients, list(seeders), local_file_path, file_hash),
+                                       *(send(client, answer) for client, answer in clients), return_exceptions=True)
+        received = set()
+        for result in results[:2]:
+            if isinstance(result, Exception):
+                print(f"Could not spread {local_file_path}: {result!r}")
+            else:
+                received.update(result)
+        for (client, _), result in zip(clients, results[2:]):
+            if isinstance(result, Exception):
+                print(f"Could not send {local_file_path} to {client}: {result}")
+                self._drop_client(client)
+            else:
+                received.add(client)
+        return received
+
+    async def _multicast_file(self, clients: List[ClientConnection], local_file_path: str,
+                              file_hash: str) -> List[ClientConnection]:
+        """
+        Send the given file to all the given clients at once, through the multicast group.
+        Clients are told to join the group first (MULTICAST_SEND), and the file is sent once all of them are ready.
+        Then, every client is sent the blocks it is still missing (see `_repair_multicast`).
+
+        :param clients: Clients that don't have the file.
+        :param local_file_path: Path of the file to be sent.
+        :param file_hash: Content hash of the file.
+        :return: The clients that received the file.
+        """
+        if not clients:
+            return []
+        self.multicast_clients.update(clients)
+        try:
+            announcement = multicast_send_packet(local_file_path, file_hash, self.multicast_sender.group,
+                                                 self.multicast_sender.port, self.multicast_sender.block_size)
+            answers = await asyncio.gather(*(self._ask_who_has(client, announcement) for client in clients),
+                                           return_exceptions=True)
+            receivers = []
+            for client, answer in zip(clients, answers):
+                if isinstance(answer, Exception):
+                    print(f"{client} did not join the multicast of {local_file_path}: {answer!r}")
+                    self._drop_client(client)
+                elif answer.message_type == MISSING:
+                    receivers.append(client)
+            if not receivers:
+                return []
+            interface = receivers[0].socket.getsockname()[0]
+            print(f"Multicasting {local_file_path} to {len(receivers)} clients")
+            sent = await self.multicast_sender.send_file(local_file_path, file_hash, interface)
+            self.file_bytes_sent += sent
+            repaired = await asyncio.gather(*(self._repair_multicast(client, local_file_path, file_hash)
+                                              for client in receivers))
+            return [client for client, has_file in zip(receivers, repaired) if has_file]
+        finally:
+            self.multicast_clients.difference_update(clients)
+
+    async def _repair_multicast(self, client: ClientConnection, local_file_path: str, file_hash: str) -> bool:
+        """
+        Tell the client the multicast of the file ended (MULTICAST_END), and send it the byte ranges it asks for in
+        its NACK. If the client still doesn't have the file afterwards, the whole file is sent to it directly.
+
+        :return: Whether the client has the file now.
+        """
+        file_name = os.path.basename(local_file_path).encode('utf-8')
+        try:
+            await client.send(FileSyncPacket(message_type=MULTICAST_END, file_name=file_name))
+            nack = await asyncio.wait_for(self._recv_file_sync(client, file_name, (NACK,)), self.who_has_timeout)
+            ranges = unpack_ranges(nack.signatures)
+            if ranges:
+                print(f"Repairing {sum(count for _, count in ranges)} bytes of {local_file_path} for {client}")
+            for offset, count in ranges:
+                await self._send_content(client, local_file_path, offset, count)
+            answer = await self._recv_who_has_answer(client, file_name)
+        except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+            print(f"Could not repair the multicast of {local_file_path} for {client}: {e!r}")
+            self._drop_client(client)
+            return False
+        if answer.message_type == HAVE:
+            return True
+        print(f"{client} did not receive {local_file_path} by multicast, sending it directly")
+        return await self._send_file_or_drop(client, local_file_path, file_hash)
+
+    async def _swarm_file(self, clients: List[ClientConnection], seeders: List[ClientConnection],
+                          local_file_path: str, file_hash: str) -> Set[ClientConnection]:
+        """
+        Spread the given file between the given clients: every seeder (a client that has the file) is in charge of
+        one client that doesn't at a time, and tells it to fetch the file from the seeder. Once it has the file, this
+        client becomes a seeder as well, so the amount of seeders doubles on every round.
+        The server sends the file itself only if there are no seeders to begin with (to a single client), or to
+        clients that failed fetching it from their peer. Clients that don't serve their peers can't become seeders, so
+        if none of the clients does, the server sends the file to all of them.
+
+        :param clients: Clients that don't have the file.
+        :param seeders: Clients that have the file, and can serve it to their peers.
+        :param local_file_path: Path of the file to be spread.
+        :param file_hash: Content hash of the file.
+        :return: The clients that received the file.
+        """
+        pending = collections.deque(clients)
+        received = set()
+        while pending and not seeders:
+            first = next((client for client in pending if client.peer_port), None)
+            if first is None:
+                sent = await asyncio.gather(*(self._send_file_or_drop(client, local_file_path, file_hash)
+                                              for client in pending))
+                received.update(client for client, has_file in zip(pending, sent) if has_file)
+                return received
+            pending.remove(first)
+            if await self._send_file_or_drop(first, local_file_path, file_hash, confirm=True):
+                seeders.append(first)
+                received.add(first)
+
+        tasks = []
+
+        async def seed(seeder: ClientConnection):
+            while pending:
+                client = pending.popleft()
+                if await self._fetch_from_peer(client, seeder, local_file_path, file_hash):
+                    received.add(client)
+                    if client.peer_port:
+                        tasks.append(self.loop.create_task(seed(client)))
+
+        tasks.extend(self.loop.create_task(seed(seeder)) for seeder in seeders)
+        for task in tasks:
+            await task
+        return received
+
+    async def _fetch_from_peer(self, client: ClientConnection, seeder: ClientConnection, local_file_path: str,
+                               file_hash: str) -> bool:
+        """
+        Tell the client to fetch the file from the seeder, and wait until it did. If the client could not fetch the
+        file, the server sends it by itself. A client that doesn't answer in time (see `_transfer_timeout`) is dropped.
+
+        :return: Whether the client has the file now.
+        """
+        file_name = os.path.basename(local_file_path).encode('utf-8')
+        try:
+            await client.send(fetch_packet(local_file_path, file_hash, seeder.address[0], seeder.peer_port))
+            answer = await asyncio.wait_for(self._recv_who_has_answer(client, file_name),
+                                            self._transfer_timeout(local_file_path))
+        except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+            print(f"Could not tell {client} to fetch {local_file_path}: {e!r}")
+            self._drop_client(client)
+            return False
+        if answer.message_type == HAVE:
+            return True
+        print(f"{client} could not fetch {local_file_path} from {seeder}, sending it directly")
+        offset = answer.offset if 0 < answer.offset < os.path.getsize(local_file_path) else 0
+        return await self._send_file_or_drop(client, local_file_path, file_hash, offset, confirm=True)
+
+    async def _send_file_or_drop(self, client: ClientConnection, local_file_path: str, file_hash: str,
+                                 offset: int = 0, confirm: bool = False) -> bool:
+        """
+        Send the file to the client, disconnecting it on failure.
+        If `confirm` is set, wait until the client has the whole file: it is asked WHO_HAS once more, which it handles
+        only after receiving the file. A client that doesn't answer in time (see `_transfer_timeout`) is dropped.
+
+        :return: Whether the file was sent (and confirmed, if required).
+        """
+        try:
+            await self._send_file(client, local_file_path, file_hash, offset)
+            if not confirm:
+                return True
+            await client.send(who_has_packet(local_file_path, file_hash))
+            answer = await asyncio.wait_for(
+                self._recv_who_has_answer(client, os.path.basename(local_file_path).encode('utf-8')),
+                self._transfer_timeout(local_file_path))
+            return answer.message_type == HAVE
+        except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+            print(f"Could not send {local_file_path} to {client}: {e!r}")
+            self._drop_client(client)
+            return False
+
+    def _transfer_timeout(self, local_file_path: str) -> float:
+        """
+        Seconds to wait for a client to answer once it was sent the given file (or told to fetch it): the time it takes
+        to receive the file at `MIN_TRANSFER_RATE`, on top of `who_has_timeout`.
+        """
+        return self.who_has_timeout + os.path.getsize(local_file_path) / MIN_TRANSFER_RATE
+
+    async def _send_file(self, client: ClientConnection, local_file_path: str, file_hash: str = "", offset: int = 0):
+        """
+        Send a FILE_SEND packet followed by the file's content (from the given offset on) to the client, in chunks (see
+        `_send_content`).
+        A whole file is sent compressed if the client supports one of the server's codecs, and it is worth it (see
+        `CompressionCache`).
+        """
+        content_path = local_file_path
+        codec = ""
+        if offset == 0 and self.compression_cache is not None:
+            codec = choose_codec(client.codecs)
+            compressed_path = await self.compression_cache.compressed_path(local_file_path, file_hash, codec)
+            if compressed_path is None:
+                codec = ""
+            else:
+                content_path = compressed_path
+        content_size = os.path.getsize(content_path) if codec else 0
+        header = file_send_packet(local_file_path, file_hash, offset, codec, content_size)
+        await self._send_content(client, content_path, offset, os.path.getsize(content_path) - offset, [header])
+
+    async def _send_delta(self, client: ClientConnection, local_file_path: str, file_hash: str, block_size: int,
+                          plan):
+        """
+        Send the file to the client by the given delta plan (see `delta.delta_plan`).
+        Packets are queued until content has to follow them, and are then sent together in a single write. The content
+        is sent in chunks (see `_send_content`).
+        """
+        print(f"Sending {plan_literal_size(plan)} bytes of {local_file_path} to {client} as a delta")
+        queued = []
+        for packet in delta_packets(local_file_path, file_hash, block_size, plan):
+            if packet.message_type == DELTA_DATA:
+                await self._send_content(client, local_file_path, packet.offset, packet.file_size, queued)
+                queued = []
+            else:
+                queued.append(packet)
+        if queued:
+            async with client.send_lock:
+                await client.send_batch_locked(queued)
+
+    async def _send_content(self, client: ClientConnection, file_path: str, offset: int, count: int,
+                            packets: List[FileSyncPacket] = ()):
+        """
+        Send a part of a file to the client, in chunks of up to `SEND_CHUNK_SIZE` bytes. Every chunk is preceded by a
+        DELTA_DATA packet with its offset and size.
+        The client is locked only while a single chunk is sent, so other packets (like signals) are sent between the
+        chunks rather than after the whole file.
+
+        :param file_path: Path of the file to be sent.
+        :param offset: Position in the file to start sending from.
+        :param count: Amount of bytes to send.
+        :param packets: Packets to send in the same write as the header of the first chunk.
+        """
+        end = offset + count
+        packets = list(packets)
+        while offset < end or packets:
+            size = min(SEND_CHUNK_SIZE, end - offset)
+            async with client.send_lock:
+                if size:
+                    packets.append(FileSyncPacket(message_type=DELTA_DATA, offset=offset, file_size=size))
+                await client.send_batch_locked(packets)
+                if size:
+                    self.file_bytes_sent += await client.send_file_locked(file_path, offset, size)
+            packets = []
+            offset += size
+
+    async def _query_file_existence(self, local_file_path: str, file_hash: str = ""):
         """
         Check which of the clients have the given file in their repository.
-        Return a list of all the clients that responded with `FileSyncPacket(message_type=MISSING)` to a
-        `FileSyncPacket(message_type=WHO_HAS)` packet.
+        A `FileSyncPacket(message_type=WHO_HAS)` packet is sent to all the clients at once, and their answers are
+        gathered until the server's `who_has_timeout` passes.
 
         :param local_file_path: File to look for in clients.
-        :return: List of all the clients that don't have the required file and should be synced.
+        :param file_hash: Content hash of the file, so that clients will compare the content of their files.
+        :return: Tuple of all the clients that answered (mapped to their answers), and a list of all the clients that
+                 did not answer in time.
         """
-        who_has = who_has_packet(local_file_path)
-        missing_clients = []
-        for conn in self.clients:
-            print(f"{conn} has {local_file_path}?")
-            try:
-                conn.send(who_has)
-                ans = GeneralPacket(conn.recv())[FileSyncPacket]
-                if ans.message_type == MISSING:
-                    missing_clients.append(conn)
+        who_has = who_has_packet(local_file_path, file_hash)
+        clients = list(self.clients)
+        answers = await asyncio.gather(*(self._ask_who_has(conn, who_has) for conn in clients),
+                                       return_exceptions=True)
+        answered_clients = {}
+        unanswered_clients = []
+        for conn, answer in zip(clients, answers):
+            if isinstance(answer, asyncio.TimeoutError):
+                print(f"{conn} did not answer whether it has {local_file_path} in {self.who_has_timeout} seconds")
+                unanswered_clients.append(conn)
+            elif isinstance(answer, Exception):
+                print(f"Could not check {conn}: {answer}")
+            else:
+                answered_clients[conn] = answer
+                if answer.message_type == MISSING:
                     print(f"Sending file to {conn}")
-            except (Exception, socket.error) as e:
-                print(f"Could not check {conn}: {e}")
-        return missing_clients
+        return answered_clients, unanswered_clients
 
-    def _send_signal(self, signal, wait_seconds=DEFAULT_WAIT_SECONDS, music_file_name=None):
+    async def _ask_who_has(self, conn: ClientConnection, who_has: FileSyncPacket) -> FileSyncPacket:
+        """
+        Send a WHO_HAS packet to the client and wait for its answer, for up to `who_has_timeout` seconds.
+        Answers about other files (left over from queries the client answered too late) are discarded.
+
+        :param conn: Client to ask.
+        :param who_has: The WHO_HAS packet to be sent.
+        :return: The client's answer.
+        :raise asyncio.TimeoutError: If the client did not answer in time.
+        """
+        print(f"{conn} has {who_has.file_name}?")
+        await conn.send(who_has)
+        return await asyncio.wait_for(self._recv_who_has_answer(conn, who_has.file_name), self.who_has_timeout)
+
+    @staticmethod
+    async def _recv_who_has_answer(conn: ClientConnection, file_name: bytes) -> FileSyncPacket:
+        answer = await MusicServer._recv_file_sync(conn, file_name, (HAVE, MISSING))
+        conn.peer_port = answer.peer_port
+        if answer.codecs:
+            conn.codecs = answer.codecs.decode('utf-8').split(",")
+        return answer
+
+    @staticmethod
+    async def _recv_file_sync(conn: ClientConnection, file_name: bytes, message_types) -> FileSyncPacket:
+        """
+        Wait for a FileSyncPacket of one of the given types about the given file. Other packets (left over from
+        queries the client answered too late) are discarded.
+        """
+        while True:
+            answer = (await conn.recv())[FileSyncPacket]
+            if answer.message_type in message_types and answer.file_name in (file_name, b""):
+                return answer
+            print(f"Discarding stale answer from {conn}: {answer!r}")
+
+    async def _send_signal(self, signal, wait_seconds=DEFAULT_WAIT_SECONDS, music_file_name=None):
         """
         Send a signal packet to all the clients. Signal might be any of the signal types allows by `SignalPacket`
+        Every signal has a sequence number of its own, so that clients handle it once, no matter how many times it
+        reached them. If signal datagrams are enabled, the signal is sent as datagrams first (see
+        `_send_signal_datagrams`), and the connections of the clients are the fallback for lost datagrams.
         :param signal: A signal accepted by `SignalPacket` (see: signal_packet.commands).
         :param wait_seconds: Amount of seconds clients should wait before executing the command signaled in
                              order to be synced.
         :param music_file_name: Name of the file to be played. Required only for play signal.
         """
         send_time = datetime.now().timestamp()
+        self.signal_seq += 1
         signal_packet = SignalPacket(signal=signal,
                                      send_timestamp=send_time,
                                      wait_seconds=wait_seconds,
+                                     seq=self.signal_seq,
                                      music_file_name=music_file_name or "")
-        send_to_all(self.clients, [signal_packet])
+        self._track_playback(signal_packet)
+        if self.signal_socket is not None:
+            datagram = build_packet(signal_packet)
+            self._send_signal_datagrams(datagram)
+            self._spawn(self._retransmit_signal(datagram))
+        await self._send_to_all(self.clients, [signal_packet])
 
-    def stop(self):
+    def _track_playback(self, signal_packet: SignalPacket):
         """
-        Stop the server from accepting clients.
+        Keep track of the position the clients should be at in the song, by the signals they are sent.
+        """
+        execute_time = signal_packet.send_timestamp + signal_packet.wait_seconds
+        if signal_packet.signal == PLAY_SIGNAL:
+            self.playing_file = signal_packet.music_file_name
+            self.play_start_time = execute_time
+            self.paused_position = None
+        elif signal_packet.signal == STOP_SIGNAL:
+            self.playing_file = None
+        elif signal_packet.signal == PAUSE_SIGNAL and self.paused_position is None:
+            self.paused_position = max(execute_time - self.play_start_time, 0)
+        elif signal_packet.signal == UNPAUSE_SIGNAL and self.paused_position is not None:
+            self.play_start_time = execute_time - self.paused_position
+            self.paused_position = None
+
+    async def _send_heartbeats(self):
         """
-        self.recv_thread.should_stop.set()
+        Send the clients the position they should be at in the song being played (POSITION_SIGNAL), every
+        `heartbeat_interval` seconds, so that they can correct their drift (see `DriftCorrector`).
+        Heartbeats are sent only while the song is playing, and (like signals) are sent as datagrams too if signal
+        datagrams are enabled. A lost heartbeat is not sent again, as the next one will come soon.
+        Clients that are receiving a multicast are skipped, as they wait for the packets of the multicast's exchange
+        on their connection.
+        """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = datetime.now().timestamp()
+            if self.playing_file is None or self.paused_position is not None or now < self.play_start_time:
+                continue
+            self.signal_seq += 1
+            heartbeat = SignalPacket(signal=POSITION_SIGNAL, send_timestamp=now, wait_seconds=0, seq=self.signal_seq,
+                                     position=now - self.play_start_time, music_file_name=self.playing_file)
+            if self.signal_socket is not None:
+                self._send_signal_datagrams(build_packet(heartbeat))
+            await self._send_to_all([client for client in self.clients if client not in self.multicast_clients],
+                                    [heartbeat])
+
+    def _send_signal_datagrams(self, datagram: bytes):
+        """
+        Send a signal's datagram to the signal multicast group, or to the address of every client (which listens for
+        signals on a UDP port with the same number as its connection's port). Sending a datagram never waits for the
+        client, so all the clients get the signal at about the same time, no matter how many there are.
+        """
+        if self.signal_group is not None:
+            if self.clients:
+                interface = self.clients[0].socket.getsockname()[0]
+                self.signal_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+            addresses = [self.signal_group]
+        else:
+            addresses = [client.address for client in self.clients]
+        for address in addresses:
+            try:
+                self.signal_socket.sendto(datagram, address)
+            except OSError as e:
+                print(f"Could not send signal datagram to {address}: {e}")
+
+    async def _retransmit_signal(self, datagram: bytes):
+        for _ in range(self.signal_redundancy - 1):
+            await asyncio.sleep(SIGNAL_RETRANSMIT_INTERVAL)
+            self._send_signal_datagrams(datagram)
 
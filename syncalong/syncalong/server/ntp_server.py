@@ -1,10 +1,11 @@
+import asyncio
 import datetime
+import math
 import socket
 import struct
+import sys
 import time
-import queue
 import threading
-import select
 
 
 def system_to_ntp_time(timestamp):
@@ -236,99 +237,412 @@ class NTPPacket:
         self.orig_timestamp_low = low
 
 
-class RecvThread(threading.Thread):
-    def __init__(self, ntp_socket, task_queue, delay=0):
-        threading.Thread.__init__(self)
-        self.socket = ntp_socket
-        self.task_queue = task_queue
-        self.should_stop = False
-        # Customizable delay, can be used for testing or simulation an offset
-        # NTP server - default to Zero delay
-        self.delay = delay
+# Precompiled format of a whole NTP packet (see `NTPPacket`), for answering requests without building packet objects.
+NTP_PACKET = struct.Struct(NTPPacket._PACKET_FORMAT)
+# Offset of the transmit timestamp in a request, which is copied to the originate timestamp of the answer.
+TX_TIMESTAMP_OFFSET = 40
+TIMESTAMP = struct.Struct("!II")
+NTP_WORKERS = 4
+RECV_TIMEOUT = 1
+
+SERVER_VERSION = 4
+SERVER_MODE = 4
+SERVER_POLL = 10
+LEAP_ALARM = 3
+# In accurate mode, the server's own clock is the reference of all the clients.
+LOCAL_STRATUM = 1
+LOCAL_REF_ID = int.from_bytes(b"LOCL", 'big')
+# log2 of the resolution of the clock the timestamps are read from, and the error of reading it.
+PRECISION = max(-128, math.ceil(math.log2(time.get_clock_info('time').resolution)))
+ROOT_DISPERSION = 2.0 ** PRECISION
+# In simulated offset mode, the server pretends its clock was updated this many seconds before every request.
+SIMULATED_STRATUM = 2
+SIMULATED_REF_AGE = 5
+
+# Receive timestamps of the kernel (a struct timespec per datagram). Not exported by the socket module on Linux.
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None)
+TIMESPEC = struct.Struct("@qq")
+
+# Default budget of every client: NTP_RATE requests a second on average, in bursts of up to NTP_BURST requests.
+NTP_RATE = 2
+NTP_BURST = 8
+# Buckets that are full again are forgotten once there are more than this many.
+MAX_RATE_SOURCES = 10000
+ALLOW = 0
+KISS = 1
+DROP = 2
+
+
+def _to_short(duration):
+    """Return a duration as an NTP short format (16.16 fixed point), rounded up so that it is never understated."""
+    return min(math.ceil(duration * 2 ** 16), 2 ** 32 - 1)
+
+
+def pack_answer(buffer, request, recv_timestamp, simulated_offset=None):
+    """
+    Pack the answer to the given request into the buffer.
+    In accurate mode, the transmit timestamp is left for `stamp_transmit`, which should be called right before the
+    answer is sent. In simulated offset mode, the answer pretends it was sent `simulated_offset` seconds after the
+    request was received, so the clients see the server as if its clock was offset from theirs.
+
+    :param buffer: Writable buffer of at least `NTP_PACKET.size` bytes.
+    :param request: The request received (at least `NTP_PACKET.size` bytes).
+    :param recv_timestamp: NTP time the request was received at.
+    :param simulated_offset: Seconds to add to the transmit timestamp, for testing. If None (accurate mode), the
+                             answer tells the actual time.
+    """
+    orig_timestamp_high, orig_timestamp_low = TIMESTAMP.unpack_from(request, TX_TIMESTAMP_OFFSET)
+    if simulated_offset is None:
+        stratum, precision, root_dispersion, ref_id = LOCAL_STRATUM, PRECISION, _to_short(ROOT_DISPERSION), LOCAL_REF_ID
+        ref_timestamp = tx_timestamp = recv_timestamp
+    else:
+        stratum, precision, root_dispersion, ref_id = SIMULATED_STRATUM, 0, 0, 0
+        ref_timestamp = recv_timestamp - SIMULATED_REF_AGE
+        tx_timestamp = recv_timestamp + simulated_offset
+    NTP_PACKET.pack_into(buffer, 0,
+                         SERVER_VERSION << 3 | SERVER_MODE,
+                         stratum,
+                         SERVER_POLL,
+                         precision,
+                         0,
+                         root_dispersion,
+                         ref_id,
+                         _to_int(ref_timestamp), _to_frac(ref_timestamp),
+                         orig_timestamp_high, orig_timestamp_low,
+                         _to_int(recv_timestamp), _to_frac(recv_timestamp),
+                         _to_int(tx_timestamp), _to_frac(tx_timestamp))
+
+
+def stamp_transmit(buffer):
+    """
+    Set the transmit timestamp of an answer in the buffer to now.
+    """
+    tx_timestamp = system_to_ntp_time(time.time())
+    TIMESTAMP.pack_into(buffer, TX_TIMESTAMP_OFFSET, _to_int(tx_timestamp), _to_frac(tx_timestamp))
 
-    def run(self):
-        while not self.should_stop:
-            rlist, wlist, elist = select.select([self.socket], [], [], 1)
-            if len(rlist) != 0:
-                print("Received %d packets" % len(rlist))
-                for temp_socket in rlist:
-                    try:
-                        data, addr = temp_socket.recvfrom(1024)
-                        recv_timestamp = system_to_ntp_time(time.time() + self.delay)
-                        print('RT = %d' % recv_timestamp)  # Receive Timestamp
-                        self.task_queue.put((data, addr, recv_timestamp))
-                    except socket.error as msg:
-                        print("Socket error: %s" % msg)
 
-    def signal_stop(self):
-        self.should_stop = True
+def enable_kernel_timestamps(ntp_socket: socket.socket) -> bool:
+    """
+    Ask the kernel to timestamp every datagram received by the socket (SO_TIMESTAMPNS).
+
+    :return: Whether the kernel timestamps datagrams. If it doesn't, the time they were read at should be used.
+    """
+    if SO_TIMESTAMPNS is None:
+        return False
+    try:
+        ntp_socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError:
+        return False
+    return True
 
 
-class WorkThread(threading.Thread):
-    def __init__(self, ntp_socket, task_queue):
-        threading.Thread.__init__(self)
+def kernel_timestamp(ancdata):
+    """
+    Get the receive time (as an NTP time) out of the ancillary data of a datagram, or None if it has none.
+    """
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(data) >= TIMESPEC.size:
+            seconds, nanoseconds = TIMESPEC.unpack_from(data)
+            return system_to_ntp_time(seconds + nanoseconds / 1e9)
+    return None
+
+
+def pack_kiss_of_death(buffer, request, code=b"RATE"):
+    """
+    Pack a Kiss-o'-Death answer to the given request into the buffer: a packet of stratum 0, whose reference id is
+    the kiss code (RATE tells the client to poll less often). The client's transmit timestamp is copied as usual, so
+    that the client accepts the answer.
+    """
+    orig_timestamp_high, orig_timestamp_low = TIMESTAMP.unpack_from(request, TX_TIMESTAMP_OFFSET)
+    NTP_PACKET.pack_into(buffer, 0,
+                         LEAP_ALARM << 6 | SERVER_VERSION << 3 | SERVER_MODE,
+                         0,
+                         SERVER_POLL,
+                         0, 0, 0,
+                         int.from_bytes(code, 'big'),
+                         0, 0,
+                         orig_timestamp_high, orig_timestamp_low,
+                         0, 0, 0, 0)
+
+
+class RateLimiter(object):
+    """
+    Token bucket of every source: a bucket holds up to `burst` tokens, and is refilled with `rate` tokens a second.
+    Every request takes a token. A request that finds its source's bucket empty is answered with a Kiss-o'-Death
+    (KISS) once, and dropped (DROP) until the source is allowed again.
+    """
+
+    def __init__(self, rate: float = NTP_RATE, burst: float = NTP_BURST, max_sources: int = MAX_RATE_SOURCES):
+        self.rate = rate
+        self.burst = burst
+        self.max_sources = max_sources
+        # source -> [tokens, last update time, whether it was kissed since it was last allowed]
+        self.buckets = {}
+
+    def take(self, source, now: float = None) -> int:
+        """
+        Take a token from the bucket of the given source.
+
+        :return: ALLOW if the request should be answered, KISS if it should be answered with a Kiss-o'-Death, or DROP.
+        """
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.get(source)
+        if bucket is None:
+            if len(self.buckets) >= self.max_sources:
+                self._forget_full_buckets(now)
+            bucket = self.buckets[source] = [self.burst, now, False]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return ALLOW
+        if bucket[2]:
+            return DROP
+        bucket[2] = True
+        return KISS
+
+    def _forget_full_buckets(self, now: float):
+        self.buckets = {source: bucket for source, bucket in self.buckets.items()
+                        if bucket[0] + (now - bucket[1]) * self.rate < self.burst}
+
+
+class NTPWorker(threading.Thread):
+    """
+    Answers NTP requests arriving at its own socket. Several workers may listen on the same port, each with a socket
+    bound with SO_REUSEPORT, so that the kernel spreads the clients between them.
+    Requests are received into a reusable buffer, and answers are packed into another one.
+    In accurate mode, the receive time of a request is the time the kernel received it (SO_TIMESTAMPNS), and the
+    transmit time is stamped right before the answer is sent.
+    """
+
+    def __init__(self, ntp_socket: socket.socket, simulated_offset=None):
+        """
+        :param ntp_socket: Bound socket to answer requests on. Should have a timeout, so that the worker can stop.
+        :param simulated_offset: If given, the server pretends its clock is offset by this many seconds from the
+                                 clients' clocks (see `pack_answer`). For testing only.
+        """
+        super().__init__(daemon=True)
         self.socket = ntp_socket
-        self.task_queue = task_queue
+        self.simulated_offset = simulated_offset
+        self.kernel_timestamps = enable_kernel_timestamps(ntp_socket)
         self.should_stop = False
+        self.requests = 0
+        self.recv_buffer = bytearray(1024)
+        self.send_buffer = bytearray(NTP_PACKET.size)
 
     def run(self):
         while not self.should_stop:
             try:
-                data, addr, recv_timestamp = self.task_queue.get(timeout=2)  # will generate an exception
-                recv_packet = NTPPacket(version=4, mode=3)  # we know this is version 4, client mode
-                recv_packet.from_data(data)
-                time_stamp_high, time_stamp_low = recv_packet.get_tx_time_stamp()
-                send_packet = NTPPacket(version=4, mode=4)  # version 4, server mode
-                send_packet.stratum = 2
-                send_packet.poll = 10
-                send_packet.ref_timestamp = recv_timestamp - 5  # pretend the clock was updated slightly before
-                send_packet.set_origin_time_stamp(time_stamp_high, time_stamp_low)
-                send_packet.recv_timestamp = recv_timestamp
-
-                # for testing: we base the tx_timestamp on the rcvTimestamp, which was purposedly offset
-                # so we simulate an NTP server which is offset from the client
-                # Then we expect the client to gradually align
-                # 1 second of processing delay
-                send_packet.tx_timestamp = recv_timestamp + 1  # system_to_ntp_time(time.time()+self.delay)
-                print('TT = %d' % send_packet.tx_timestamp)  # Transmit Timestamp
-                self.socket.sendto(send_packet.to_data(), addr)
-                print("Sent packet to %s:%d" % (addr[0], addr[1]))
-            except queue.Empty:
+                size, addr, recv_timestamp = self.receive()
+            except socket.timeout:
+                continue
+            except OSError as msg:
+                if self.should_stop:
+                    break
+                print("Socket error: %s" % msg)
+                continue
+            if size < NTP_PACKET.size:
                 continue
+            pack_answer(self.send_buffer, self.recv_buffer, recv_timestamp, self.simulated_offset)
+            if self.simulated_offset is None:
+                stamp_transmit(self.send_buffer)
+            try:
+                self.socket.sendto(self.send_buffer, addr)
+            except OSError as msg:
+                print("Socket error: %s" % msg)
+                continue
+            self.requests += 1
+
+    def receive(self):
+        """
+        Receive a request into the receive buffer.
+
+        :return: Size of the request, address of its sender, and the NTP time it was received at.
+        """
+        if not self.kernel_timestamps:
+            size, addr = self.socket.recvfrom_into(self.recv_buffer)
+            return size, addr, system_to_ntp_time(time.time())
+        size, ancdata, _, addr = self.socket.recvmsg_into([self.recv_buffer], socket.CMSG_SPACE(TIMESPEC.size))
+        recv_timestamp = kernel_timestamp(ancdata)
+        return size, addr, recv_timestamp if recv_timestamp is not None else system_to_ntp_time(time.time())
 
     def signal_stop(self):
         self.should_stop = True
 
 
 class NTPServer(object):
-    def __init__(self, ip, port=123):
+    """
+    NTP server the clients sync their clocks from.
+    Requests are answered by a pool of `NTPWorker` threads. Where SO_REUSEPORT is supported, every worker has a socket
+    of its own on the same port; otherwise, the workers share a single socket.
+    """
+
+    def __init__(self, ip, port=123, workers=NTP_WORKERS, simulated_offset=None):
+        """
+        :param ip: The address of the server.
+        :param port: The port of the server. If 0, a free port is chosen (see `address`).
+        :param workers: Amount of worker threads answering requests.
+        :param simulated_offset: If given, the server pretends its clock is offset by this many seconds from the
+                                 clients' clocks (see `pack_answer`). For testing only.
+        """
         self.ip = ip
         self.port = port
-        self.task_queue = queue.Queue()
-        self.recv_thread = None
-        self.work_thread = None
+        self.workers_count = workers
+        self.simulated_offset = simulated_offset
+        self.sockets = []
+        self.workers = []
+
+    @property
+    def address(self):
+        return self.sockets[0].getsockname()
+
+    @property
+    def requests(self) -> int:
+        """
+        Amount of requests answered so far.
+        """
+        return sum(worker.requests for worker in self.workers)
 
     def start(self):
-        self.ntp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.ntp_socket.bind((self.ip, self.port))
-        print("Starting NTP server socket: {} ".format(self.ntp_socket.getsockname()))
+        reuse_port = hasattr(socket, "SO_REUSEPORT")
+        port = self.port
+        for _ in range(self.workers_count if reuse_port else 1):
+            ntp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if reuse_port:
+                ntp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            ntp_socket.settimeout(RECV_TIMEOUT)
+            ntp_socket.bind((self.ip, port))
+            port = ntp_socket.getsockname()[1]
+            self.sockets.append(ntp_socket)
+        print("Starting NTP server socket: {} ({} workers)".format(self.address, self.workers_count))
+
+        self.workers = [NTPWorker(self.sockets[i % len(self.sockets)], self.simulated_offset)
+                        for i in range(self.workers_count)]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        print("Sopping NTP server...")
+        for worker in self.workers:
+            worker.signal_stop()
+        for worker in self.workers:
+            worker.join()
+        print("NTP server stopped! ({} requests answered)".format(self.requests))
+
+    def close(self):
+        self.stop()
+        for ntp_socket in self.sockets:
+            ntp_socket.close()
+        self.sockets = []
+        print('ntp server closed')
+        return None
 
-        self.recv_thread = RecvThread(self.ntp_socket, self.task_queue)
-        self.recv_thread.start()
-        self.work_thread = WorkThread(self.ntp_socket, self.task_queue)
-        self.work_thread.start()
+
+class NTPProtocol(asyncio.DatagramProtocol):
+    """
+    Answers NTP requests on an event loop. Every source has a budget of requests (see `RateLimiter`), so that a
+    misbehaving client can't starve the others.
+    Datagram transports don't pass on the kernel's receive timestamps, so the receive time of a request is the time
+    it is handed to the protocol (see `NTPWorker` for kernel timestamps).
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, simulated_offset=None):
+        self.rate_limiter = rate_limiter
+        self.simulated_offset = simulated_offset
+        self.transport = None
+        self.send_buffer = bytearray(NTP_PACKET.size)
+        self.served = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self.kisses = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        recv_timestamp = system_to_ntp_time(time.time())
+        if len(data) < NTP_PACKET.size:
+            self.dropped += 1
+            return
+        verdict = self.rate_limiter.take(addr[0])
+        if verdict == ALLOW:
+            pack_answer(self.send_buffer, data, recv_timestamp, self.simulated_offset)
+            if self.simulated_offset is None:
+                stamp_transmit(self.send_buffer)
+            self.served += 1
+        elif verdict == KISS:
+            pack_kiss_of_death(self.send_buffer, data)
+            self.rate_limited += 1
+            self.kisses += 1
+        else:
+            self.rate_limited += 1
+            return
+        # The transport copies the buffer if it can't send it right away.
+        self.transport.sendto(self.send_buffer, addr)
+
+    def error_received(self, exc):
+        print("Socket error: %s" % exc)
+
+
+class AsyncNTPServer(object):
+    """
+    NTP server answering requests on an event loop of its own (see `NTPProtocol`), with a budget of requests for
+    every client. Clients that exceed their budget are answered with a Kiss-o'-Death (RATE) once, and then ignored
+    until they slow down.
+    """
+
+    def __init__(self, ip, port=123, rate=NTP_RATE, burst=NTP_BURST, simulated_offset=None):
+        """
+        :param ip: The address of the server.
+        :param port: The port of the server. If 0, a free port is chosen (see `address`).
+        :param rate: Requests a second every client may send on average.
+        :param burst: Requests every client may send at once.
+        :param simulated_offset: If given, the server pretends its clock is offset by this many seconds from the
+                                 clients' clocks (see `pack_answer`). For testing only.
+        """
+        self.ip = ip
+        self.port = port
+        self.protocol = NTPProtocol(RateLimiter(rate, burst), simulated_offset)
+        self.loop = None
+        self.loop_thread = None
+        self.transport = None
+
+    @property
+    def address(self):
+        return self.transport.get_extra_info('sockname')
+
+    @property
+    def requests(self) -> int:
+        return self.protocol.served
+
+    def counters(self) -> dict:
+        """
+        Amounts of requests served, dropped (invalid), and rate limited (of which `kisses` were answered with a
+        Kiss-o'-Death).
+        """
+        return {"served": self.protocol.served, "dropped": self.protocol.dropped,
+                "rate_limited": self.protocol.rate_limited, "kisses": self.protocol.kisses}
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        endpoint = self.loop.create_datagram_endpoint(lambda: self.protocol, local_addr=(self.ip, self.port))
+        self.transport, _ = asyncio.run_coroutine_threadsafe(endpoint, self.loop).result()
+        print("Starting NTP server socket: {} ".format(self.address))
 
     def stop(self):
         print("Sopping NTP server...")
-        self.recv_thread.signal_stop()
-        self.work_thread.signal_stop()
-        self.recv_thread.join()
-        self.work_thread.join()
-        print("NTP server stopped!")
+        self.loop.call_soon_threadsafe(self.transport.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        print("NTP server stopped! {}".format(self.counters()))
 
     def close(self):
         self.stop()
-        self.ntp_socket.close()
+        self.loop.close()
         print('ntp server closed')
         return None
 
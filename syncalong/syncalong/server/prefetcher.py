@@ -0,0 +1,132 @@
+import os
+import threading
+from typing import Dict, List, Tuple
+
+from syncalong.server.music_server import MusicServer
+
+PREFETCH_LOOKAHEAD = 2
+PREFETCH_INTERVAL = 5
+
+
+class Prefetcher(threading.Thread):
+    """
+    Serves the next songs of the playlist to the clients in the background, while the current song is playing, so
+    that changing a track costs only the play signal.
+
+    The prefetcher remembers which clients every song was served to. A song counts as a hit when it is about to be
+    played and all the connected clients were already served it (and it did not change since). Otherwise it is a miss,
+    and it is served right away. Songs are checked again every `PREFETCH_INTERVAL` seconds, so clients that connect
+    in the middle of a song get the next songs as well.
+    """
+
+    def __init__(self, server: MusicServer, lookahead: int = PREFETCH_LOOKAHEAD):
+        """
+        Initialize a prefetcher for the given server.
+
+        :param server: The server serving the songs.
+        :param lookahead: Amount of the next songs to serve ahead of time.
+        """
+        super().__init__(daemon=True)
+        self.server = server
+        self.lookahead = lookahead
+        self.upcoming: List[str] = []
+        self.synced: Dict[str, Tuple[float, frozenset]] = {}
+        self.sync_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.should_stop = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.in_progress = None
+
+    def run(self):
+        """
+        Serve the upcoming songs whenever they change, or every `PREFETCH_INTERVAL` seconds, until `stop` is called.
+        A song that could not be served is printed and skipped, and is tried again the next time.
+        """
+        while not self.should_stop.is_set():
+            self.wake.wait(PREFETCH_INTERVAL)
+            self.wake.clear()
+            for song_path in self.upcoming[:self.lookahead]:
+                if self.should_stop.is_set():
+                    break
+                with self.sync_lock:
+                    if self.server.clients and not self._is_synced(song_path):
+                        try:
+                            if self._sync(song_path):
+                                self.prefetched += 1
+                        except Exception as e:
+                            print(f"Could not prefetch {song_path}: {e!r}")
+
+    def stop(self):
+        self.should_stop.set()
+        self.wake.set()
+
+    def set_upcoming(self, song_paths: List[str]):
+        """
+        Set the songs that will be played next, by order. The first `lookahead` of them are served in the background.
+        """
+        with self.sync_lock:
+            self.upcoming = list(song_paths)
+            self.synced = {song_path: synced for song_path, synced in self.synced.items()
+                           if song_path in self.upcoming}
+        self.wake.set()
+
+    def ensure(self, song_path: str) -> bool:
+        """
+        Make sure all the clients have the given song, before it is played. If the song is being prefetched right
+        now, wait for it to finish.
+
+        :param song_path: Path of the song that is about to be played.
+        :return: Whether the song was prefetched (a hit), or had to be served now (a miss).
+        """
+        with self.sync_lock:
+            if self._is_synced(song_path):
+                self.hits += 1
+                print(f"Prefetch hit: {song_path}")
+                return True
+            self.misses += 1
+            print(f"Prefetch miss: {song_path}")
+            self._sync(song_path)
+            return False
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self) -> str:
+        """
+        A short description of the prefetcher's progress and hit rate.
+        """
+        progress = f"prefetching {os.path.basename(self.in_progress)}" if self.in_progress else "idle"
+        return f"Prefetch: {progress}, {self.prefetched} songs prefetched, {self.hits} hits, {self.misses} misses " \
+               f"({self.hit_rate:.0%} hit rate)"
+
+    def _is_synced(self, song_path: str) -> bool:
+        if song_path not in self.synced:
+            return False
+        mtime, clients = self.synced[song_path]
+        try:
+            return os.path.getmtime(song_path) == mtime and clients.issuperset(self.server.clients)
+        except OSError:
+            return False
+
+    def _sync(self, song_path: str) -> bool:
+        """
+        Serve the song to all the clients, and remember which clients have it now. Clients that could not be served
+        it are left out, so the song is served to them again before it is played.
+
+        :return: Whether the song was served.
+        """
+        self.in_progress = song_path
+        try:
+            mtime = os.path.getmtime(song_path)
+            clients = frozenset(self.server.serve_music_file(song_path))
+        except OSError as e:
+            print(f"Could not serve {song_path}: {e}")
+            return False
+        finally:
+            self.in_progress = None
+        self.synced[song_path] = (mtime, clients)
+        return True
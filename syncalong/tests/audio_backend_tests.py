@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from syncalong.client.audio_backend import NullBackend, RecordingBackend, AudioBackendError, create_backend, NULL, \
+    RECORDING
+from syncalong.client.client import Client
+
+
+def test_null_backend_tracks_position():
+    backend = NullBackend()
+    with pytest.raises(AudioBackendError):
+        backend.play()
+    backend.load("song.wav")
+    backend.play(start=10)
+    assert backend.is_playing()
+    backend.pause()
+    paused_position = backend.position()
+    time.sleep(0.05)
+    assert not backend.is_playing()
+    assert backend.position() == paused_position
+    backend.unpause()
+    time.sleep(0.05)
+    assert 10.05 <= backend.position() < 10.5
+    backend.stop()
+    assert not backend.is_playing()
+
+
+def test_recording_backend_records_calls():
+    backend = create_backend(RECORDING)
+    backend.preload("song.wav")
+    backend.load("song.wav")
+    backend.play()
+    backend.stop()
+    assert [(method, argument) for _, method, argument in backend.calls] == \
+           [("preload", "song.wav"), ("load", "song.wav"), ("play", 0.0), ("stop", None)]
+    times = [call_time for call_time, _, _ in backend.calls]
+    assert times == sorted(times)
+
+
+def test_create_backend():
+    assert type(create_backend(NULL)) is NullBackend
+    with pytest.raises(ValueError):
+        create_backend("speakers")
+
+
+def test_client_plays_with_backend(tmp_path):
+    client = Client.__new__(Client)
+    client.audio = RecordingBackend()
+    client._handle_play(str(tmp_path / "song.wav"))
+    assert client.plaing_now == "song.wav"
+    assert [method for _, method, _ in client.audio.calls] == ["load", "play"]
+    assert client.audio.is_playing()
@@ -0,0 +1,77 @@
+import socket
+import time
+
+import mock
+import pytest
+
+from syncalong.client.clock_service import ClockService, MAX_DRIFT
+from syncalong.server.ntp_server import NTPServer, AsyncNTPServer
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_offset_of_minimum_delay_sample():
+    clock = ClockService('dummy.ntp.server', filter_size=3)
+    assert clock.offset == 0
+    assert clock.error == float("inf")
+
+    for offset, delay in [(0.5, 0.2), (0.1, 0.01), (0.3, 0.1)]:
+        clock.add_sample(offset, delay)
+    assert clock.offset == 0.1
+    assert 0.005 <= clock.error < 0.005 + MAX_DRIFT
+
+    # The best sample is pushed out of the filter by newer ones.
+    clock.add_sample(0.4, 0.3)
+    clock.add_sample(0.2, 0.05)
+    assert clock.offset == 0.2
+    assert clock.remote_time() == pytest.approx(time.time() + 0.2, abs=0.01)
+
+
+def test_reading_does_not_query_server():
+    clock = ClockService('dummy.ntp.server')
+    clock.add_sample(10, 0.01)
+    with mock.patch.object(clock.ntp_client, 'request') as request:
+        clock.now()
+        clock.offset
+        clock.error
+    request.assert_not_called()
+
+
+def test_samples_ntp_server():
+    port = free_udp_port()
+    ntp_server = NTPServer('127.0.0.1', port)
+    ntp_server.start()
+    clock = ClockService('127.0.0.1', port)
+    clock.start()
+    try:
+        assert clock.wait_synced(5)
+        # Both clocks are the same clock.
+        assert abs(clock.offset) < 0.01
+        assert clock.error < 0.01
+    finally:
+        clock.stop()
+        clock.join()
+        ntp_server.close()
+
+
+def test_unreachable_server():
+    clock = ClockService('127.0.0.1', free_udp_port())
+    assert not clock.sample()
+    assert not clock.synced.is_set()
+
+
+def test_kiss_of_death_slows_sampling():
+    server = AsyncNTPServer('127.0.0.1', 0, rate=0.1, burst=1)
+    server.start()
+    clock = ClockService('127.0.0.1', server.address[1], interval=1)
+    try:
+        assert clock.sample()
+        assert not clock.sample()
+        assert clock.interval == 2
+        assert len(clock.samples) == 1
+    finally:
+        server.close()
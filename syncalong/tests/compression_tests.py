@@ -0,0 +1,70 @@
+import asyncio
+import os
+
+import mock
+import pytest
+
+from syncalong.common import compression
+from syncalong.common.compression import ZLIB, ZSTD, choose_codec, compress_file, decompressor, is_compressible, \
+    supported_codecs
+from syncalong.server.compression_cache import CompressionCache
+
+
+@pytest.mark.parametrize("codec", supported_codecs())
+def test_compress_file_streams(tmp_path, codec):
+    source = tmp_path / "song.wav"
+    source.write_bytes(b"la la la " * 500000)
+    target = tmp_path / "song.wav.compressed"
+
+    size = compress_file(str(source), str(target), codec)
+
+    assert size == os.path.getsize(target) < os.path.getsize(source)
+    decompress = decompressor(codec)
+    compressed = target.read_bytes()
+    data = b"".join(decompress.decompress(compressed[i:i + 1000]) for i in range(0, len(compressed), 1000))
+    assert data + decompress.flush() == source.read_bytes()
+
+
+def test_choose_codec():
+    assert choose_codec([ZSTD, ZLIB]) == supported_codecs()[0]
+    assert choose_codec(["lzma", ZLIB]) == ZLIB
+    assert choose_codec([]) == ""
+    with mock.patch.object(compression, 'zstandard', None):
+        assert choose_codec([ZSTD, ZLIB]) == ZLIB
+
+
+def test_is_compressible():
+    assert is_compressible("Ring05.wav")
+    assert not is_compressible("song.MP3")
+
+
+def test_compression_cache_compresses_once(tmp_path):
+    song = tmp_path / "song.wav"
+    song.write_bytes(b"silence " * 100000)
+    loop = asyncio.new_event_loop()
+    cache = CompressionCache(str(tmp_path / "cache"), loop)
+
+    async def get_all():
+        return await asyncio.gather(*(cache.compressed_path(str(song), "hash", ZLIB) for _ in range(5)))
+
+    with mock.patch('syncalong.server.compression_cache.compress_file', wraps=compress_file) as compress:
+        paths = loop.run_until_complete(get_all())
+        paths.append(loop.run_until_complete(cache.compressed_path(str(song), "hash", ZLIB)))
+    loop.close()
+
+    assert compress.call_count == 1
+    assert set(paths) == {str(tmp_path / "cache" / f"hash.{ZLIB}")}
+
+
+def test_compression_cache_skips_incompressible(tmp_path):
+    noise = tmp_path / "noise.wav"
+    noise.write_bytes(os.urandom(100000))
+    song = tmp_path / "song.mp3"
+    song.write_bytes(b"silence " * 100000)
+    loop = asyncio.new_event_loop()
+    cache = CompressionCache(str(tmp_path / "cache"), loop)
+
+    assert loop.run_until_complete(cache.compressed_path(str(noise), "noise", ZLIB)) is None
+    assert loop.run_until_complete(cache.compressed_path(str(song), "song", ZLIB)) is None
+    assert loop.run_until_complete(cache.compressed_path(str(song), "song", "")) is None
+    loop.close()
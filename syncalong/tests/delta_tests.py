@@ -0,0 +1,82 @@
+import filecmp
+import os
+
+from syncalong.common.delta import COPY, DATA, MATCH_PROBE_SIZE, block_signatures, delta_block_size, delta_plan, \
+    pack_signatures, plan_literal_size, unpack_signatures
+from syncalong.client.audio_backend import NULL
+from syncalong.client.client import DELTA_SUFFIX
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
+from syncalong.server.music_server import MusicServer
+from tests.swarm_tests import start_clients, wait_for_song
+
+
+def apply_plan(old: bytes, new: bytes, plan) -> bytes:
+    return b"".join(old[offset:offset + count] if kind == COPY else new[offset:offset + count]
+                    for kind, offset, count in plan)
+
+
+def plan_for(tmp_path, old: bytes, new: bytes):
+    (tmp_path / "old.mp3").write_bytes(old)
+    (tmp_path / "new.mp3").write_bytes(new)
+    block_size = delta_block_size(len(old))
+    signatures = unpack_signatures(pack_signatures(block_signatures(str(tmp_path / "old.mp3"), block_size)))
+    return delta_plan(str(tmp_path / "new.mp3"), block_size, signatures)
+
+
+def test_retagged_file_sends_only_changes(tmp_path):
+    audio = os.urandom(2 * 1024 * 1024)
+    old = b"ID3" + b"\x00" * 500 + audio
+    new = b"ID3" + b"\x01" * 700 + audio[:1000000] + b"edited" + audio[1000006:]
+
+    plan = plan_for(tmp_path, old, new)
+    assert apply_plan(old, new, plan) == new
+    assert plan_literal_size(plan) < 4 * delta_block_size(len(old))
+    assert any(kind == DATA for kind, _, _ in plan)
+
+
+def test_identical_file_is_copied(tmp_path):
+    content = os.urandom(100 * 1024)
+    plan = plan_for(tmp_path, content, content)
+    assert apply_plan(content, content, plan) == content
+    assert plan_literal_size(plan) < delta_block_size(len(content))
+
+
+def test_unrelated_file_has_no_plan(tmp_path):
+    assert plan_for(tmp_path, os.urandom(100 * 1024), os.urandom(100 * 1024)) is None
+
+
+def test_large_prepended_block_is_found(tmp_path):
+    # Artwork larger than a probe window is prepended, so nothing matches at the start of the file.
+    old = os.urandom(2 * 1024 * 1024)
+    new = b"ID3" + os.urandom(MATCH_PROBE_SIZE + 1024) + old
+    plan = plan_for(tmp_path, old, new)
+    assert apply_plan(old, new, plan) == new
+    assert plan_literal_size(plan) < MATCH_PROBE_SIZE + 1027 + delta_block_size(len(old))
+
+
+def test_large_unrelated_file_has_no_plan(tmp_path):
+    assert plan_for(tmp_path, os.urandom(2 * 1024 * 1024), os.urandom(2 * 1024 * 1024)) is None
+
+
+def test_client_applies_delta(tmp_path):
+    audio = os.urandom(2 * 1024 * 1024)
+    song = tmp_path / "song.mp3"
+    song.write_bytes(b"ID3" + b"\x01" * 700 + audio)
+    repo = tmp_path / "client"
+    repo.mkdir()
+    (repo / song.name).write_bytes(b"ID3" + b"\x00" * 500 + audio)
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)))
+    server.start()
+    clients = start_clients(server, [repo], audio_backend=NULL)
+    try:
+        server.serve_music_file(str(song))
+        wait_for_song(clients, str(song))
+
+        assert filecmp.cmp(str(song), str(repo / song.name), shallow=False)
+        assert 0 < server.file_bytes_sent < 4 * delta_block_size(len(audio))
+        assert not [name for name in os.listdir(str(repo)) if name.endswith(DELTA_SUFFIX)]
+    finally:
+        for client, thread in clients:
+            client.stop_request.set()
+            thread.join()
+        server.close()
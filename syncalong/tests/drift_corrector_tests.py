@@ -0,0 +1,25 @@
+import pytest
+
+from syncalong.client.drift_corrector import DriftCorrector, choose_correction, NO_CORRECTION, NUDGE, SEEK
+
+
+@pytest.mark.parametrize("drift, correction", [(0, NO_CORRECTION), (0.02, NO_CORRECTION), (-0.02, NO_CORRECTION),
+                                               (0.1, NUDGE), (0.25, NUDGE), (0.3, SEEK), (-0.05, SEEK), (-3, SEEK)])
+def test_choose_correction(drift, correction):
+    assert choose_correction(drift) == correction
+
+
+def test_metrics():
+    corrector = DriftCorrector()
+    assert corrector.check(10, 10.01) == NO_CORRECTION
+    assert corrector.check(12, 12.1) == NUDGE
+    assert corrector.check(14, 13.5) == SEEK
+    corrector.failed_corrections += 1
+
+    stats = corrector.stats()
+    assert stats["heartbeats"] == 3
+    assert (stats["nudges"], stats["seeks"], stats["failed_corrections"]) == (1, 1, 1)
+    assert stats["last_drift"] == pytest.approx(-0.5)
+    assert stats["max_abs_drift"] == pytest.approx(0.5)
+    assert stats["mean_abs_drift"] == pytest.approx(0.61 / 3)
+    assert corrector.summary().startswith("3 heartbeats, 1 nudges, 1 seeks (1 failed)")
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+
+import mock
+import pytest
+
+from syncalong.common.general_packet import GeneralPacket
+from syncalong.common.length_socket import LengthSocket, RECV_BUFFER_SIZE, MAX_SEND_BUFFERS, build_packet
+from syncalong.common.signal_packet import SignalPacket
+
+
+@pytest.fixture
+def socket_pair():
+    listener = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sender = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
+    sender.connect(listener.getsockname())
+    receiver, _ = listener.accept()
+    receiver.settimeout(5)
+    listener.close()
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+def recv_all(sock: LengthSocket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        data += sock.recv(size - len(data))
+    return bytes(data)
+
+
+@pytest.mark.parametrize("offset, count", [(0, None), (1000, None), (1000, 5000)])
+def test_send_file(socket_pair, tmp_path, offset, count):
+    sender, receiver = socket_pair
+    content = os.urandom(100 * 1024)
+    song = tmp_path / "song.wav"
+    song.write_bytes(content)
+    expected = content[offset:offset + count] if count else content[offset:]
+
+    assert sender.send_file(str(song), offset, count) == len(expected)
+    assert recv_all(receiver, len(expected)) == expected
+
+
+def test_recv_parses_many_messages_from_one_read(socket_pair):
+    sender, receiver = socket_pair
+    messages = [os.urandom(size) for size in range(1, 200)]
+    sender.sendall(b"".join(len(message).to_bytes(4, 'big') + message for message in messages))
+
+    assert receiver.recv() == messages[0]
+    assert receiver.pending() > 0
+    assert [receiver.recv() for _ in messages[1:]] == messages[1:]
+    assert receiver.pending() == 0
+
+
+def test_recv_waits_for_split_messages(socket_pair):
+    sender, receiver = socket_pair
+    messages = [b"a" * 10, os.urandom(RECV_BUFFER_SIZE * 3), b"", b"tail"]
+    data = b"".join(len(message).to_bytes(4, 'big') + message for message in messages)
+
+    def send_slowly():
+        for start in range(0, 8):
+            sender.sendall(data[start:start + 1])
+            time.sleep(0.01)
+        sender.sendall(data[8:])
+
+    threading.Thread(target=send_slowly).start()
+    assert [receiver.recv() for _ in messages] == messages
+
+
+def test_raw_recv_returns_buffered_data_first(socket_pair):
+    sender, receiver = socket_pair
+    content = os.urandom(1000)
+    sender.send(b"\x00\x00\x00\x03abc" + content)
+    time.sleep(0.1)
+
+    assert receiver.recv() == b"abc"
+    assert recv_all(receiver, len(content)) == content
+
+
+def test_recv_raises_when_closed_mid_message(socket_pair):
+    sender, receiver = socket_pair
+    sender.send(b"\x00\x00\x00\x10abc")
+    sender.close()
+    with pytest.raises(ConnectionError):
+        receiver.recv()
+
+
+def test_async_recv(socket_pair):
+    sender, receiver = socket_pair
+    receiver.setblocking(False)
+    messages = [os.urandom(size) for size in (5, 0, RECV_BUFFER_SIZE + 1, 7)]
+    sender.sendall(b"hello" + b"".join(len(message).to_bytes(4, 'big') + message for message in messages))
+
+    async def recv_all_messages():
+        hello = await receiver.async_recv(loop, 5)
+        return hello, [await receiver.async_recv(loop) for _ in messages]
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(recv_all_messages()) == (b"hello", messages)
+    finally:
+        loop.close()
+
+
+def test_send_writes_length_and_packet_at_once(socket_pair):
+    sender, receiver = socket_pair
+    packet = SignalPacket(seq=1, music_file_name="Ring05.wav")
+    with mock.patch.object(sender, "sendmsg", wraps=sender.sendmsg) as sendmsg:
+        sent = sender.send(packet)
+
+    assert sendmsg.call_count == 1
+    data = receiver.recv()
+    assert sent == len(data) + 4
+    assert GeneralPacket(data)[SignalPacket] == packet
+
+
+def test_send_batch(socket_pair):
+    sender, receiver = socket_pair
+    packets = [SignalPacket(seq=seq, music_file_name=f"{seq}.wav") for seq in range(MAX_SEND_BUFFERS)]
+    with mock.patch.object(sender, "sendmsg", wraps=sender.sendmsg) as sendmsg:
+        sender.send_batch(packets)
+
+    # Every packet takes two buffers (its length and itself).
+    assert sendmsg.call_count == 2
+    assert [GeneralPacket(receiver.recv())[SignalPacket].seq for _ in packets] == list(range(MAX_SEND_BUFFERS))
+
+
+def test_async_send_batch(socket_pair):
+    sender, receiver = socket_pair
+    sender.setblocking(False)
+    packets = [SignalPacket(seq=seq) for seq in range(10)] + [b"\x00\x00\x00\x03abc"]
+
+    loop = asyncio.new_event_loop()
+    try:
+        sent = loop.run_until_complete(sender.async_send_batch(packets, loop))
+    finally:
+        loop.close()
+    assert [GeneralPacket(receiver.recv())[SignalPacket].seq for _ in range(10)] == list(range(10))
+    assert receiver.recv() == b"abc"
+    assert sent == sum(4 + len(build_packet(packet)) for packet in packets[:-1]) + len(packets[-1])
+
+
+def test_set_nodelay(socket_pair):
+    sender, _ = socket_pair
+    sender.set_nodelay()
+    assert sender.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
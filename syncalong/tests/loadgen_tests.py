@@ -0,0 +1,55 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
+from syncalong.main.loadgen_main import main, percentiles, load_remote_server
+from syncalong.server.music_server import MusicServer
+
+
+def test_percentiles():
+    assert percentiles([]) == {"count": 0}
+    stats = percentiles([float(value) for value in range(100, 0, -1)])
+    assert stats == {"count": 100, "p50": 51, "p90": 91, "p99": 100, "max": 100}
+
+
+def test_local_load(tmp_path):
+    report_path = tmp_path / "report.json"
+    result = main(["--clients", "20", "--file-size", "300000", "--signals", "2", "--json", str(report_path)])
+
+    assert (result["clients"], result["connected"], result["errors"]) == (20, 20, 0)
+    assert result["connect_time"]["count"] == 20
+    assert result["bytes_received"] == 20 * 300000
+    assert result["throughput"] > 0
+    assert result["signal_latency"]["PLAY"]["count"] == 40
+    assert json.loads(report_path.read_text()) == result
+
+
+def test_remote_server(tmp_path):
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)))
+    server.start()
+    song = tmp_path / "song.wav"
+    song.write_bytes(os.urandom(100000))
+    results = []
+    load = threading.Thread(target=lambda: results.append(
+        asyncio.run(load_remote_server(server.server_socket.getsockname(), 5, 2))))
+    load.start()
+    try:
+        deadline = time.time() + 5
+        while len(server.clients) < 5 and time.time() < deadline:
+            time.sleep(0.01)
+        server.serve_music_file(str(song))
+        # The clients remember the content they received, so nothing is sent the second time.
+        server.serve_music_file(str(song))
+        server.signal_stop_all()
+        load.join()
+    finally:
+        server.close()
+
+    result, = results
+    assert (result["connected"], result["errors"]) == (5, 0)
+    assert result["bytes_received"] == 5 * 100000
+    assert result["client_throughput"]["count"] == 5
+    assert result["signal_latency"]["STOP"]["count"] == 5
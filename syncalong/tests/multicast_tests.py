@@ -0,0 +1,192 @@
+import collections
+import filecmp
+import os
+import select
+import socket
+import threading
+import time
+
+import pytest
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from syncalong.client.audio_backend import NULL
+from syncalong.client.multicast_receiver import MulticastReceiver
+from syncalong.common.multicast import FEC_GROUP_SIZE, MULTICAST_BLOCK_SIZE, DATA_BLOCK, PARITY_BLOCK, \
+    DATAGRAM_HEADER, pack_datagram, pack_ranges, unpack_ranges, xor_blocks, multicast_sender_socket
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
+from syncalong.server.multicast_sender import MulticastSender
+from syncalong.server.music_server import MusicServer
+from tests.swarm_tests import start_clients
+
+SONG_SIZE = 1024 * 1024 + 123
+MULTICAST_GROUP = "239.255.20.58"
+
+
+class LossySender(MulticastSender):
+    """
+    A multicast sender that drops the data blocks whose index is in the given set, as if they were lost.
+    """
+    def __init__(self, sender: MulticastSender, lost_blocks):
+        super().__init__(sender.group, sender.port, sender.loop, sender.rate)
+        sender.close()
+        self.lost_blocks = set(lost_blocks)
+
+    async def _send_datagram(self, datagram: bytes):
+        _, index, kind = DATAGRAM_HEADER.unpack_from(datagram)
+        if kind == DATA_BLOCK and index in self.lost_blocks:
+            return
+        await super()._send_datagram(datagram)
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+def test_parity_recovers_a_single_block():
+    blocks = [os.urandom(MULTICAST_BLOCK_SIZE) for _ in range(3)] + [b"short"]
+    parity = xor_blocks(blocks, MULTICAST_BLOCK_SIZE)
+    assert xor_blocks(blocks[:2] + blocks[3:] + [parity], MULTICAST_BLOCK_SIZE) == blocks[2]
+    assert xor_blocks(blocks[:3] + [parity], MULTICAST_BLOCK_SIZE)[:5] == b"short"
+
+
+def test_pack_ranges():
+    ranges = [(0, 1400), (2800, 5600)]
+    assert unpack_ranges(pack_ranges(ranges)) == ranges
+
+
+@pytest.mark.parametrize("lost_blocks", [
+    [],
+    range(3, 700, FEC_GROUP_SIZE),
+    range(100, 140),
+])
+def test_multicast_file(tmp_path, lost_blocks):
+    song = tmp_path / "song.wav"
+    song.write_bytes(os.urandom(SONG_SIZE))
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)),
+                         multicast_group=(MULTICAST_GROUP, free_udp_port()), multicast_rate=64 * 1024 * 1024)
+    server.multicast_sender = LossySender(server.multicast_sender, lost_blocks)
+    server.start()
+    repos = [tmp_path / f"client{i}" for i in range(4)]
+    clients = start_clients(server, repos)
+    try:
+        server.serve_music_file(str(song))
+
+        lost_per_group = collections.Counter(index // FEC_GROUP_SIZE for index in lost_blocks)
+        repaired = MULTICAST_BLOCK_SIZE * sum(lost for lost in lost_per_group.values() if lost > 1) * len(repos)
+        assert server.file_bytes_sent <= SONG_SIZE * (1 + 1 / FEC_GROUP_SIZE) + MULTICAST_BLOCK_SIZE + repaired
+        for repo in repos:
+            assert filecmp.cmp(str(song), str(repo / song.name), shallow=False)
+    finally:
+        for client, thread in clients:
+            client.stop_request.set()
+            thread.join()
+        server.close()
+
+
+def test_multicast_while_playing(tmp_path):
+    # Heartbeats are sent while a song plays, and may come up in the middle of the multicast of another one.
+    song = tmp_path / "song.wav"
+    song.write_bytes(os.urandom(SONG_SIZE))
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)),
+                         multicast_group=(MULTICAST_GROUP, free_udp_port()), multicast_rate=2 * 1024 * 1024,
+                         heartbeat_interval=0.05)
+    server.multicast_sender = LossySender(server.multicast_sender, range(100, 140))
+    server.start()
+    repos = [tmp_path / f"client{i}" for i in range(2)]
+    clients = start_clients(server, repos, audio_backend=NULL)
+    try:
+        server.signal_play_all("playing.wav", wait_seconds=0)
+        server.serve_music_file(str(song))
+        time.sleep(0.3)
+
+        for (client, thread), repo in zip(clients, repos):
+            assert filecmp.cmp(str(song), str(repo / song.name), shallow=False)
+            assert thread.is_alive()
+            assert client.drift_corrector.heartbeats > 0
+    finally:
+        for client, thread in clients:
+            client.stop_request.set()
+            thread.join()
+        server.close()
+
+
+def test_signal_during_multicast(tmp_path):
+    song = tmp_path / "song.wav"
+    song.write_bytes(os.urandom(SONG_SIZE))
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)),
+                         multicast_group=(MULTICAST_GROUP, free_udp_port()), multicast_rate=2 * 1024 * 1024,
+                         heartbeat_interval=None)
+    server.multicast_sender = LossySender(server.multicast_sender, range(100, 140))
+    server.start()
+    repos = [tmp_path / f"client{i}" for i in range(2)]
+    clients = start_clients(server, repos, audio_backend=NULL)
+    signal = threading.Timer(0.2, server.signal_play_all, ("playing.wav", 0))
+    signal.start()
+    try:
+        server.serve_music_file(str(song))
+        signal.join()
+
+        for (client, thread), repo in zip(clients, repos):
+            assert filecmp.cmp(str(song), str(repo / song.name), shallow=False)
+            assert thread.is_alive()
+            assert client.plaing_now == "playing.wav"
+    finally:
+        for client, thread in clients:
+            client.stop_request.set()
+            thread.join()
+        server.close()
+
+
+def test_receiver_drops_short_datagrams(tmp_path):
+    file_hash = "ab" * 32
+    block = os.urandom(MULTICAST_BLOCK_SIZE)
+    port = free_udp_port()
+    with open(tmp_path / "song.wav", "w+b") as local_file, \
+            MulticastReceiver(local_file, MULTICAST_GROUP, port, "127.0.0.1", file_hash, len(block),
+                              MULTICAST_BLOCK_SIZE) as receiver, \
+            multicast_sender_socket() as sender:
+        sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton("127.0.0.1"))
+        sender.sendto(b"short", (MULTICAST_GROUP, port))
+        sender.sendto(pack_datagram(file_hash, DATA_BLOCK, 0, block), (MULTICAST_GROUP, port))
+        deadline = time.time() + 2
+        while receiver.missing_ranges() and time.time() < deadline:
+            select.select([receiver], [], [], 0.1)
+            receiver.receive_pending()
+
+        assert receiver.missing_ranges() == []
+        local_file.seek(0)
+        assert local_file.read() == block
+
+
+def test_receiver_drops_blocks_of_wrong_length(tmp_path):
+    file_hash = "ab" * 32
+    content = os.urandom(MULTICAST_BLOCK_SIZE + 100)
+    port = free_udp_port()
+    with open(tmp_path / "song.wav", "w+b") as local_file, \
+            MulticastReceiver(local_file, MULTICAST_GROUP, port, "127.0.0.1", file_hash, len(content),
+                              MULTICAST_BLOCK_SIZE) as receiver, \
+            multicast_sender_socket() as sender:
+        sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton("127.0.0.1"))
+        # A forged first block long enough to run over the second one, and a parity block too short for its group.
+        sender.sendto(pack_datagram(file_hash, DATA_BLOCK, 0, os.urandom(len(content))), (MULTICAST_GROUP, port))
+        sender.sendto(pack_datagram(file_hash, PARITY_BLOCK, 0, b"short"), (MULTICAST_GROUP, port))
+        sender.sendto(pack_datagram(file_hash, DATA_BLOCK, 1, content[MULTICAST_BLOCK_SIZE:]), (MULTICAST_GROUP, port))
+        deadline = time.time() + 2
+        while receiver.missing_ranges() != [(0, MULTICAST_BLOCK_SIZE)] and time.time() < deadline:
+            select.select([receiver], [], [], 0.1)
+            receiver.receive_pending()
+
+        assert receiver.missing_ranges() == [(0, MULTICAST_BLOCK_SIZE)]
+        assert receiver.parities == {}
+        sender.sendto(pack_datagram(file_hash, DATA_BLOCK, 0, content[:MULTICAST_BLOCK_SIZE]), (MULTICAST_GROUP, port))
+        deadline = time.time() + 2
+        while receiver.missing_ranges() and time.time() < deadline:
+            select.select([receiver], [], [], 0.1)
+            receiver.receive_pending()
+
+        assert receiver.missing_ranges() == []
+        local_file.seek(0)
+        assert local_file.read() == content
@@ -1,45 +1,77 @@
+import asyncio
 import os
+import socket
+import threading
 import time
+import zlib
+from typing import List
+
 import mock
+import pytest
 from datetime import datetime
-from syncalong.common.signal_packet import SignalPacket, PLAY_SIGNAL, DEFAULT_WAIT_SECONDS, STOP_SIGNAL
+from syncalong.client.audio_backend import NULL
+from syncalong.client.client import PARTIAL_SUFFIX
+from syncalong.common.compression import ZLIB
+from syncalong.common.file_sync_packet import FileSyncPacket, WHO_HAS, HAVE, MISSING, FILE_SEND, DELTA_DATA, \
+    FETCH, FILE_CHUNK_SIZE
+from syncalong.common.general_packet import GeneralPacket
+from syncalong.common.length_socket import LengthSocket
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME, file_hash
+from syncalong.common.signal_packet import SignalPacket, PLAY_SIGNAL, DEFAULT_WAIT_SECONDS, STOP_SIGNAL, \
+    PAUSE_SIGNAL, UNPAUSE_SIGNAL, POSITION_SIGNAL
+from syncalong.server.client_connection import ClientConnection
 from syncalong.server.music_server import MusicServer
+from tests.swarm_tests import start_clients, wait_for_song
 
 
-def call_counter(func):
-    def helper(*args, **kwargs):
-        helper.calls += 1
-        return func(*args, **kwargs)
+def connect_clients(server: MusicServer, count: int) -> List[LengthSocket]:
+    """
+    Connect the given amount of clients to the server, and wait until the server registered all of them.
+    """
+    clients = []
+    for _ in range(count):
+        client = LengthSocket(socket.AF_INET, socket.SOCK_STREAM)
+        client.connect(server.server_socket.getsockname())
+        client.send(b"hello")
+        clients.append(client)
+    deadline = time.time() + 5
+    while len(server.clients) < count and time.time() < deadline:
+        time.sleep(0.01)
+    return clients
 
-    helper.calls = 0
-    helper.__name__ = func.__name__
-    return helper
 
+def recv_packet(client: LengthSocket) -> GeneralPacket:
+    client.settimeout(5)
+    return GeneralPacket(client.recv())
 
-@mock.patch('server.music_server.LengthSocket')
-def test_accept_multiple_clients(mock_socket):
-    print("Mocking 2 clients")
-    accept_mock_values = [mock.Mock(), mock.Mock()]
 
-    @call_counter
-    def accept_side_effect():
-        if accept_side_effect.calls > 2:
-            time.sleep(1)
-        else:
-            return accept_mock_values[accept_side_effect.calls - 1], ('1.1.1.1', 11111)
+@pytest.fixture
+def tested_server(tmp_path):
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)))
+    server.start()
+    yield server
+    server.close()
 
-    mock_socket.return_value.accept.side_effect = accept_side_effect
 
-    tested_server = MusicServer('1.2.3.4', 12345)
-    tested_server.start()
-    tested_server.stop()
-    assert tested_server.clients == accept_mock_values
+def test_accept_multiple_clients(tested_server):
+    clients = connect_clients(tested_server, 50)
+    assert len(tested_server.clients) == 50
+    for client in clients:
+        client.close()
+
 
+def test_client_disconnect_is_dropped(tested_server):
+    clients = connect_clients(tested_server, 2)
+    clients[0].close()
+    deadline = time.time() + 5
+    while len(tested_server.clients) > 1 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(tested_server.clients) == 1
+    clients[1].close()
 
-@mock.patch('server.music_server.LengthSocket')
-def test_signal_play_all(_):
-    tested_server = MusicServer('1.2.3.4', 12345)
-    tested_server.clients = [mock.Mock() for _ in range(4)]
+
+def test_signal_play_all(tested_server):
+    clients = connect_clients(tested_server, 4)
     dummy_path = "C:\\bla.mp3"
     now = datetime.now()
     expected_message = SignalPacket(signal=PLAY_SIGNAL,
@@ -47,27 +79,225 @@ def test_signal_play_all(_):
                                     wait_seconds=DEFAULT_WAIT_SECONDS,
                                     music_file_name=os.path.basename(dummy_path))
 
-    with mock.patch('server.music_server.datetime') as mock_datetime:
+    with mock.patch('syncalong.server.music_server.datetime') as mock_datetime:
         mock_datetime.now.return_value = now
         tested_server.signal_play_all(dummy_path)
 
-    for mock_client in tested_server.clients:
-        mock_client.send.assert_called_once_with(expected_message)
+    for client in clients:
+        assert recv_packet(client)[SignalPacket] == expected_message
+        client.close()
 
 
-@mock.patch('server.music_server.LengthSocket')
-def test_signal_stop_all(_):
-    tested_server = MusicServer('1.2.3.4', 12345)
-    tested_server.clients = [mock.Mock() for _ in range(4)]
+def test_signal_stop_all(tested_server):
+    clients = connect_clients(tested_server, 4)
     now = datetime.now()
     expected_message = SignalPacket(signal=STOP_SIGNAL,
                                     send_timestamp=now.timestamp(),
                                     wait_seconds=DEFAULT_WAIT_SECONDS,
                                     music_file_name="")
 
-    with mock.patch('server.music_server.datetime') as mock_datetime:
+    with mock.patch('syncalong.server.music_server.datetime') as mock_datetime:
         mock_datetime.now.return_value = now
         tested_server.signal_stop_all()
 
-    for mock_client in tested_server.clients:
-        mock_client.send.assert_called_once_with(expected_message)
+    for client in clients:
+        assert recv_packet(client)[SignalPacket] == expected_message
+        client.close()
+
+
+def test_position_heartbeats(tmp_path):
+    tested_server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)),
+                                heartbeat_interval=0.1)
+    tested_server.start()
+    client, = connect_clients(tested_server, 1)
+    try:
+        tested_server._run(tested_server._send_signal(PLAY_SIGNAL, wait_seconds=0, music_file_name="song.mp3"))
+        assert recv_packet(client)[SignalPacket].signal == PLAY_SIGNAL
+        heartbeats = [recv_packet(client)[SignalPacket] for _ in range(3)]
+        assert all(heartbeat.signal == POSITION_SIGNAL and heartbeat.music_file_name == b"song.mp3"
+                   for heartbeat in heartbeats)
+        for heartbeat in heartbeats:
+            assert heartbeat.position == pytest.approx(heartbeat.send_timestamp - tested_server.play_start_time)
+        assert 0 < heartbeats[0].position < heartbeats[1].position < heartbeats[2].position
+    finally:
+        client.close()
+        tested_server.close()
+
+
+def test_track_playback(tested_server):
+    tested_server._track_playback(SignalPacket(signal=PLAY_SIGNAL, send_timestamp=100, wait_seconds=5,
+                                               music_file_name="song.mp3"))
+    assert (tested_server.playing_file, tested_server.play_start_time) == (b"song.mp3", 105)
+    tested_server._track_playback(SignalPacket(signal=PAUSE_SIGNAL, send_timestamp=120, wait_seconds=5))
+    assert tested_server.paused_position == 20
+    tested_server._track_playback(SignalPacket(signal=UNPAUSE_SIGNAL, send_timestamp=200, wait_seconds=5))
+    assert (tested_server.play_start_time, tested_server.paused_position) == (185, None)
+    tested_server._track_playback(SignalPacket(signal=STOP_SIGNAL, send_timestamp=300, wait_seconds=5))
+    assert tested_server.playing_file is None
+
+
+def test_query_file_existence_gathers_answers_until_timeout(tmp_path):
+    tested_server = MusicServer('127.0.0.1', 0, who_has_timeout=0.5,
+                                catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)))
+    tested_server.start()
+    missing_client, having_client, silent_client = connect_clients(tested_server, 3)
+    registered = list(tested_server.clients)
+    query = asyncio.run_coroutine_threadsafe(tested_server._query_file_existence(__file__), tested_server.loop)
+
+    file_name = os.path.basename(__file__)
+    for client, answer in [(missing_client, MISSING), (having_client, HAVE)]:
+        who_has = recv_packet(client)[FileSyncPacket]
+        assert who_has.message_type == WHO_HAS and who_has.file_name.decode() == file_name
+        client.send(FileSyncPacket(message_type=answer, file_name=file_name))
+
+    start = time.time()
+    answers, unanswered_clients = query.result(timeout=5)
+    assert time.time() - start < 1
+    assert {conn: answer.message_type for conn, answer in answers.items()} == {registered[0]: MISSING,
+                                                                                registered[1]: HAVE}
+    assert unanswered_clients == [registered[2]]
+
+    for client in (missing_client, having_client, silent_client):
+        client.close()
+    tested_server.close()
+
+
+def test_silent_fetching_client_is_dropped(tmp_path):
+    tested_server = MusicServer('127.0.0.1', 0, who_has_timeout=0.5, swarm=True,
+                                catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)))
+    tested_server.start()
+    song = tmp_path / "song.mp3"
+    song.write_bytes(os.urandom(1024))
+    seeder, fetcher = connect_clients(tested_server, 2)
+    registered = list(tested_server.clients)
+    serve = asyncio.run_coroutine_threadsafe(tested_server._serve_music_file(str(song)), tested_server.loop)
+    try:
+        for client, answer in [(seeder, HAVE), (fetcher, MISSING)]:
+            recv_packet(client)
+            client.send(FileSyncPacket(message_type=answer, file_name=song.name, peer_port=40000))
+        assert recv_packet(fetcher)[FileSyncPacket].message_type == FETCH
+
+        assert serve.result(timeout=5) == [registered[0]]
+        assert tested_server.clients == [registered[0]]
+    finally:
+        seeder.close()
+        fetcher.close()
+        tested_server.close()
+
+
+def recv_content(client: LengthSocket, size: int) -> bytes:
+    """
+    Receive the given amount of a file's content, sent in chunks that are each preceded by a DELTA_DATA packet.
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = recv_packet(client)[FileSyncPacket]
+        assert chunk.message_type == DELTA_DATA
+        end = len(data) + chunk.file_size
+        while len(data) < end:
+            data += client.recv(end - len(data))
+    return bytes(data)
+
+
+def recv_file(client: LengthSocket) -> bytes:
+    header = recv_packet(client)[FileSyncPacket]
+    assert header.message_type == FILE_SEND
+    return recv_content(client, header.file_size)
+
+
+def test_serve_music_file_to_missing_clients(tested_server, tmp_path):
+    song = tmp_path / "song.wav"
+    song.write_bytes(os.urandom(5 * FILE_CHUNK_SIZE + 123))
+    clients = connect_clients(tested_server, 3)
+    serve = threading.Thread(target=tested_server.serve_music_file, args=(str(song),))
+    serve.start()
+
+    for client, answer in zip(clients, [MISSING, HAVE, MISSING]):
+        who_has = recv_packet(client)[FileSyncPacket]
+        assert who_has.file_hash.decode() == file_hash(str(song))
+        client.send(FileSyncPacket(message_type=answer, file_name=song.name))
+    assert recv_file(clients[0]) == song.read_bytes()
+    assert recv_file(clients[2]) == song.read_bytes()
+    serve.join()
+
+    for client in clients:
+        client.close()
+
+
+def test_serve_music_file_resumes_from_offset(tested_server, tmp_path):
+    song = tmp_path / "song.wav"
+    song.write_bytes(os.urandom(3 * FILE_CHUNK_SIZE))
+    offset = FILE_CHUNK_SIZE + 17
+    client, = connect_clients(tested_server, 1)
+    serve = threading.Thread(target=tested_server.serve_music_file, args=(str(song),))
+    serve.start()
+
+    recv_packet(client)
+    client.send(FileSyncPacket(message_type=MISSING, file_name=song.name, offset=offset))
+    header = recv_packet(client)[FileSyncPacket]
+    assert header.message_type == FILE_SEND
+    assert header.offset == offset and header.file_size == len(song.read_bytes())
+    assert recv_content(client, header.file_size - offset) == song.read_bytes()[offset:]
+    serve.join()
+    client.close()
+
+
+def test_client_resumes_cut_transfer(tested_server, tmp_path):
+    song = tmp_path / "song.mp3"
+    song.write_bytes(os.urandom(5 * FILE_CHUNK_SIZE + 123))
+    cut = 2 * FILE_CHUNK_SIZE + 17
+    repo = tmp_path / "client"
+    send_file_locked = ClientConnection.send_file_locked
+
+    async def cut_send_file(connection, file_path, offset=0, count=None):
+        sent = await send_file_locked(connection, file_path, offset, cut)
+        connection.socket.shutdown(socket.SHUT_RDWR)
+        return sent
+
+    (client, thread), = start_clients(tested_server, [repo], audio_backend=NULL)
+    with mock.patch.object(ClientConnection, "send_file_locked", cut_send_file):
+        tested_server.serve_music_file(str(song))
+    thread.join(5)
+    assert not thread.is_alive()
+    deadline = time.time() + 5
+    while tested_server.clients and time.time() < deadline:
+        time.sleep(0.01)
+    partial_files = [name for name in os.listdir(str(repo)) if name.endswith(PARTIAL_SUFFIX)]
+    assert len(partial_files) == 1 and os.path.getsize(str(repo / partial_files[0])) == cut
+
+    sent_before = tested_server.file_bytes_sent
+    clients = start_clients(tested_server, [repo], audio_backend=NULL)
+    (client, thread), = clients
+    try:
+        tested_server.serve_music_file(str(song))
+        wait_for_song(clients, str(song))
+
+        assert tested_server.file_bytes_sent - sent_before == len(song.read_bytes()) - cut
+        assert client.catalog.find(file_hash(str(song))) == str(repo / song.name)
+        assert (repo / song.name).read_bytes() == song.read_bytes()
+        assert not [name for name in os.listdir(str(repo)) if name.endswith(PARTIAL_SUFFIX)]
+    finally:
+        client.stop_request.set()
+        thread.join()
+
+
+@pytest.mark.parametrize("song_name, expected_codec", [("song.wav", ZLIB), ("song.mp3", "")])
+def test_serve_music_file_compressed(tested_server, tmp_path, song_name, expected_codec):
+    song = tmp_path / song_name
+    song.write_bytes(b"silence " * (4 * FILE_CHUNK_SIZE))
+    client, = connect_clients(tested_server, 1)
+    serve = threading.Thread(target=tested_server.serve_music_file, args=(str(song),))
+    serve.start()
+
+    recv_packet(client)
+    client.send(FileSyncPacket(message_type=MISSING, file_name=song.name, codecs=ZLIB))
+    header = recv_packet(client)[FileSyncPacket]
+    assert header.codecs.decode() == expected_codec
+    content_size = header.content_size if expected_codec else header.file_size
+    data = recv_content(client, content_size)
+    if expected_codec:
+        assert content_size < header.file_size
+        data = zlib.decompress(data)
+    assert bytes(data) == song.read_bytes()
+    serve.join()
+    client.close()
@@ -0,0 +1,127 @@
+import socket
+import struct
+import time
+
+import ntplib
+import pytest
+
+from syncalong.server.ntp_server import NTPServer, AsyncNTPServer, NTPWorker, RateLimiter, NTP_PACKET, TIMESTAMP, \
+    TX_TIMESTAMP_OFFSET, ALLOW, KISS, DROP, LOCAL_STRATUM, PRECISION, system_to_ntp_time
+
+
+def ntp_request(tx_timestamp_high: int, tx_timestamp_low: int = 0) -> bytearray:
+    request = bytearray(NTP_PACKET.size)
+    request[0] = 0x23
+    TIMESTAMP.pack_into(request, TX_TIMESTAMP_OFFSET, tx_timestamp_high, tx_timestamp_low)
+    return request
+
+
+@pytest.fixture
+def ntp_server():
+    server = NTPServer('127.0.0.1', 0, workers=3)
+    server.start()
+    yield server
+    server.close()
+
+
+def test_answers_ntplib(ntp_server):
+    result = ntplib.NTPClient().request('127.0.0.1', port=ntp_server.address[1], timeout=2)
+    assert (result.version, result.mode, result.stratum) == (4, 4, LOCAL_STRATUM)
+    assert result.ref_id == int.from_bytes(b"LOCL", 'big')
+    assert result.precision == PRECISION < 0
+    assert 0 < result.root_dispersion < 0.001
+    assert result.recv_time <= result.tx_time
+    assert abs(result.offset) < 0.01
+
+
+def test_simulated_offset():
+    server = NTPServer('127.0.0.1', 0, workers=1, simulated_offset=1)
+    server.start()
+    try:
+        result = ntplib.NTPClient().request('127.0.0.1', port=server.address[1], timeout=2)
+        # The server answers with a transmit time 1 second after it received the request.
+        assert result.tx_time - result.recv_time == pytest.approx(1)
+        assert result.offset == pytest.approx(0.5, abs=0.1)
+    finally:
+        server.close()
+
+
+def test_kernel_receive_timestamp():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as ntp_socket, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        ntp_socket.bind(('127.0.0.1', 0))
+        worker = NTPWorker(ntp_socket)
+        if not worker.kernel_timestamps:
+            pytest.skip("The kernel doesn't timestamp received datagrams")
+        sent_at = system_to_ntp_time(time.time())
+        sock.sendto(ntp_request(1000), ntp_socket.getsockname())
+        time.sleep(0.2)
+        size, _, recv_timestamp = worker.receive()
+    assert size == NTP_PACKET.size
+    assert recv_timestamp == pytest.approx(sent_at, abs=0.05)
+
+
+def test_many_clients(ntp_server):
+    sockets = []
+    for i in range(20):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(2)
+        sock.sendto(ntp_request(1000 + i, i), ntp_server.address)
+        sockets.append(sock)
+    for i, sock in enumerate(sockets):
+        answer = sock.recv(1024)
+        assert len(answer) == NTP_PACKET.size
+        # The transmit time of the request is the originate time of the answer.
+        assert struct.unpack_from("!II", answer, 24) == (1000 + i, i)
+        sock.close()
+    assert ntp_server.requests == 20
+
+
+def test_short_request_is_dropped(ntp_server):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0.5)
+        sock.sendto(b"\x23" * 10, ntp_server.address)
+        with pytest.raises(socket.timeout):
+            sock.recv(1024)
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=1, burst=2)
+    assert [limiter.take("a", 0) for _ in range(4)] == [ALLOW, ALLOW, KISS, DROP]
+    assert limiter.take("b", 0) == ALLOW
+    assert limiter.take("a", 0.5) == DROP
+    assert limiter.take("a", 1) == ALLOW
+    assert limiter.take("a", 1) == KISS
+    assert limiter.take("a", 3) == ALLOW
+
+
+def test_rate_limiter_forgets_full_buckets():
+    limiter = RateLimiter(rate=1, burst=2, max_sources=3)
+    for source in "abc":
+        limiter.take(source, 0)
+    limiter.take("d", 10)
+    assert list(limiter.buckets) == ["d"]
+
+
+def test_async_server_rate_limits():
+    server = AsyncNTPServer('127.0.0.1', 0, rate=0.1, burst=2)
+    server.start()
+    try:
+        result = ntplib.NTPClient().request('127.0.0.1', port=server.address[1], timeout=2)
+        assert abs(result.offset) < 0.01
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(0.5)
+            for i in range(4):
+                sock.sendto(ntp_request(2000 + i), server.address)
+            sock.sendto(b"short", server.address)
+            answer = sock.recv(1024)
+            kiss = sock.recv(1024)
+            with pytest.raises(socket.timeout):
+                sock.recv(1024)
+        assert answer[1] == LOCAL_STRATUM
+        assert (kiss[1], kiss[12:16]) == (0, b"RATE")
+        assert struct.unpack_from("!II", kiss, 24) == (2001, 0)
+        assert server.counters() == {"served": 2, "dropped": 1, "rate_limited": 3, "kisses": 1}
+    finally:
+        server.close()
@@ -0,0 +1,61 @@
+import dataclasses
+
+import pytest
+
+from syncalong.common.file_sync_packet import FileSyncPacket, FILE_SEND, MISSING
+from syncalong.common.general_packet import GeneralPacket, handle_packet
+from syncalong.common.length_socket import build_packet
+from syncalong.common.signal_packet import SignalPacket, STOP_SIGNAL, POSITION_SIGNAL
+
+PACKETS = [
+    SignalPacket(),
+    SignalPacket(signal=STOP_SIGNAL, send_timestamp=1600000000.25, wait_seconds=3, seq=42,
+                 music_file_name="שיר.mp3"),
+    SignalPacket(signal=POSITION_SIGNAL, send_timestamp=1600000000.25, wait_seconds=0, position=83.125,
+                 music_file_name="song.mp3"),
+    FileSyncPacket(),
+    FileSyncPacket(message_type=FILE_SEND, file_size=1234567, file_name="Ring05.wav", file_hash="ab" * 32,
+                   offset=1000, block_size=2048, signatures=bytes(range(256)) * 3, peer_host="10.0.0.7",
+                   peer_port=40000, codecs="zstd,zlib", content_size=99999),
+]
+
+
+@pytest.mark.parametrize("packet", PACKETS)
+def test_round_trip(packet):
+    data = build_packet(packet)
+    assert GeneralPacket(data)[type(packet)] == packet
+    assert GeneralPacket(data).encode() == data
+
+
+@pytest.mark.parametrize("packet", PACKETS)
+def test_wire_format_matches_scapy(packet):
+    scapy_view = pytest.importorskip("syncalong.common.scapy_view")
+    data = build_packet(packet)
+    dissected = scapy_view.dissect(data)
+    assert scapy_view.build(dissected) == data
+    fields = {field.name: getattr(packet, field.name) for field in dataclasses.fields(packet)}
+    assert scapy_view.build(getattr(scapy_view, type(packet).__name__)(**fields)) == data
+
+
+def test_string_fields_are_bytes():
+    packet = FileSyncPacket(message_type=MISSING, file_name="song.wav", codecs="zlib")
+    assert packet.file_name == b"song.wav" and packet.codecs == b"zlib"
+    assert SignalPacket(music_file_name="song.mp3").music_file_name == b"song.mp3"
+
+
+def test_wrong_layer():
+    with pytest.raises(IndexError):
+        GeneralPacket(build_packet(SignalPacket()))[FileSyncPacket]
+
+
+@pytest.mark.parametrize("data", [b"", b"\x00\x00\x00\x07", build_packet(PACKETS[4])[:-1],
+                                  build_packet(PACKETS[1])[:-2]])
+def test_invalid_data(data):
+    with pytest.raises(ValueError):
+        GeneralPacket(data)
+
+
+def test_handle_packet():
+    handled = handle_packet(GeneralPacket(build_packet(PACKETS[1])), {SignalPacket: lambda pkt: pkt.seq,
+                                                                      FileSyncPacket: lambda pkt: None})
+    assert handled == 42
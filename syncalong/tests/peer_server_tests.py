@@ -0,0 +1,67 @@
+import os
+import socket
+import threading
+
+import mock
+import pytest
+
+from syncalong.client.peer_server import PeerServer
+from syncalong.common.file_sync_packet import FileSyncPacket, FETCH, FILE_SEND, MISSING
+from syncalong.common.general_packet import GeneralPacket
+from syncalong.common.length_socket import LengthSocket, build_packet, int_to_bytes
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME, file_hash
+
+
+@pytest.fixture
+def peer_server(tmp_path):
+    server = PeerServer(str(tmp_path), SongCatalog(str(tmp_path / CATALOG_FILE_NAME)), '127.0.0.1')
+    server.start()
+    yield server
+    server.stop()
+    server.join()
+
+
+def fetch(peer_server: PeerServer, request):
+    """
+    Send the request to the peer server, and receive its answer and the content that follows it, until it closes the
+    connection. The answer is None if the connection is closed without one.
+    """
+    with LengthSocket(socket.AF_INET, socket.SOCK_STREAM) as peer:
+        peer.settimeout(5)
+        peer.connect(('127.0.0.1', peer_server.port))
+        peer.send(request)
+        try:
+            answer = GeneralPacket(peer.recv())[FileSyncPacket]
+        except ConnectionError:
+            return None, b""
+        content = bytearray()
+        while True:
+            received = peer.recv(64 * 1024)
+            if not received:
+                return answer, bytes(content)
+            content += received
+
+
+def test_serve_from_offset(peer_server, tmp_path):
+    song = tmp_path / "song.mp3"
+    song.write_bytes(os.urandom(10000))
+    answer, content = fetch(peer_server, FileSyncPacket(message_type=FETCH, file_name=song.name,
+                                                        file_hash=file_hash(str(song)), offset=1000))
+    assert answer.message_type == FILE_SEND and answer.offset == 1000
+    assert content == song.read_bytes()[1000:]
+
+
+def test_offset_past_end_is_missing(peer_server, tmp_path):
+    song = tmp_path / "song.mp3"
+    song.write_bytes(os.urandom(10000))
+    answer, content = fetch(peer_server, FileSyncPacket(message_type=FETCH, file_name=song.name,
+                                                        file_hash=file_hash(str(song)), offset=20000))
+    assert answer.message_type == MISSING and content == b""
+
+
+@pytest.mark.parametrize("request_body", [b"", b"\x00\x00", b"\x00\x00\x00\x01" + b"\xff" * 32,
+                                          build_packet(FileSyncPacket(message_type=FETCH, file_name=b"\xff\xfe.mp3"))])
+def test_malformed_request_is_dropped(peer_server, request_body):
+    with mock.patch.object(threading, "excepthook") as excepthook:
+        assert fetch(peer_server, int_to_bytes(len(request_body)) + request_body) == (None, b"")
+    excepthook.assert_not_called()
@@ -0,0 +1,185 @@
+import filecmp
+import os
+import socket
+import threading
+import time
+
+import mock
+import pytest
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from syncalong.common.file_sync_packet import FileSyncPacket, FILE_SEND, MISSING
+from syncalong.common.signal_packet import SignalPacket, PAUSE_SIGNAL
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
+from syncalong.server.music_server import MusicServer
+from syncalong.server.prefetcher import Prefetcher
+from tests.music_server_tests import connect_clients, recv_packet
+from tests.swarm_tests import start_clients, wait_for_song
+
+
+@pytest.fixture
+def songs(tmp_path):
+    paths = []
+    for i in range(3):
+        song = tmp_path / f"song{i}.wav"
+        song.write_bytes(os.urandom(256 * 1024))
+        paths.append(str(song))
+    return paths
+
+
+def test_prefetch_next_songs(tmp_path, songs):
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)))
+    server.start()
+    repos = [tmp_path / f"client{i}" for i in range(2)]
+    clients = start_clients(server, repos)
+    prefetcher = Prefetcher(server, lookahead=2)
+    prefetcher.start()
+    try:
+        prefetcher.set_upcoming(songs)
+        deadline = time.time() + 10
+        while prefetcher.prefetched < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        for song in songs[:2]:
+            wait_for_song(clients, song)
+            for repo in repos:
+                assert filecmp.cmp(song, str(repo / os.path.basename(song)), shallow=False)
+
+        assert prefetcher.ensure(songs[0])
+        assert not prefetcher.ensure(songs[2])
+        assert prefetcher.hit_rate == 0.5
+        assert "1 hits, 1 misses (50% hit rate)" in prefetcher.summary()
+        wait_for_song(clients, songs[2])
+        for repo in repos:
+            assert filecmp.cmp(songs[2], str(repo / os.path.basename(songs[2])), shallow=False)
+    finally:
+        prefetcher.stop()
+        prefetcher.join()
+        for client, thread in clients:
+            client.stop_request.set()
+            thread.join()
+        server.close()
+
+
+def test_new_client_is_a_miss(tmp_path, songs):
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)))
+    server.start()
+    clients = start_clients(server, [tmp_path / "client0"])
+    prefetcher = Prefetcher(server)
+    try:
+        prefetcher.ensure(songs[0])
+        assert prefetcher.ensure(songs[0])
+        clients += start_clients(server, [tmp_path / "client1"])
+        deadline = time.time() + 5
+        while len(server.clients) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert not prefetcher.ensure(songs[0])
+        wait_for_song(clients, songs[0])
+        assert filecmp.cmp(songs[0], str(tmp_path / "client1" / os.path.basename(songs[0])), shallow=False)
+    finally:
+        for client, thread in clients:
+            client.stop_request.set()
+            thread.join()
+        server.close()
+
+
+def test_unserved_client_is_a_miss(tmp_path, songs):
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)), who_has_timeout=0.5)
+    server.start()
+    clients = start_clients(server, [tmp_path / "client0"])
+    # A client that never answers whether it has the song, so it is never served it.
+    silent, = connect_clients(server, 1)
+    deadline = time.time() + 5
+    while len(server.clients) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    prefetcher = Prefetcher(server)
+    try:
+        served = server.serve_music_file(songs[0])
+        assert [client.address for client in served] == [clients[0][0].socket.getsockname()]
+        assert not prefetcher.ensure(songs[1])
+        assert not prefetcher.ensure(songs[1])
+    finally:
+        silent.close()
+        for client, thread in clients:
+            client.stop_request.set()
+            thread.join()
+        server.close()
+
+
+def test_failed_prefetch_is_skipped(songs):
+    client = object()
+
+    def serve_music_file(song_path):
+        if song_path == songs[0]:
+            raise ValueError("Malformed answer")
+        return [client]
+
+    server = mock.Mock(clients=[client], serve_music_file=mock.Mock(side_effect=serve_music_file))
+    prefetcher = Prefetcher(server)
+    prefetcher.start()
+    try:
+        prefetcher.set_upcoming(songs[:2])
+        deadline = time.time() + 5
+        while prefetcher.prefetched < 1 and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert prefetcher.is_alive()
+        assert prefetcher.prefetched == 1
+        assert [call.args for call in server.serve_music_file.call_args_list] == [(songs[0],), (songs[1],)]
+        assert prefetcher.ensure(songs[1])
+    finally:
+        prefetcher.stop()
+        prefetcher.join()
+
+
+def test_signal_during_prefetch(tmp_path):
+    song = tmp_path / "song.mp3"
+    song.write_bytes(os.urandom(16 * 1024 * 1024))
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)),
+                         heartbeat_interval=None)
+    server.start()
+    client, = connect_clients(server, 1)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+    prefetcher = Prefetcher(server)
+    prefetcher.start()
+    try:
+        prefetcher.set_upcoming([str(song)])
+        recv_packet(client)
+        client.send(FileSyncPacket(message_type=MISSING, file_name=song.name))
+        header = recv_packet(client)[FileSyncPacket]
+        assert header.message_type == FILE_SEND
+
+        # The client reads the song slowly, so that it takes a few seconds to send.
+        received = []
+        reader = threading.Thread(target=slow_read, args=(client, header.file_size, received), daemon=True)
+        reader.start()
+        time.sleep(0.2)
+        start = time.time()
+        server.signal_pause_all()
+        assert time.time() - start < 0.5
+        reader.join(30)
+
+        signals = [(index, packet) for index, packet in enumerate(received) if isinstance(packet, SignalPacket)]
+        assert [packet.signal for _, packet in signals] == [PAUSE_SIGNAL]
+        content_before_signal = sum(packet.file_size for packet in received[:signals[0][0]])
+        assert content_before_signal < header.file_size
+    finally:
+        prefetcher.stop()
+        prefetcher.join()
+        client.close()
+        server.close()
+
+
+def slow_read(client, size: int, received: list):
+    """
+    Receive the content of a file sent in chunks, at about 8 MiB a second, keeping every packet received on the way.
+    """
+    while size > 0:
+        packet = recv_packet(client).payload
+        received.append(packet)
+        if isinstance(packet, FileSyncPacket):
+            left = packet.file_size
+            size -= left
+            while left > 0:
+                left -= len(client.recv(min(left, 64 * 1024)))
+                time.sleep(0.008)
@@ -0,0 +1,112 @@
+import os
+import socket
+import threading
+import time
+
+import mock
+import pytest
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from syncalong.client.audio_backend import AudioBackend
+from syncalong.client.client import Client
+from syncalong.client.drift_corrector import DriftCorrector
+from syncalong.common.general_packet import GeneralPacket
+from syncalong.common.multicast import multicast_receiver_socket
+from syncalong.common.signal_packet import SignalPacket, PLAY_SIGNAL, POSITION_SIGNAL
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
+from syncalong.server.music_server import MusicServer, SIGNAL_REDUNDANCY
+from tests.multicast_tests import free_udp_port, MULTICAST_GROUP
+from tests.music_server_tests import connect_clients, recv_packet
+
+
+def recv_datagrams(sock: socket.socket, count: int):
+    sock.settimeout(5)
+    return [GeneralPacket(sock.recv(1024))[SignalPacket] for _ in range(count)]
+
+
+@pytest.fixture
+def datagram_server(tmp_path):
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)),
+                         signal_datagrams=True)
+    server.start()
+    yield server
+    server.close()
+
+
+def test_signal_datagrams_to_every_client(datagram_server):
+    clients = connect_clients(datagram_server, 3)
+    signal_sockets = []
+    for client in clients:
+        signal_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        signal_socket.bind(client.getsockname())
+        signal_sockets.append(signal_socket)
+
+    datagram_server.signal_play_all("song.mp3")
+
+    for client, signal_socket in zip(clients, signal_sockets):
+        datagrams = recv_datagrams(signal_socket, SIGNAL_REDUNDANCY)
+        tcp_signal = recv_packet(client)[SignalPacket]
+        assert {datagram.seq for datagram in datagrams} == {tcp_signal.seq}
+        assert datagrams[0] == tcp_signal
+        assert tcp_signal.signal == PLAY_SIGNAL
+        signal_socket.close()
+        client.close()
+
+
+def test_signal_multicast(tmp_path):
+    signal_group = (MULTICAST_GROUP, free_udp_port())
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)),
+                         signal_group=signal_group)
+    server.start()
+    clients = connect_clients(server, 2)
+    group_socket = multicast_receiver_socket(*signal_group, "127.0.0.1")
+    group_socket.setblocking(True)
+    try:
+        server.signal_stop_all()
+        first = recv_datagrams(group_socket, SIGNAL_REDUNDANCY)
+        server.signal_stop_all()
+        second = recv_datagrams(group_socket, SIGNAL_REDUNDANCY)
+        assert len({datagram.seq for datagram in first}) == 1
+        assert {datagram.seq for datagram in second} == {first[0].seq + 1}
+    finally:
+        group_socket.close()
+        for client in clients:
+            client.close()
+        server.close()
+
+
+def test_client_handles_signal_once(datagram_server, tmp_path):
+    client = Client('127.0.0.1', datagram_server.server_socket.getsockname()[1], '127.0.0.1', str(tmp_path / "repo"))
+    with mock.patch('syncalong.client.timer.wait_until', return_value=0), \
+            mock.patch.object(Client, '_handle_play') as handle_play:
+        thread = threading.Thread(target=client.start, daemon=True)
+        thread.start()
+        try:
+            deadline = time.time() + 5
+            while not datagram_server.clients and time.time() < deadline:
+                time.sleep(0.01)
+            datagram_server.signal_play_all("song.mp3")
+            time.sleep(0.5)
+            handle_play.assert_called_once_with(os.path.join(str(tmp_path / "repo"), "song.mp3"))
+        finally:
+            client.stop_request.set()
+            thread.join()
+
+
+@pytest.mark.parametrize("position, expected_calls", [(40.1, ["pause", "unpause"]), (10, ["play"]), (40.01, [])])
+def test_client_corrects_drift(position, expected_calls):
+    # The heartbeat was sent 10 seconds ago at position 30, so the song should be at position 40.
+    client = Client.__new__(Client)
+    client.plaing_now = "song.mp3"
+    client.clock = mock.Mock(remote_time=lambda: 1000.0)
+    client.drift_corrector = DriftCorrector()
+    client.audio = mock.Mock(spec=AudioBackend)
+    client.audio.is_playing.return_value = True
+    client.audio.position.return_value = position
+    heartbeat = SignalPacket(signal=POSITION_SIGNAL, send_timestamp=990, position=30, music_file_name="song.mp3")
+    client._handle_position(heartbeat)
+
+    assert [call[0] for call in client.audio.method_calls if call[0] in ("pause", "unpause", "play")] == expected_calls
+    if expected_calls == ["play"]:
+        assert client.audio.play.call_args == mock.call(start=40)
@@ -0,0 +1,30 @@
+import json
+
+from syncalong.main.skew_main import main, skew_report
+
+
+def test_skew_report():
+    executions = [
+        [("PLAY", 100.0, 5.000, 0.001), ("STOP", 101.0, 6.000, 0.002)],
+        [("PLAY", 100.0, 5.003, 0.004), ("STOP", 101.0, 6.001, 0.001)],
+        [("PLAY", 100.0, 5.001, 0.002)],
+    ]
+    result = skew_report(executions, [0.0001, 0.0002, 0.0003])
+
+    assert (result["clients"], result["signals"], result["missed"]) == (3, 2, 1)
+    assert abs(result["max_spread"] - 0.003) < 1e-9
+    assert result["spread"]["PLAY"]["count"] == 1
+    assert abs(result["spread"]["STOP"]["max"] - 0.001) < 1e-9
+    assert result["lateness"]["PLAY"]["max"] == 0.004
+    assert result["clock_error"]["max"] == 0.0003
+
+
+def test_measure_skew(tmp_path):
+    report_path = tmp_path / "skew.json"
+    result = main(["--clients", "3", "--rounds", "1", "--json", str(report_path)])
+
+    assert (result["clients"], result["signals"], result["missed"]) == (3, 4, 0)
+    assert set(result["spread"]) == {"PLAY", "PAUSE", "UNPAUSE", "STOP"}
+    # The clients share a clock, so they execute every signal within milliseconds of each other.
+    assert result["max_spread"] < 0.05
+    assert json.loads(report_path.read_text()) == result
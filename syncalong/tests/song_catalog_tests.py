@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+
+import mock
+
+from syncalong.common import song_catalog
+from syncalong.common.file_sync_packet import who_has_answer_packet, HAVE, MISSING
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME
+
+
+def write_song(path, content: bytes) -> str:
+    path.write_bytes(content)
+    return hashlib.sha256(content).hexdigest()
+
+
+def test_hashes_are_cached_on_disk(tmp_path):
+    expected = {str(tmp_path / name): write_song(tmp_path / name, os.urandom(1000)) for name in ["a.wav", "b.wav"]}
+    cache_path = str(tmp_path / CATALOG_FILE_NAME)
+    assert SongCatalog(cache_path).scan(str(tmp_path)) == expected
+
+    with mock.patch.object(song_catalog, 'file_hash', side_effect=AssertionError("File was hashed again")):
+        assert SongCatalog(cache_path).scan(str(tmp_path)) == expected
+
+
+def test_changed_file_is_hashed_again(tmp_path):
+    song = tmp_path / "a.wav"
+    write_song(song, b"\x00" * 1000)
+    catalog = SongCatalog(str(tmp_path / CATALOG_FILE_NAME))
+    catalog.hash_of(str(song))
+
+    new_hash = write_song(song, b"\x01" * 1000)
+    os.utime(str(song), ns=(0, 1))
+    assert catalog.hash_of(str(song)) == new_hash
+
+
+def test_find_by_content(tmp_path):
+    content_hash = write_song(tmp_path / "a.wav", b"song")
+    catalog = SongCatalog(str(tmp_path / CATALOG_FILE_NAME))
+    catalog.scan(str(tmp_path))
+
+    assert catalog.find(content_hash) == str(tmp_path / "a.wav")
+    assert catalog.find(hashlib.sha256(b"other song").hexdigest()) is None
+
+
+def test_concurrent_saves(tmp_path):
+    songs = [tmp_path / f"{i}.wav" for i in range(16)]
+    hashes = [write_song(song, os.urandom(100)) for song in songs]
+    cache_path = str(tmp_path / CATALOG_FILE_NAME)
+    catalog = SongCatalog(cache_path)
+    errors = []
+
+    def add(song, content_hash):
+        try:
+            catalog.add(str(song), content_hash)
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add, args=args) for args in zip(songs, hashes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert all(SongCatalog(cache_path).find(content_hash) == str(song) for song, content_hash in zip(songs, hashes))
+    assert [name for name in os.listdir(str(tmp_path)) if name.startswith(".")] == [CATALOG_FILE_NAME]
+
+
+def test_who_has_answer_compares_content(tmp_path):
+    song = tmp_path / "a.wav"
+    write_song(song, b"\x00" * 1000)
+    catalog = SongCatalog(str(tmp_path / CATALOG_FILE_NAME))
+    same_size_hash = hashlib.sha256(b"\x01" * 1000).hexdigest()
+
+    assert who_has_answer_packet(str(song), 1000).message_type == HAVE
+    assert who_has_answer_packet(str(song), 1000, same_size_hash, catalog).message_type == MISSING
@@ -0,0 +1,26 @@
+import subprocess
+import sys
+
+import pytest
+
+# Dependencies that are slow to import, and needed only by some of the modes.
+HEAVY_MODULES = ("wx", "pygame", "scapy", "mutagen")
+REPORT_MODULES = f"print(sorted(name for name in {HEAVY_MODULES!r} if name in sys.modules))"
+
+
+def imported_heavy_modules(code):
+    result = subprocess.run([sys.executable, "-c", f"import sys\n{code}\n{REPORT_MODULES}"],
+                            stdout=subprocess.PIPE, text=True, check=True)
+    return result.stdout.splitlines()[-1]
+
+
+def test_common_modules_import_no_heavy_modules():
+    assert imported_heavy_modules("import syncalong.common.general_packet, syncalong.common.length_socket, "
+                                  "syncalong.common.song_catalog, syncalong.common.compression") == "[]"
+
+
+@pytest.mark.parametrize("mode", ["loadgen", "skew"])
+def test_headless_modes_import_no_heavy_modules(mode):
+    code = (f"import runpy\nsys.argv = ['syncalong', '{mode}', '--help']\n"
+            "try:\n    runpy.run_module('syncalong', run_name='__main__')\nexcept SystemExit:\n    pass")
+    assert imported_heavy_modules(code) == "[]"
@@ -0,0 +1,74 @@
+import filecmp
+import os
+import threading
+import time
+
+import pytest
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from syncalong.client.client import Client
+from syncalong.common.song_catalog import SongCatalog, CATALOG_FILE_NAME, file_hash
+from syncalong.server.music_server import MusicServer
+
+SONG_SIZE = 2 * 1024 * 1024
+
+
+def start_clients(server: MusicServer, repos, **client_args):
+    clients = []
+    for repo in repos:
+        client = Client('127.0.0.1', server.server_socket.getsockname()[1], '127.0.0.1', str(repo), **client_args)
+        thread = threading.Thread(target=client.start, daemon=True)
+        thread.start()
+        clients.append((client, thread))
+    deadline = time.time() + 5
+    while len(server.clients) < len(repos) and time.time() < deadline:
+        time.sleep(0.01)
+    return clients
+
+
+def wait_for_song(clients, song_path: str, timeout: float = 5):
+    """
+    Wait until all the given clients have the song in their catalog. A song sent directly by the server is still being
+    received when `serve_music_file` returns.
+    """
+    content_hash = file_hash(song_path)
+    deadline = time.time() + timeout
+    while any(client.catalog.find(content_hash) is None for client, _ in clients) and time.time() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("clients_count", [2, 4, 8, 16])
+def test_server_egress_is_flat(tmp_path, clients_count):
+    song = tmp_path / "song.wav"
+    song.write_bytes(os.urandom(SONG_SIZE))
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)))
+    server.start()
+    repos = [tmp_path / f"client{i}" for i in range(clients_count)]
+    clients = start_clients(server, repos, peer_port=0)
+    try:
+        server.serve_music_file(str(song))
+
+        assert server.file_bytes_sent == SONG_SIZE
+        for repo in repos:
+            assert filecmp.cmp(str(song), str(repo / song.name), shallow=False)
+    finally:
+        for client, thread in clients:
+            client.stop_request.set()
+            thread.join()
+        server.close()
+
+
+def test_peer_serving_is_opt_in(tmp_path):
+    server = MusicServer('127.0.0.1', 0, catalog=SongCatalog(str(tmp_path / CATALOG_FILE_NAME)))
+    server.start()
+    clients = start_clients(server, [tmp_path / "client0"]) + start_clients(server, [tmp_path / "client1"], peer_port=0)
+    try:
+        assert clients[0][0].peer_server is None
+        peer = clients[1][0]
+        assert peer.peer_server.listening_socket.getsockname()[0] == peer.socket.getsockname()[0]
+    finally:
+        for client, thread in clients:
+            client.stop_request.set()
+            thread.join()
+        server.close()
@@ -1,23 +1,26 @@
+import time
+
+import mock
 import pytest
 
 import syncalong.client.timer
 import datetime
 
-REMOTE_TIME_DIFF = datetime.timedelta(seconds=10)
-
+from syncalong.client.timer import PreciseScheduler, wait_until
 
-def stub_get_remote_time(*args, **kwargs):
-    return datetime.datetime.now() - REMOTE_TIME_DIFF
+REMOTE_TIME_DIFF = datetime.timedelta(seconds=10)
 
 
-syncalong.client.timer.get_remote_time = stub_get_remote_time
+class StubClock:
+    def remote_time(self):
+        return time.time() - REMOTE_TIME_DIFF.total_seconds()
 
 
 @pytest.mark.parametrize("expected_actual_wait_range, server_send_secs",
                          [
                              (
-                                     (datetime.timedelta(seconds=1, microseconds=500),
-                                      datetime.timedelta(seconds=2, microseconds=500)),
+                                     (datetime.timedelta(seconds=1, microseconds=995000),
+                                      datetime.timedelta(seconds=2, microseconds=5000)),
                                      1
                              ),
                              (
@@ -34,6 +37,37 @@ def test_wait_for_remote(expected_actual_wait_range, server_send_secs):
     remote_wait_seconds = 3
     remote_start_time = datetime.datetime.now() - (REMOTE_TIME_DIFF + datetime.timedelta(seconds=server_send_secs))
     start_milli_secs = datetime.datetime.now()
-    client.timer.wait_for_remote_time(remote_start_time, remote_wait_seconds, 'dummy.ntp.server')
+    syncalong.client.timer.wait_for_remote_time(remote_start_time, remote_wait_seconds, StubClock())
     end_milli_secs = datetime.datetime.now()
     assert expected_actual_wait_range[0] <= (end_milli_secs - start_milli_secs) <= expected_actual_wait_range[1]
+
+
+def test_wait_until_is_precise():
+    lateness = [wait_until(time.monotonic() + 0.02) for _ in range(20)]
+    assert all(0 <= late < 0.001 for late in lateness)
+    assert wait_until(time.monotonic() - 1) >= 1
+
+
+def test_wall_clock_jump_does_not_affect_wait():
+    deadline = time.time() + 0.1
+    start = time.monotonic()
+    with mock.patch.object(StubClock, 'remote_time', side_effect=[deadline - 0.1, deadline + 100]):
+        scheduler = PreciseScheduler(StubClock())
+        scheduler.run_at(deadline, lambda: None)
+    assert 0.1 <= time.monotonic() - start < 0.15
+
+
+def test_scheduler_reports_lateness():
+    scheduler = PreciseScheduler(StubClock())
+    actions = []
+    for i in range(5):
+        target = StubClock().remote_time() + 0.01
+        assert scheduler.run_at(target, lambda: actions.append(i) or i, "PLAY") == i
+    scheduler.run_at(StubClock().remote_time() - 0.5, lambda: None, "STOP")
+
+    assert actions == list(range(5))
+    assert scheduler.stats("PLAY")["count"] == 5
+    assert scheduler.stats("PLAY")["max"] < 0.001
+    assert scheduler.stats("STOP")["p50"] >= 0.5
+    assert scheduler.stats("PAUSE") == {"count": 0}
+    assert scheduler.summary().startswith("PLAY: 5 runs, late by ")